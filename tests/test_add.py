@@ -0,0 +1,62 @@
+import tempfile
+import shutil
+import os.path
+import os
+from unittest import TestCase
+from vc.api import PRepo
+from vc.impl import create_repo
+
+
+class AddTest(TestCase):
+    rootdir: str
+    repo: PRepo
+
+    def setUp(self):
+        self.rootdir = tempfile.mkdtemp(dir=tempfile.gettempdir())
+        os.chdir(self.rootdir)
+        self.repo = create_repo(self.rootdir, True)
+
+    def tearDown(self):
+        shutil.rmtree(self.rootdir)
+
+    def test_add_dirs(self):
+        self.create_file(".vcignore", "ignored.*\nbuild")
+        self.create_file("README.org", "abc")
+        self.create_file("build/out.o", "binary")
+        for i in range(100):
+            self.create_file(f"src/m{i % 7}/f{i}.py", f"print({i})")
+        self.create_file("src/ignored.txt", "not me")
+
+        self.repo.index.stage_files(["src", "README.org"], workers=2)
+        names = self.repo.index.dirtree().all_file_names()
+        self.assertEqual(101, len(names))
+        self.assertIn("README.org", names)
+        self.assertIn("src/m3/f10.py", names)
+        self.assertNotIn("src/ignored.txt", names)
+
+        serial = create_repo(self.rootdir)
+        keys = {e.ename: e.ehash for es in self.repo.index.dirtree().values() for e in es}
+        for name, key in keys.items():
+            with open(name, "rb") as f:
+                self.assertEqual(key, serial.db.calculate_key(f.read()))
+
+        st = self.repo.status()
+        self.assertEqual(101, len(st.staged))
+        self.assertEqual(0, len(st.not_staged))
+
+    def test_add_missing(self):
+        with self.assertRaises(FileNotFoundError):
+            self.repo.index.stage_files(["i dont exist"])
+
+    def create_file(self, rel_root: str, contents: str) -> str:
+        fn = self.rootdir + "/" + rel_root
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        with open(fn, "w") as f:
+            f.write(contents)
+            return fn
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
@@ -51,6 +51,100 @@ class CheckoutTest(TestCase):
         log = self.repo.log()
         self.assertEqual(c2, log[0].key)
 
+    def test_only_changes_are_written(self):
+        self.repo.init_repo()
+        os.makedirs(self.rootdir + "/src/old")
+        files = [self.create_file(f"src/f{i}.txt", f"v{i}") for i in range(20)]
+        files.append(self.create_file("src/old/gone.txt", "gone"))
+        self.repo.index.stage_files(files)
+        c1 = self.repo.index.commit("first commit")
+
+        self.create_file("src/f3.txt", "changed")
+        os.remove(files[-1])
+        os.makedirs(self.rootdir + "/src/new")
+        self.create_file("src/new/n.txt", "new")
+        self.repo.index.stage_files(["src"])
+        idx = self.repo.index.dirtree()
+        del idx["src/old"]
+        self.repo.index.set_to_dirtree(idx)
+        c2 = self.repo.index.commit("second commit")
+
+        res = self.repo.checkout(c1)
+        self.assertEqual((2, 1), (res.files_written, res.files_removed))
+        self.assertEqual(len("v3") + len("gone"), res.bytes_written)
+        self.assertFalse(os.path.exists(self.rootdir + "/src/new"))
+        with open(self.rootdir + "/src/old/gone.txt") as f:
+            self.assertEqual("gone", f.read())
+        st = self.repo.status()
+        self.assertEqual(([], [], []), (st.staged, st.not_staged, st.not_tracked))
+
+        os.makedirs(self.rootdir + "/src/new")
+        self.create_file("src/new/n.txt", "untracked")
+        with self.assertRaises(Exception):
+            self.repo.checkout(c2)
+        os.remove(self.rootdir + "/src/new/n.txt")
+        res = self.repo.checkout(c2)
+        self.assertEqual((2, 1), (res.files_written, res.files_removed))
+        self.assertEqual(sorted(os.listdir(self.rootdir + "/src"))[-2:], ["f9.txt", "new"])
+        self.assertEqual(0, self.repo.checkout(c2).files_written)
+
+    def test_staged_changes_are_kept(self):
+        self.repo.init_repo()
+        f1 = self.create_file("f1.txt", "v1")
+        f2 = self.create_file("f2.txt", "v2")
+        self.repo.index.stage_files([f1, f2])
+        c1 = self.repo.index.commit("first commit")
+        self.repo.create_branch("other")
+        self.create_file("f2.txt", "v2 changed")
+        self.repo.index.stage_file(f2)
+        c2 = self.repo.index.commit("second commit")
+
+        self.create_file("f1.txt", "v1 staged")
+        new = self.create_file("new.txt", "new")
+        self.repo.index.stage_files([f1, new])
+        self.repo.checkout("other")
+        self.repo.checkout(c2)
+        st = self.repo.status()
+        self.assertEqual(["f1.txt", "new.txt"], sorted(f.name for f in st.staged))
+        self.assertEqual(([], []), (st.not_staged, st.not_tracked))
+
+        self.create_file("f2.txt", "v2 staged")
+        self.repo.index.stage_file(f2)
+        with self.assertRaises(Exception):
+            self.repo.checkout(c1)
+        self.repo.create_branch("same")
+        self.repo.checkout("same")
+        with open(f2) as f:
+            self.assertEqual("v2 staged", f.read())
+        st = self.repo.status()
+        self.assertEqual(["f1.txt", "f2.txt", "new.txt"], sorted(f.name for f in st.staged))
+
+    def test_dir_becomes_file(self):
+        self.repo.init_repo()
+        os.makedirs(self.rootdir + "/x")
+        self.repo.index.stage_file(self.create_file("x/f", "in dir"))
+        c1 = self.repo.index.commit("x is a dir")
+        shutil.rmtree(self.rootdir + "/x")
+        idx = self.repo.index.dirtree()
+        del idx["x"]
+        self.repo.index.set_to_dirtree(idx)
+        self.repo.index.stage_file(self.create_file("x", "a file"))
+        c2 = self.repo.index.commit("x is a file")
+
+        self.repo.checkout(c1)
+        with open(self.rootdir + "/x/f") as f:
+            self.assertEqual("in dir", f.read())
+        self.repo.checkout(c2)
+        with open(self.rootdir + "/x") as f:
+            self.assertEqual("a file", f.read())
+        st = self.repo.status()
+        self.assertEqual(([], [], []), (st.staged, st.not_staged, st.not_tracked))
+
+        self.repo.checkout(c1)
+        self.create_file("x/untracked", "untracked")
+        with self.assertRaises(Exception):
+            self.repo.checkout(c2)
+
     def create_file(self, rel_root: str, contents: str) -> str:
         fn = self.rootdir + "/" + rel_root
         with open(fn, "w") as f:
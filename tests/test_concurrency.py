@@ -0,0 +1,102 @@
+import tempfile
+import shutil
+import os
+import multiprocessing
+from unittest import TestCase
+from unittest.mock import patch
+from vc.api import PRepo
+from vc.impl import create_repo
+from vc.impl.lockfile import LockError, LockFile
+from vc.impl.refs import HEADS, RefConflictError, branch_head, head_advance, update_ref
+
+WRITERS = 8
+COMMITS = 5
+
+
+def _commit_files(root: str, writer: int) -> None:
+    """Stage and commit COMMITS files, one at a time, in the repo at root."""
+    os.chdir(root)
+    repo = create_repo(root)
+    for i in range(COMMITS):
+        fn = f"w{writer}_{i}.txt"
+        with open(fn, "w") as f:
+            f.write(f"{writer} {i}\n")
+        repo.index.stage_files([fn])
+        repo.index.commit(f"w{writer} c{i}")
+
+
+class ConcurrencyTest(TestCase):
+    rootdir: str
+    repo: PRepo
+
+    def setUp(self):
+        self.rootdir = tempfile.mkdtemp(dir=tempfile.gettempdir())
+        os.chdir(self.rootdir)
+        self.repo = create_repo(self.rootdir, True)
+        self.repo.init_repo()
+
+    def tearDown(self):
+        shutil.rmtree(self.rootdir)
+
+    def test_concurrent_commits(self):
+        ctx = multiprocessing.get_context("fork")
+        writers = [
+            ctx.Process(target=_commit_files, args=(self.rootdir, w)) for w in range(WRITERS)
+        ]
+        for p in writers:
+            p.start()
+        for p in writers:
+            p.join()
+        self.assertEqual([0] * WRITERS, [p.exitcode for p in writers])
+
+        # No commit was lost: they are all in a single line of history
+        log = self.repo.log()
+        expected = {f"w{w} c{i}" for w in range(WRITERS) for i in range(COMMITS)}
+        self.assertEqual(expected, {e.comment for e in log})
+        self.assertEqual(WRITERS * COMMITS, len(log))
+        # Nor a staged file, and the last commit has them all
+        st = self.repo.status()
+        self.assertEqual(([], [], []), (st.staged, st.not_staged, st.not_tracked))
+        self.assertEqual(WRITERS * COMMITS, len(self.repo.index.dirtree().all_file_names()))
+        self.assertEqual(["master"], os.listdir(self.rootdir + "/.vc/refs/heads"))  # No locks
+
+    def test_commit_fails_when_head_moves(self):
+        root = self.rootdir + "/.vc"
+        with open("f.txt", "w") as f:
+            f.write("v1\n")
+        self.repo.index.stage_files(["f.txt"])
+        self.repo.index.commit("first")
+
+        def moved_meanwhile(root: str, commit_id: str, old: str) -> None:
+            update_ref(root, HEADS + "master", "1" * 40)
+            head_advance(root, commit_id, old)
+
+        with open("f.txt", "w") as f:
+            f.write("v2\n")
+        self.repo.index.stage_files(["f.txt"])
+        with patch("vc.impl.index.head_advance", side_effect=moved_meanwhile):
+            with self.assertRaises(RefConflictError):
+                self.repo.index.commit("second")
+        self.assertEqual("1" * 40, branch_head(root, "master"))
+        self.assertFalse(os.path.exists(root + "/index.lock"))
+
+    def test_update_ref(self):
+        root = self.rootdir + "/.vc"
+        update_ref(root, HEADS + "b", "1" * 40, "")
+        update_ref(root, HEADS + "b", "2" * 40, "1" * 40)
+        with self.assertRaises(RefConflictError):
+            update_ref(root, HEADS + "b", "3" * 40, "1" * 40)
+        self.assertEqual("2" * 40, branch_head(root, "b"))
+        self.assertEqual(0, os.stat(root + "/" + HEADS + "b").st_mode & 0o111)
+
+        with LockFile(root + "/" + HEADS + "b"):
+            with self.assertRaises(LockError):
+                LockFile(root + "/" + HEADS + "b", timeout=0.05).acquire()
+        update_ref(root, HEADS + "b", "3" * 40)
+        self.assertEqual("3" * 40, branch_head(root, "b"))
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
@@ -0,0 +1,145 @@
+import sys
+import socket
+import tempfile
+import shutil
+import subprocess
+import os
+from typing import Dict, List, Tuple
+from unittest import TestCase, skipIf
+from vc.api import PRepo
+from vc.impl import create_repo
+from vc.cli import daemon
+
+PKG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Runs the command in the daemon only, exiting with 100 if it wasn't
+CLIENT = "import sys; from vc.cli.daemon import forward; c = forward(sys.argv)\n"
+CLIENT += "sys.exit(100 if c is None else c)"
+
+
+def _vc(cwd: str, args: List[str], in_daemon: bool) -> Tuple[int, str, str]:
+    """Run vc with args in cwd, in the daemon or not, returning its exit code and output."""
+    env = dict(os.environ, PYTHONPATH=PKG_DIR)
+    if in_daemon:
+        cmd = [sys.executable, "-c", CLIENT] + args
+    else:
+        cmd = [sys.executable, "-m", "vc"] + args
+        env[daemon.NO_DAEMON_ENV] = "1"
+    res = subprocess.run(cmd, cwd=cwd, env=env, capture_output=True, text=True)
+    return res.returncode, res.stdout, res.stderr
+
+
+def _open_fds() -> int:
+    """Return how many files this process has open (0 if it can't be known)."""
+    return len(os.listdir("/proc/self/fd")) if os.path.isdir("/proc/self/fd") else 0
+
+
+@skipIf(sys.platform == "win32", "The daemon listens on a Unix socket")
+class DaemonTest(TestCase):
+    rootdir: str
+    repo: PRepo
+
+    def setUp(self):
+        self.rootdir = tempfile.mkdtemp(dir=tempfile.gettempdir())
+        os.chdir(self.rootdir)
+        self.repo = create_repo(self.rootdir, True)
+        self.repo.init_repo()
+        self.root = self.rootdir + "/.vc"
+        os.makedirs("src")
+        for i in range(5):
+            self.write(f"src/f{i}.txt", f"v{i}\n")
+        self.repo.index.stage_files(["src"])
+        self.repo.index.commit("Initial import")
+        self.assertTrue(daemon.start(self.root))
+
+    def tearDown(self):
+        daemon.stop(self.root)
+        shutil.rmtree(self.rootdir)
+
+    def write(self, name: str, contents: str) -> None:
+        with open(name, "w") as f:
+            f.write(contents)
+
+    def assertSameOutput(self, args: List[str], cwd: str = "") -> None:
+        cwd = cwd or self.rootdir
+        in_daemon = _vc(cwd, args, True)
+        self.assertNotEqual(100, in_daemon[0], "Not run in the daemon")
+        self.assertEqual(_vc(cwd, args, False), in_daemon)
+
+    def test_commands(self):
+        self.write("src/f1.txt", "v1\nchanged\n")
+        self.write("new.txt", "new\n")
+        self.assertSameOutput(["status"])
+        self.assertSameOutput(["status"], self.rootdir + "/src")
+        self.assertSameOutput(["diff"])
+        self.assertSameOutput(["log", "--oneline", "--", "src"])
+        self.assertSameOutput(["checkout", "no-such-branch"])
+        self.assertSameOutput(["no-such-command"])
+        self.assertEqual(100, _vc(self.rootdir, ["daemon", "stop"], True)[0])
+
+        self.assertEqual(0, _vc(self.rootdir, ["add", "new.txt"], True)[0])
+        self.assertEqual(0, _vc(self.rootdir, ["commit", "-m", "In the daemon"], True)[0])
+        self.assertEqual("In the daemon", self.repo.log()[0].comment)
+
+    def test_changes_by_others(self):
+        self.assertSameOutput(["status"])  # The daemon has read the repo
+        self.assertSameOutput(["log"])
+
+        c1 = self.repo.log()[0].key
+        self.write("src/f2.txt", "v2\nchanged\n")
+        self.repo.index.stage_file("src/f2.txt")
+        self.assertSameOutput(["status"])
+        c2 = self.repo.index.commit("Second")
+        self.assertSameOutput(["log"])
+        self.assertSameOutput(["cat-file", "-p", c2[:8]])
+
+        self.repo.create_branch("topic")
+        self.repo.pack_refs()
+        self.assertSameOutput(["branch"])
+        self.repo.repack(all_objects=True)
+        self.assertSameOutput(["cat-file", "-p", c2])
+        self.assertSameOutput(["diff", c1[:8], c2[:8]])
+
+        self.repo.checkout("topic")
+        self.write("src/f3.txt", "v3\nchanged\n")
+        self.assertSameOutput(["status"])
+
+    def test_client_gone(self):
+        self.write("src/f1.txt", "v1\nchanged\n")
+        frames = [(daemon._ARG, b"vc"), (daemon._ARG, b"diff")]
+        frames.append((daemon._CWD, os.fsencode(self.rootdir)))
+        frames.extend((daemon._ENV, k + b"=" + v) for k, v in os.environb.items())
+        request: Dict[bytes, List[bytes]] = {}
+        for kind, data in frames:
+            request.setdefault(kind, []).append(data)
+
+        # Run here, to check that nothing is left open by the command
+        server = daemon.Server(self.root)
+        stdout, fds = sys.stdout, _open_fds()
+        for _ in range(20):
+            conn, client = socket.socketpair()
+            client.close()
+            with conn:
+                self.assertEqual(0, server.run(conn, request))
+        self.assertIs(stdout, sys.stdout)
+        self.assertEqual(fds, _open_fds())
+
+        # The daemon keeps running commands after their clients are gone
+        frames.append((daemon._RUN, b""))
+        for _ in range(5):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                s.connect(self.root + "/" + daemon.SOCKET_FILE)
+                s.sendall(b"".join(daemon._FRAME.pack(k, len(d)) + d for k, d in frames))
+        self.assertTrue(daemon.is_running(self.root))
+        self.assertSameOutput(["diff"])
+
+    def test_stop(self):
+        self.assertTrue(daemon.stop(self.root))
+        self.assertFalse(os.path.exists(self.root + "/" + daemon.SOCKET_FILE))
+        self.assertEqual(100, _vc(self.rootdir, ["status"], True)[0])
+        self.assertFalse(daemon.stop(self.root))
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
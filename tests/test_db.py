@@ -1,9 +1,18 @@
 import tempfile
 import shutil
+import glob
+import io
+import os
+import os.path
+import tracemalloc
+import zlib
+from unittest.mock import patch
 import unittest
 from unittest import TestCase
-from vc.api import PObjectDB
+from vc.api import PObjectDB, AmbiguousKeyError, DBObjectType
+from vc.impl.cache import CachedDB
 from vc.impl.db import DB
+from vc.impl.delta import create_delta, apply_delta
 from vc.impl.fs import create_vc_root_dir
 
 
@@ -58,6 +67,121 @@ class DBTest(TestCase):
         rkey = db.get_full_key(key[:6])
         self.assertEqual(key, rkey)
 
+    def test_key_lookup(self):
+        db = self.db
+        key = db.put("abc")
+        with patch("os.listdir", side_effect=AssertionError("listing")):
+            self.assertEqual("abc", db.get(key).text)
+            self.assertEqual(key, db.get_full_key(key))
+        self.assertEqual(key, db.get_full_key(key[:4]))
+
+        os.makedirs(self.root + "/objects/ab")
+        for k in ["abcd" + "0" * 36, "abcd" + "1" * 36]:
+            with open(self.root + "/objects/ab/" + k[2:], "wb") as f:
+                f.write(zlib.compress(b"blob 0\0"))
+        with self.assertRaises(AmbiguousKeyError):
+            db.get_full_key("abcd")
+        self.assertEqual("abcd" + "1" * 36, db.get_full_key("abcd1"))
+        with self.assertRaises(FileNotFoundError):
+            db.get_full_key("abcd2")
+
+        # Objects written after the keys have been listed are also found
+        key2 = DB(self.root).put("def")
+        self.assertEqual(key2, db.get_full_key(key2[:5]))
+
+    def test_cache(self):
+        cdb = CachedDB(self.db, {DBObjectType.BLOB: 3000, DBObjectType.TREE: 3000})
+        tree = cdb.put("f " + "0" * 40 + " a.txt\n", DBObjectType.TREE)
+        blobs = [cdb.put(f"{i:0500}") for i in range(10)]
+        self.assertEqual(DBObjectType.TREE, cdb.get(tree).type)
+        for b in blobs:
+            cdb.get(b)
+        self.assertIs(cdb.get(tree), cdb.get(tree[:6]))
+        stats = cdb.stats()
+        self.assertEqual(2, stats[DBObjectType.TREE].hits)
+        self.assertEqual(1, stats[DBObjectType.TREE].misses)
+        self.assertEqual(10, stats[DBObjectType.BLOB].misses)
+        self.assertGreater(stats[DBObjectType.BLOB].evictions, 0)
+        self.assertLessEqual(stats[DBObjectType.BLOB].size, 3000)
+
+        parsed = cdb.parsed(tree, "lines", lambda ob: ob.text.splitlines())
+        self.assertIs(parsed, cdb.parsed(tree, "lines", lambda ob: []))
+
+    def test_put_stream(self):
+        db = self.db
+        content = b"".join(b"%d some streamed line\n" % i for i in range(200000))
+        with open(self.root + "/big", "wb") as f:
+            f.write(content)
+        del content
+        size = os.path.getsize(self.root + "/big")
+        tracemalloc.start()
+        with open(self.root + "/big", "rb") as f:
+            key = db.put_stream(f, size)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.assertLess(peak, size / 2)
+        with open(self.root + "/big", "rb") as f:
+            self.assertEqual(key, db.calculate_key_stream(f, size))
+            f.seek(0)
+            content = f.read()
+        self.assertEqual(db.put(content), key)
+        self.assertEqual(content, db.get(key).contents)
+        self.assertEqual([], glob.glob(self.root + "/objects/tmp*"))
+
+        with self.assertRaises(ValueError):
+            db.put_stream(io.BytesIO(b"short"), 10)
+        self.assertEqual([], glob.glob(self.root + "/objects/tmp*"))
+
+    def test_repack(self):
+        db = self.db
+        keys = [db.put(f"content {i}") for i in range(20)]
+        self.assertEqual(20, db.repack())
+        self.assertEqual(0, db.repack())
+        self.assertEqual([], glob.glob(self.root + "/objects/[0-9a-f][0-9a-f]"))
+        for i, k in enumerate(keys):
+            self.assertEqual(f"content {i}", db.get(k).text)
+            self.assertEqual(k, db.get_full_key(k[:6]))
+
+        # Objects from a fresh DB are found in the pack, and new ones stay loose
+        db = DB(self.root)
+        self.assertEqual("content 3", db.get(keys[3]).text)
+        self.assertEqual(keys[3], db.put("content 3"))
+        k = db.put("loose")
+        self.assertEqual("loose", db.get(k).text)
+        self.assertEqual(1, db.repack())
+        self.assertEqual("loose", db.get(k).text)
+        self.assertEqual("content 5", db.get(keys[5]).text)
+
+    def test_delta(self):
+        base = b"".join(b"line number %d of the base\n" % i for i in range(500))
+        target = base.replace(b"number 250 ", b"NUMBER 250 ") + b"a last line"
+        delta = create_delta(base, target)
+        self.assertLess(len(delta), len(target) // 10)
+        self.assertEqual(target, apply_delta(base, delta))
+        self.assertEqual(b"", apply_delta(base, create_delta(base, b"")))
+        self.assertEqual(base, apply_delta(b"", create_delta(b"", base)))
+
+    def test_repack_with_deltas(self):
+        db = self.db
+        lines = [f"line {i} of a file with some revisions\n" for i in range(1000)]
+        keys = []
+        for rev in range(30):
+            lines[rev * 7] = f"line changed in revision {rev}\n"
+            keys.append(db.put("".join(lines)))
+        hints = {k: "file.txt" for k in keys}
+        loose_size = sum(os.path.getsize(p) for p in glob.glob(self.root + "/objects/*/*"))
+        db.repack(hints=hints)
+        self.assertEqual(30, db.repack(all_objects=True, hints=hints))
+        packs = glob.glob(self.root + "/objects/pack/*.pack")
+        self.assertEqual(1, len(packs))
+        self.assertLess(os.path.getsize(packs[0]), loose_size / 5)
+
+        content = "".join(lines)
+        self.assertEqual(content, DB(self.root).get(keys[-1]).text)
+        fresh = DB(self.root)
+        for k in reversed(keys):
+            self.assertEqual(k, fresh.calculate_key(fresh.get(k).contents))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,195 @@
+import tempfile
+import shutil
+import os
+import random
+from unittest import TestCase, mock
+from vc.api import PRepo, FileStatus
+from vc.impl import create_repo
+from vc.impl.linediff import diff_lines, unified_diff
+from vc.impl.treediff import build_trees, diff_trees
+
+
+class DiffTest(TestCase):
+    rootdir: str
+    repo: PRepo
+
+    def setUp(self):
+        self.rootdir = tempfile.mkdtemp(dir=tempfile.gettempdir())
+        os.chdir(self.rootdir)
+        self.repo = create_repo(self.rootdir, True)
+        self.repo.init_repo()
+
+    def tearDown(self):
+        shutil.rmtree(self.rootdir)
+
+    def test_diff_trees(self):
+        files = {
+            f"d{i}/s{j}/f.txt": f"k{i}{j}".ljust(40, "0") for i in range(5) for j in range(5)
+        }
+        trees = {}
+
+        def tree(files):
+            key, ts = build_trees(files.items(), lambda ob: str(hash(ob)))
+            trees.update(ts)
+            return key
+
+        read = []
+
+        def reader(key):
+            read.append(key)
+            return trees[key]
+
+        old = tree(files)
+        self.assertEqual([], list(diff_trees(reader, old, old)))
+        self.assertEqual([], read)
+
+        changed = dict(files)
+        changed["d2/s3/f.txt"] = "new".ljust(40, "0")
+        changed["d4/s0/g.txt"] = "g".ljust(40, "0")
+        del changed["d0/s0/f.txt"]
+        del changed["d1/s1/f.txt"]
+        changed["d1/s1"] = "file".ljust(40, "0")  # Directory replaced by a file
+        changes = list(diff_trees(reader, old, tree(changed)))
+        self.assertEqual(
+            [
+                ("d0/s0/f.txt", FileStatus.DELETED),
+                ("d1/s1", FileStatus.NEW),
+                ("d1/s1/f.txt", FileStatus.DELETED),
+                ("d2/s3/f.txt", FileStatus.MODIFIED),
+                ("d4/s0/g.txt", FileStatus.NEW),
+            ],
+            [(c.path, c.status) for c in changes],
+        )
+        self.assertEqual(16, len(read))  # Only the changed trees, not all 62
+
+        changes = diff_trees(reader, old, tree(changed), ["d2", "d4/s0/g.txt"])
+        self.assertEqual(["d2/s3/f.txt", "d4/s0/g.txt"], [c.path for c in changes])
+        changes = diff_trees(reader, None, old, ["d3/s1"])
+        self.assertEqual(["d3/s1/f.txt"], [c.path for c in changes])
+
+    def test_index_trees_match_commits(self):
+        os.makedirs("src/a/b")
+        for fn in ["src/a/b/x.txt", "src/y.txt", "z.txt", "src/a/w.txt"]:
+            with open(fn, "w") as f:
+                f.write(fn)
+        self.repo.index.stage_files(["z.txt", "src/a/w.txt"])
+        self.repo.index.stage_files(["src"])
+        k1 = self.repo.index.save_to_db()
+        # The same files staged in another order give the same tree
+        os.remove(self.rootdir + "/.vc/index")
+        self.repo.index.stage_files(["src", "z.txt"])
+        self.assertEqual(k1, self.repo.index.save_to_db())
+
+    def test_diff_commits(self):
+        os.makedirs("src")
+        self.create_file("src/a.txt", "a\n")
+        self.create_file("b.txt", "b\n")
+        self.repo.index.stage_files(["src", "b.txt"])
+        c1 = self.repo.index.commit("First")
+        self.create_file("src/a.txt", "a2\n")
+        self.repo.index.stage_file("src/a.txt")
+        self.assertEqual([], self.repo.status().not_staged)
+        self.assertEqual(
+            [("src/a.txt", FileStatus.MODIFIED)],
+            [(f.name, f.status) for f in self.repo.status().staged],
+        )
+
+        cached = self.repo.diff([], cached=True)
+        self.assertEqual(1, len(cached))
+        self.assertIn("@@ -1 +1 @@\n-a\n+a2\n", cached[0])
+        self.assertEqual(cached, self.repo.diff([], [c1]))
+        self.assertEqual([], self.repo.diff(["b.txt"], cached=True))
+
+        c2 = self.repo.index.commit("Second")
+        self.assertEqual([], self.repo.diff([], cached=True))
+        self.assertEqual(cached, self.repo.diff([], [c1, c2]))
+        self.assertEqual([], self.repo.diff([], [c2, "master"]))
+        with self.assertRaises(Exception):
+            self.repo.diff([], ["nothing", c2])
+
+    def test_diff_lines(self):
+        random.seed(7)
+        for _ in range(500):
+            a = random.choices("abcde", k=random.randint(0, 25))
+            b = random.choices("abcde", k=random.randint(0, 25))
+            for algorithm in ["myers", "histogram"]:
+                rebuilt, equal = [], 0
+                for tag, i1, i2, j1, j2 in diff_lines(a, b, algorithm):
+                    if tag == "equal":
+                        self.assertEqual(a[i1:i2], b[j1:j2])
+                        equal += i2 - i1
+                    rebuilt.extend(b[j1:j2])
+                self.assertEqual(b, rebuilt)
+                if algorithm == "myers":
+                    self.assertEqual(_lcs(a, b), equal)  # Minimal diff
+
+    def test_unified_diff(self):
+        old = "".join(f"l{i}\n" for i in range(20))
+        new = old.replace("l2\n", "two\n").replace("l15\n", "")
+        self.assertEqual(
+            "--- f\n+++ f\n@@ -1,5 +1,5 @@\n l0\n l1\n-l2\n+two\n l3\n l4\n"
+            + "@@ -14,5 +14,4 @@\n l13\n l14\n-l15\n l16\n l17\n",
+            "".join(unified_diff(old, new, "f", "f", context=2)),
+        )
+        self.assertEqual("", "".join(unified_diff(old, old, "f", "f")))
+        self.assertEqual(
+            "--- f\n+++ f\n@@ -1 +1 @@\n-a\n\\ No newline at end of file\n+a\n",
+            "".join(unified_diff("a", "a\n", "f", "f")),
+        )
+        # Histogram matches the unique line, not the repeated braces
+        old = "f() {\n}\ng() {\n}\n"
+        new = "g() {\n}\n"
+        self.assertEqual(
+            "--- f\n+++ f\n@@ -1,4 +1,2 @@\n-f() {\n-}\n g() {\n }\n",
+            "".join(unified_diff(old, new, "f", "f", algorithm="histogram")),
+        )
+
+    def test_binary_files(self):
+        with open("b.bin", "wb") as f:
+            f.write(b"\x89PNG\0\xff" * 10)
+        self.create_file("t.txt", "t\n")
+        self.repo.index.stage_files(["b.bin", "t.txt"])
+        c1 = self.repo.index.commit("First")
+        with open("b.bin", "ab") as f:
+            f.write(b"\xfe")
+        self.create_file("t.txt", "t2\n")
+        diffs = self.repo.iter_diff([])
+        self.assertEqual("Binary files b.bin and b.bin differ\n", next(diffs))
+        self.assertIn("+t2\n", next(diffs))
+        self.assertIsNone(next(diffs, None))
+
+        self.repo.index.stage_files(["b.bin", "t.txt"])
+        c2 = self.repo.index.commit("Second")
+        differ = ["Binary files b.bin and b.bin differ\n"]
+        self.assertEqual(differ, self.repo.diff(["b.bin"], [c1, c2]))
+        with open("b.bin", "wb") as f:
+            f.write(b"\x89PNG\0\xff" * 10)
+        self.assertEqual(differ, self.repo.diff(["b.bin"]))
+        self.assertEqual([], self.repo.diff(["b.bin"], [c1]))  # Same as in c1 again
+        with open("b.bin", "ab") as f:
+            f.write(b"\xfe" * 100000)
+        with mock.patch("vc.impl.repo._blob_data") as blob_data:
+            self.assertEqual(differ, self.repo.diff(["b.bin"]))
+        blob_data.assert_not_called()  # Told from the start of the file alone
+
+    def create_file(self, rel_root: str, contents: str) -> str:
+        fn = self.rootdir + "/" + rel_root
+        with open(fn, "w") as f:
+            f.write(contents)
+            return fn
+
+
+def _lcs(a, b):
+    lengths = [[0] * (len(b) + 1) for _ in range(len(a) + 1)]
+    for i, x in enumerate(a):
+        for j, y in enumerate(b):
+            lengths[i + 1][j + 1] = (
+                lengths[i][j] + 1 if x == y else max(lengths[i][j + 1], lengths[i + 1][j])
+            )
+    return lengths[-1][-1]
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
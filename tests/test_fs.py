@@ -0,0 +1,57 @@
+import tempfile
+import shutil
+import os
+from unittest import TestCase
+from vc.api import PRepo
+from vc.impl import create_repo
+from vc.impl.fs import find_repo, find_vc_root_dir
+from vc.impl.trace import count_syscalls
+
+
+class FsTest(TestCase):
+    rootdir: str
+    repo: PRepo
+
+    def setUp(self):
+        self.rootdir = os.path.realpath(tempfile.mkdtemp(dir=tempfile.gettempdir()))
+        os.chdir(self.rootdir)
+        self.repo = create_repo(self.rootdir, True)
+        self.repo.init_repo()
+
+    def tearDown(self):
+        shutil.rmtree(self.rootdir)
+
+    def test_find_repo(self):
+        os.makedirs("src/a/b")
+        with count_syscalls() as first:
+            repo = find_repo("src/a/b")
+        self.assertEqual(self.rootdir + "/.vc", repo.vc_dir)  # type: ignore
+        self.assertEqual(self.rootdir, repo.worktree)  # type: ignore
+        self.assertEqual(4, first["stat"])  # b, a, src and the root
+        with count_syscalls() as again:
+            self.assertEqual(repo, find_repo(self.rootdir + "/src/a/b"))
+        self.assertEqual(0, sum(again.values()))
+        self.assertIsNone(find_vc_root_dir("/"))
+
+    def test_repo_is_not_looked_for(self):
+        for i in range(10):
+            os.makedirs(f"d{i % 3}", exist_ok=True)
+            with open(f"d{i % 3}/f{i}.txt", "w") as f:
+                f.write(f"{i}")
+        self.repo.index.stage_files(["d0", "d1", "d2"])
+        self.repo.index.commit("First")
+        for command in [self.repo.status, self.repo.log, self.repo.list_branches]:
+            with count_syscalls() as counts:
+                command()
+            stats = counts.paths("stat") + counts.paths("lstat")
+            walked = [p for p in stats if p.endswith("/.vc") or p.endswith("/..")]
+            self.assertEqual([], walked)
+        with count_syscalls() as counts:
+            self.repo.log()
+        self.assertEqual(3, sum(counts.values()))  # HEAD, the branch and the commit
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
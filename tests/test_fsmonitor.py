@@ -0,0 +1,103 @@
+import sys
+import tempfile
+import shutil
+import threading
+import os.path
+import os
+from unittest import TestCase, skipUnless, mock
+from vc.api import PRepo
+from vc.impl import create_repo, fsmonitor
+from vc.impl.hasher import changed_entries
+
+
+@skipUnless(sys.platform.startswith("linux"), "inotify is only available on Linux")
+class FsMonitorTest(TestCase):
+    rootdir: str
+    repo: PRepo
+
+    def setUp(self):
+        self.rootdir = tempfile.mkdtemp(dir=tempfile.gettempdir())
+        os.chdir(self.rootdir)
+        self.repo = create_repo(self.rootdir, True)
+        self.root = self.rootdir + "/.vc"
+        os.makedirs(self.rootdir + "/src")
+        files = [self.create_file(f"src/f{i}.txt", f"v{i}") for i in range(10)]
+        for f in files:
+            os.utime(f, ns=(1_000_000_000, 1_000_000_000))
+        self.repo.index.stage_files(files)
+        self.repo.index.commit("Initial import")
+        os.utime(self.root + "/index", ns=(2_000_000_000, 2_000_000_000))
+
+        self.monitor = fsmonitor.Monitor(self.root)
+        self.thread = threading.Thread(target=self.monitor.serve_forever)
+        self.thread.start()
+        while not fsmonitor.is_running(self.root):
+            pass
+
+    def tearDown(self):
+        fsmonitor.stop(self.root)
+        self.thread.join()
+        shutil.rmtree(self.rootdir)
+
+    def test_query(self):
+        token, changed = self.monitor.query("")
+        self.assertIsNone(changed)
+        self.create_file("src/f1.txt", "w1")
+        os.makedirs(self.rootdir + "/new/sub")
+        self.create_file("new/sub/a.txt", "a")
+        token, changed = self.monitor.query(token)
+        self.assertIn("src/f1.txt", changed)
+        self.assertIn("new", changed)
+        token, changed = self.monitor.query(token)
+        self.assertEqual([], changed)
+        self.assertIsNone(self.monitor.query("other:1")[1])
+
+    def test_status(self):
+        checked = []
+
+        def spy(entries, *args):
+            checked.append(sorted(e.ename for e in entries))
+            return changed_entries(entries, *args)
+
+        with mock.patch("vc.impl.repo.changed_entries", spy):
+            st = self.repo.status()  # No token yet: everything is checked
+            self.assertEqual(10, len(checked[-1]))
+            self.assertEqual(0, len(st.not_staged))
+
+            st = self.repo.status()
+            self.assertEqual([], checked[-1])
+
+            self.create_file("src/f3.txt", "w3")
+            st = self.repo.status()
+            self.assertEqual(["src/f3.txt"], checked[-1])
+            self.assertEqual(["src/f3.txt"], [f.name for f in st.not_staged])
+
+            st = self.repo.status()  # Still modified, so still checked
+            self.assertEqual(["src/f3.txt"], checked[-1])
+            self.assertEqual(["src/f3.txt"], [f.name for f in st.not_staged])
+
+            self.repo.index.stage_file(self.rootdir + "/src/f3.txt")
+            st = self.repo.status()  # The index changed: everything is checked
+            self.assertEqual(10, len(checked[-1]))
+
+    def test_without_monitor(self):
+        fsmonitor.stop(self.root)
+        self.thread.join()
+        self.assertIsNone(fsmonitor.query(self.root))
+        self.create_file("src/f3.txt", "w3")
+        st = self.repo.status()
+        self.assertEqual(["src/f3.txt"], [f.name for f in st.not_staged])
+        self.thread = threading.Thread()
+        self.thread.start()
+
+    def create_file(self, rel_root: str, contents: str) -> str:
+        fn = self.rootdir + "/" + rel_root
+        with open(fn, "w") as f:
+            f.write(contents)
+            return fn
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
@@ -0,0 +1,237 @@
+import tempfile
+import shutil
+import os
+from unittest import TestCase, mock
+from vc.api import PRepo
+from vc.impl import create_repo, commitgraph, bloom
+from vc.impl.bloom import ChangedPathFilters, path_hashes
+from vc.impl.commitgraph import CommitGraph, CommitInfo
+from vc.impl.history import History, GENERATION_INFINITY
+from vc.impl.treediff import diff_trees
+
+
+def _key(name: str) -> str:
+    return name.encode("UTF-8").hex().ljust(40, "0")
+
+
+class HistoryTest(TestCase):
+    rootdir: str
+    repo: PRepo
+
+    def setUp(self):
+        self.rootdir = tempfile.mkdtemp(dir=tempfile.gettempdir())
+        os.chdir(self.rootdir)
+        self.repo = create_repo(self.rootdir, True)
+        self.root = self.rootdir + "/.vc"
+
+    def tearDown(self):
+        shutil.rmtree(self.rootdir)
+
+    def history(self, edges, in_graph=None):
+        """Return a History for the commits in edges (name -> parent names)."""
+        infos = {
+            _key(n): CommitInfo(_key(n), _key("t"), [_key(p) for p in ps], i)
+            for i, (n, ps) in enumerate(edges.items())
+        }
+        names = in_graph if in_graph is not None else edges.keys()
+        commitgraph.write(self.root, [infos[_key(n)] for n in names])
+        return History(CommitGraph.load(self.root), infos.get)
+
+    def test_merge_base(self):
+        #   a - b - c - e - f
+        #        \     /
+        #         d ---- g
+        edges = {
+            "a": [],
+            "b": ["a"],
+            "c": ["b"],
+            "d": ["b"],
+            "e": ["c", "d"],
+            "f": ["e"],
+            "g": ["d"],
+        }
+        for in_graph in [None, [], ["a", "b", "c", "d"]]:
+            h = self.history(edges, in_graph)
+            self.assertEqual([_key("d")], h.merge_bases(_key("f"), _key("g")))
+            self.assertEqual([_key("b")], h.merge_bases(_key("c"), _key("g")))
+            self.assertEqual([_key("e")], h.merge_bases(_key("e"), _key("f")))
+            self.assertTrue(h.is_ancestor(_key("a"), _key("f")))
+            self.assertTrue(h.is_ancestor(_key("d"), _key("f")))
+            self.assertFalse(h.is_ancestor(_key("g"), _key("f")))
+            self.assertFalse(h.is_ancestor(_key("f"), _key("a")))
+
+    def test_criss_cross(self):
+        edges = {"a": [], "b": ["a"], "c": ["a"], "x": ["b", "c"], "y": ["c", "b"]}
+        h = self.history(edges)
+        bases = h.merge_bases(_key("x"), _key("y"))
+        self.assertEqual({_key("b"), _key("c")}, set(bases))
+
+    def test_graph(self):
+        edges = {"a": [], "b": ["a"], "c": ["a", "b"], "d": ["a", "b", "c"]}
+        h = self.history(edges)
+        graph = CommitGraph.load(self.root)
+        pos = graph.position(_key("c"))
+        self.assertEqual(3, graph.generation(pos))
+        self.assertEqual(2, graph.timestamp(pos))
+        self.assertEqual([_key("a"), _key("b")], [graph.key(p) for p in graph.parents(pos)])
+        self.assertIsNone(graph.parents(graph.position(_key("d"))))  # Octopus
+        self.assertEqual([_key("a"), _key("b"), _key("c")], h.node(_key("d")).parents)
+        self.assertIsNone(graph.position(_key("z")))
+
+        # Missing parents: the commit (and its descendants) are left out
+        commitgraph.write(self.root, [CommitInfo(_key("b"), _key("t"), [_key("a")], 0)])
+        self.assertIsNone(CommitGraph.load(self.root).position(_key("b")))
+        infos = {_key("b"): CommitInfo(_key("b"), "", [], 0)}
+        h = History(CommitGraph.load(self.root), infos.get)
+        self.assertEqual(GENERATION_INFINITY, h.node(_key("b")).generation)
+        self.assertIsNone(h.node(_key("z")))
+
+    def test_walk(self):
+        #   a - b - c - e - f
+        #        \     /
+        #         d ---- g
+        edges = {
+            "a": [],
+            "b": ["a"],
+            "d": ["b"],
+            "c": ["b"],
+            "e": ["c", "d"],
+            "f": ["e"],
+            "g": ["d"],
+        }
+        for in_graph in [None, []]:
+            h = self.history(edges, in_graph)
+
+            def walk(include, exclude=[], **kwargs):
+                w = h.walk([_key(k) for k in include], [_key(k) for k in exclude], **kwargs)
+                return "".join(bytes.fromhex(n.key.rstrip("0")).decode() for n in w)
+
+            self.assertEqual("fecdba", walk(["f"]))  # By date ('d' is older than 'c')
+            self.assertEqual("gfecdba", walk(["f", "g"]))
+            self.assertEqual("fec", walk(["f"], ["g"]))
+            self.assertEqual("g", walk(["g"], ["f"]))
+            self.assertEqual("fecba", walk(["f"], first_parent=True))
+            self.assertEqual("fec", walk(["f"], since=3))
+            self.assertEqual("", walk(["f"], ["f"]))
+
+        # Clock skew: the parent is more recent
+        h = self.history({"b": ["a"], "a": []})
+        w = h.walk([_key("b")], topo_order=True)
+        self.assertEqual([_key("b"), _key("a")], [n.key for n in w])
+
+    def test_walk_is_lazy(self):
+        edges = {str(i): [str(i - 1)] if i else [] for i in range(1000)}
+        infos = {
+            _key(n): CommitInfo(_key(n), _key("t"), [_key(p) for p in ps], int(n))
+            for n, ps in edges.items()
+        }
+        loaded = []
+
+        def load(key):
+            loaded.append(key)
+            return infos.get(key)
+
+        walk = History(None, load).walk([_key("999")])
+        self.assertEqual(_key("999"), next(walk).key)
+        self.assertLess(len(loaded), 5)
+
+        # Excluded commits are walked by generation, which needs the graph
+        self.history(edges)
+        loaded.clear()
+        walk = History(CommitGraph.load(self.root), load).walk([_key("999")], [_key("990")])
+        self.assertEqual(_key("999"), next(walk).key)
+        self.assertEqual(9, 1 + sum(1 for _ in walk))
+        self.assertEqual([], loaded)
+
+    def test_commit_updates_graph(self):
+        self.repo.init_repo()
+        keys = []
+        for i in range(3):
+            with open(f"f{i}.txt", "w") as f:
+                f.write(f"{i}")
+            self.repo.index.stage_file(f"f{i}.txt")
+            keys.append(self.repo.index.commit(f"commit {i}"))
+        graph = CommitGraph.load(self.root)
+        self.assertEqual(3, graph.count)
+        self.assertEqual(1, graph.sorted_count)  # The others were appended
+        self.assertEqual([1, 2, 3], [graph.generation(graph.position(k)) for k in keys])
+        self.assertEqual(keys[1], graph.key(graph.parents(graph.position(keys[2]))[0]))
+
+        self.assertEqual(3, self.repo.write_commit_graph())
+        graph = CommitGraph.load(self.root)
+        self.assertEqual(3, graph.sorted_count)
+        self.assertEqual([keys[0]], self.repo.merge_base(keys[0], "master"))
+        self.assertTrue(self.repo.is_ancestor(keys[0][:7], keys[2]))
+        self.assertFalse(self.repo.is_ancestor(keys[2], keys[1]))
+        self.assertEqual(keys[::-1], [e.key for e in self.repo.log()])
+
+        def log(*args, **kwargs):
+            return [e.key for e in self.repo.iter_log(list(args), **kwargs)]
+
+        self.assertEqual(keys[:0:-1], log(keys[0][:7] + "..master"))
+        self.assertEqual(keys[:0:-1], log("HEAD", "^" + keys[0]))
+        self.assertEqual([keys[1]], log(keys[1], max_count=1))
+        self.assertEqual([], log(".." + keys[2]))
+        with self.assertRaises(Exception):
+            self.repo.iter_log(["nothing..master"])
+
+    def test_log_paths(self):
+        self.repo.init_repo()
+        os.makedirs("src/sub")
+        keys = []
+        for i, fn in enumerate(["a.txt", "src/b.txt", "src/sub/c.txt", "src/b.txt", "a.txt"]):
+            with open(fn, "w") as f:
+                f.write(f"{i}")
+            self.repo.index.stage_file(fn)
+            keys.append(self.repo.index.commit(f"commit {i}"))
+
+        def log(*paths):
+            return [keys.index(e.key) for e in self.repo.iter_log(paths=list(paths))]
+
+        expected = {
+            ("a.txt",): [4, 0],
+            ("src",): [3, 2, 1],
+            ("src/sub/c.txt", "a.txt"): [4, 2, 0],
+            ("src/sub/",): [2],
+            ("nothing",): [],
+            (".",): [4, 3, 2, 1, 0],
+        }
+        for paths, result in expected.items():
+            self.assertEqual(result, log(*paths))
+
+        self.assertEqual(5, self.repo.write_commit_graph(changed_paths=True))
+        graph = CommitGraph.load(self.root)
+        filters = ChangedPathFilters.load(self.root, graph)
+        self.assertEqual(5, filters.count)
+        pos = graph.position(keys[2])
+        self.assertTrue(filters.may_have_changed(pos, path_hashes("src/sub/c.txt")))
+        self.assertFalse(filters.may_have_changed(pos, path_hashes("a.txt")))
+
+        with mock.patch("vc.impl.repo.diff_trees", wraps=diff_trees) as diffs:
+            self.assertEqual([4, 0], log("a.txt"))
+            self.assertEqual(2, diffs.call_count)  # Only the candidates
+        for paths, result in expected.items():
+            self.assertEqual(result, log(*paths))
+
+        # After a new commit, the filters (and the graph) are written again
+        with open("a.txt", "w") as f:
+            f.write("more")
+        self.repo.index.stage_file("a.txt")
+        keys.append(self.repo.index.commit("commit 5"))
+        self.assertEqual([5, 4, 0], log("a.txt"))
+        self.repo.write_commit_graph()
+        graph = CommitGraph.load(self.root)
+        self.assertEqual(6, ChangedPathFilters.load(self.root, graph).count)
+
+    def test_stale_filters(self):
+        self.history({"a": [], "b": ["a"]})
+        bloom.write(self.root, CommitGraph.load(self.root), lambda key: ["x"])
+        self.assertIsNotNone(ChangedPathFilters.load(self.root, CommitGraph.load(self.root)))
+        self.history({"a": [], "c": ["a"]})
+        self.assertIsNone(ChangedPathFilters.load(self.root, CommitGraph.load(self.root)))
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
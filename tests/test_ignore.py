@@ -0,0 +1,94 @@
+import tempfile
+import shutil
+import os.path
+import os
+from unittest import TestCase
+from vc.impl.ignore import IgnoreRules, read_ignore
+from vc.impl.fs import create_vc_root_dir
+
+
+class IgnoreTest(TestCase):
+    rootdir: str
+
+    def setUp(self):
+        self.rootdir = tempfile.mkdtemp(dir=tempfile.gettempdir())
+        self.vc_dir = create_vc_root_dir(self.rootdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.rootdir)
+
+    def test_patterns(self):
+        rules = IgnoreRules(
+            "# comment\n*.o\nbuild/\n/TODO\ndoc/*.html\n**/gen/*.py\ntmp?.[ch]\n"
+            + "*.log\n!keep.log\n\\!bang\n"
+        )
+        self.assertTrue(rules.match("a/b/x.o", False))
+        self.assertTrue(rules.match("build", True))
+        self.assertIsNone(rules.match("build", False))
+        self.assertTrue(rules.match("TODO", False))
+        self.assertIsNone(rules.match("src/TODO", False))
+        self.assertTrue(rules.match("doc/a.html", False))
+        self.assertIsNone(rules.match("doc/api/a.html", False))
+        self.assertTrue(rules.match("gen/a.py", False))
+        self.assertTrue(rules.match("src/gen/a.py", False))
+        self.assertTrue(rules.match("tmp1.c", False))
+        self.assertIsNone(rules.match("tmp12.c", False))
+        self.assertTrue(rules.match("x/debug.log", False))
+        self.assertFalse(rules.match("x/keep.log", False))
+        self.assertTrue(rules.match("!bang", False))
+        self.assertIsNone(rules.match("comment", False))
+
+    def test_anchored_suffix(self):
+        rules = IgnoreRules("/*.txt\n")
+        self.assertTrue(rules.match("x.txt", False))
+        self.assertIsNone(rules.match("sub/x.txt", False))
+
+    def test_classes(self):
+        rules = IgnoreRules("[]a]\nb[!]]\n[z-a]\nc[\n")
+        self.assertTrue(rules.match("]", False))
+        self.assertTrue(rules.match("a", False))
+        self.assertTrue(rules.match("bx", False))
+        self.assertIsNone(rules.match("b]", False))
+        self.assertTrue(rules.match("[z-a]", False))  # Invalid, so taken literally
+        self.assertIsNone(rules.match("z", False))
+        self.assertTrue(rules.match("c[", False))
+
+    def test_last_match_wins(self):
+        rules = IgnoreRules("*.txt\n!a*.txt\nab.txt\n")
+        self.assertTrue(rules.match("x.txt", False))
+        self.assertFalse(rules.match("ac.txt", False))
+        self.assertTrue(rules.match("ab.txt", False))
+
+    def test_matcher(self):
+        self.create_file(".vcignore", "*.tmp\nout/\n")
+        self.create_file("src/.vcignore", "!keep.tmp\n/local\n")
+        ignore = read_ignore(self.vc_dir)
+        self.assertTrue(ignore(".vc", True))
+        self.assertTrue(ignore(".vc/index"))
+        self.assertTrue(ignore("a.tmp"))
+        self.assertTrue(ignore("src/a.tmp"))
+        self.assertFalse(ignore("src/keep.tmp"))
+        self.assertTrue(ignore("keep.tmp"))
+        self.assertTrue(ignore("src/local"))
+        self.assertFalse(ignore("local"))
+        self.assertTrue(ignore("out", True))
+        self.assertTrue(ignore("out/a.c"))  # Inside an ignored dir
+        self.assertFalse(ignore("src/main.c"))
+
+        sig = ignore.signature(["src"])
+        self.assertEqual(sig, read_ignore(self.vc_dir).signature(["src"]))
+        self.create_file("src/.vcignore", "!keep.tmp\n")
+        self.assertNotEqual(sig, read_ignore(self.vc_dir).signature(["src"]))
+
+    def create_file(self, rel_root: str, contents: str) -> str:
+        fn = self.rootdir + "/" + rel_root
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        with open(fn, "w") as f:
+            f.write(contents)
+            return fn
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
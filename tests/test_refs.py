@@ -0,0 +1,76 @@
+import tempfile
+import shutil
+import os
+from unittest import TestCase
+from vc.api import PRepo
+from vc.impl import create_repo
+from vc.impl.refs import PACKED_REFS, branch_head, list_refs
+from vc.impl.trace import count_syscalls
+
+
+class RefsTest(TestCase):
+    rootdir: str
+    repo: PRepo
+    c1: str
+
+    def setUp(self):
+        self.rootdir = tempfile.mkdtemp(dir=tempfile.gettempdir())
+        os.chdir(self.rootdir)
+        self.repo = create_repo(self.rootdir, True)
+        self.repo.init_repo()
+        with open("f.txt", "w") as f:
+            f.write("f")
+        self.repo.index.stage_file("f.txt")
+        self.c1 = self.repo.index.commit("First")
+
+    def tearDown(self):
+        shutil.rmtree(self.rootdir)
+
+    def test_pack_refs(self):
+        root = self.rootdir + "/.vc"
+        names = [f"ci/b{i:03}" for i in range(200)] + ["a", "z"]
+        for b in names:
+            self.repo.create_branch(b)
+        self.assertEqual(203, self.repo.pack_refs())
+        self.assertEqual([], os.listdir(root + "/refs/heads"))
+        self.assertFalse(os.path.exists(root + "/refs/heads/ci"))
+
+        self.assertEqual((sorted(names + ["master"]), "master"), self.repo.list_branches())
+        for b in names + ["master"]:
+            self.assertEqual(self.c1, branch_head(root, b))
+        self.assertEqual("", branch_head(root, "ci/b2"))
+        with count_syscalls() as counts:
+            self.assertEqual(203, len(list_refs(root)))
+        self.assertEqual(0, counts["open"])  # Nothing changed: not read again
+
+        # Loose refs override packed ones, which can still be deleted and renamed
+        with open("f.txt", "w") as f:
+            f.write("f2")
+        self.repo.index.stage_file("f.txt")
+        c2 = self.repo.index.commit("Second")
+        self.assertEqual(c2, branch_head(root, "master"))
+        self.repo.checkout("ci/b007")
+        self.assertEqual(self.c1, self.repo.log()[0].key)
+        self.repo.delete_branch("a")
+        self.repo.rename_branch("ci/b007", "b7")
+        self.assertEqual("b7", self.repo.list_branches()[1])  # HEAD follows the rename
+        self.assertEqual(self.c1, branch_head(root, "b7"))
+        self.assertNotIn("a", self.repo.list_branches()[0])
+        with open(root + "/" + PACKED_REFS) as f:
+            self.assertNotIn("refs/heads/a\n", f.read())
+        self.assertEqual(202, self.repo.pack_refs())
+
+    def test_list_loose_refs(self):
+        root = self.rootdir + "/.vc"
+        names = [f"ci/b{i:03}" for i in range(200)] + ["a", "z"]
+        for b in names:
+            self.repo.create_branch(b)
+        with count_syscalls() as counts:
+            self.assertEqual(sorted(names + ["master"]), list_refs(root))
+        self.assertEqual(0, counts["open"])  # The loose refs are listed, not read
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
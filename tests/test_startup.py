@@ -0,0 +1,66 @@
+import tempfile
+import shutil
+import os
+import subprocess
+import sys
+from typing import Set
+from unittest import TestCase
+from vc.impl import create_repo
+
+# Slow to import, and not needed by 'vc status' in an empty repo. The time
+# spent importing is checked against a budget by tools/bench_startup.py
+NOT_IMPORTED = [
+    "vc.cli.command_diff",
+    "vc.cli.command_log",
+    "concurrent.futures",
+    "multiprocessing",
+    "tempfile",
+    "socket",
+    "json",
+    "ctypes",
+    "uuid",
+    "subprocess",
+]
+# Runs 'vc status', printing the modules imported when it exits
+STATUS = "import atexit, runpy, sys\n"
+STATUS += "atexit.register(lambda: print(*sys.modules, sep='\\n', file=sys.stderr))\n"
+STATUS += "sys.argv = ['vc', 'status']\n"
+STATUS += "runpy.run_module('vc', run_name='__main__')"
+
+
+def _imported_modules(cwd: str) -> Set[str]:
+    """Run 'vc status' in cwd, returning the modules it imported."""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    res = subprocess.run(
+        [sys.executable, "-c", STATUS],
+        cwd=cwd,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return set(res.stderr.splitlines())
+
+
+class StartupTest(TestCase):
+    rootdir: str
+
+    def setUp(self):
+        self.rootdir = tempfile.mkdtemp(dir=tempfile.gettempdir())
+        create_repo(self.rootdir, True).init_repo()
+
+    def tearDown(self):
+        shutil.rmtree(self.rootdir)
+
+    def test_status_imports(self):
+        modules = _imported_modules(self.rootdir)
+        self.assertIn("vc.cli.main", modules)
+        self.assertIn("vc.cli.command_status", modules)
+        self.assertEqual([], [m for m in NOT_IMPORTED if m in modules])
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
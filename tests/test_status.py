@@ -6,6 +6,8 @@ from unittest import TestCase
 from vc.api import PRepo
 from vc.impl import create_repo
 from vc.impl.repo import Repo
+from vc.impl.hasher import changed_entries
+from vc.impl import untracked
 
 
 class StatusTest(TestCase):
@@ -55,6 +57,103 @@ class StatusTest(TestCase):
         self.assertEqual(len(st.not_staged), 0)
         self.assertEqual(len(st.not_tracked), 1)
 
+    def test_stat_cache(self):
+        os.makedirs(self.rootdir + "/src")
+        files = [self.create_file(f"src/f{i}.txt", f"v{i}") for i in range(5)]
+        for f in files:  # Older than the index, so the stat data is trusted
+            os.utime(f, ns=(1_000_000_000, 1_000_000_000))
+        self.repo.index.stage_files(files)
+        self.repo.index.commit("Initial import")
+
+        db = self.repo.db
+        hashed = []
+        calculate_key = db.calculate_key
+        db.calculate_key = lambda c: hashed.append(c) or calculate_key(c)
+        st = self.repo.status()
+        self.assertEqual(0, len(st.not_staged))
+        self.assertEqual([], hashed)
+
+        self.create_file("src/f3.txt", "w3")  # Same size, different contents
+        st = self.repo.status()
+        self.assertEqual(["src/f3.txt"], [f.name for f in st.not_staged])
+        self.assertEqual([b"w3"], hashed)
+
+    def test_many_modified(self):
+        os.makedirs(self.rootdir + "/src")
+        files = [self.create_file(f"src/f{i}.txt", f"v{i}") for i in range(200)]
+        self.repo.index.stage_files(files)
+        self.repo.index.commit("Initial import")
+        for i in range(0, 200, 2):
+            self.create_file(f"src/f{i}.txt", f"modified {i}")
+
+        entries = [e for es in self.repo.index.dirtree().values() for e in es]
+        changed = changed_entries(entries, self.repo.db, self.repo.root, workers=2)
+        expected = [e.ename for e in entries if int(e.ename[5:-4]) % 2 == 0]
+        self.assertEqual(expected, [e.ename for e in changed])
+        st = self.repo.status()
+        self.assertEqual(set(expected), {f.name for f in st.not_staged})
+
+    def test_racy_entries_are_hashed(self):
+        f1 = self.create_file("README.org", "abc")
+        os.utime(f1, ns=(1_000_000_000, 1_000_000_000))
+        self.repo.index.stage_file(f1)
+        self.repo.index.commit("Initial import")
+        # The file could change again in the instant the index was written
+        os.utime(self.rootdir + "/.vc/index", ns=(1_000_000_000, 1_000_000_000))
+
+        db = self.repo.db
+        hashed = []
+        calculate_key = db.calculate_key
+        db.calculate_key = lambda c: hashed.append(c) or calculate_key(c)
+        st = self.repo.status()
+        self.assertEqual(0, len(st.not_staged))
+        self.assertEqual([b"abc"], hashed)
+
+    def test_untracked_cache(self):
+        os.makedirs(self.rootdir + "/src")
+        f1 = self.create_file("src/a.txt", "a")
+        self.create_file("src/b.log", "b")
+        self.repo.index.stage_file(f1)
+        for d in ["", "/src"]:  # Older than the cache, so it's trusted
+            os.utime(self.rootdir + d, ns=(1_000_000_000, 1_000_000_000))
+        st = self.repo.status()
+        self.assertEqual({"src/b.log"}, {f.name for f in st.not_tracked})
+        self.assertTrue(os.path.exists(self.rootdir + "/.vc/untracked"))
+
+        listed = []
+        list_dir = untracked._list_dir
+        untracked._list_dir = lambda p, *a: listed.append(p) or list_dir(p, *a)
+        try:
+            st = self.repo.status()
+            self.assertEqual({"src/b.log"}, {f.name for f in st.not_tracked})
+            self.assertEqual([], listed)
+
+            self.create_file("src/c.txt", "c")
+            st = self.repo.status()
+            self.assertEqual({"src/b.log", "src/c.txt"}, {f.name for f in st.not_tracked})
+            self.assertEqual(1, len(listed))
+
+            self.create_file(".vcignore", "*.log")
+            st = self.repo.status()
+            self.assertEqual({".vcignore", "src/c.txt"}, {f.name for f in st.not_tracked})
+        finally:
+            untracked._list_dir = list_dir
+
+    def test_text_index(self):
+        f1 = self.create_file("README.org", "abc")
+        key = self.repo.db.put("abc")
+        with open(self.rootdir + "/.vc/index", "w") as f:
+            f.write(f"{key} f README.org\n")
+        st = self.repo.status()
+        self.assertEqual(["README.org"], [f.name for f in st.staged])
+        self.assertEqual(0, len(st.not_staged))
+        self.create_file("README.org", "abcd")
+        st = self.repo.status()
+        self.assertEqual(["README.org"], [f.name for f in st.not_staged])
+        self.repo.index.stage_file(f1)
+        with open(self.rootdir + "/.vc/index", "rb") as f:
+            self.assertTrue(f.read().startswith(b"VCIX"))
+
     def create_file(self, rel_root: str, contents: str) -> str:
         fn = self.rootdir + "/" + rel_root  # FIXME: check '/'
         with open(fn, "w") as f:
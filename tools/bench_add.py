@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+"""Benchmark 'vc add' of a whole tree, serially and with a process pool.
+
+A synthetic tree of small text files spread over nested directories is
+staged with one worker and with one worker per CPU, reporting files/s and
+MB/s for each.
+
+Usage: PYTHONPATH=. python3 tools/bench_add.py [files]
+"""
+
+import os
+import sys
+import random
+import shutil
+import tempfile
+import time
+from vc.impl import create_repo
+
+
+def main(nfiles: int) -> None:
+    rnd = random.Random(42)
+    root = tempfile.mkdtemp()
+    try:
+        total = 0
+        for i in range(nfiles):
+            d = f"{root}/src/d{i % 97}/e{i % 13}"
+            os.makedirs(d, exist_ok=True)
+            lines = rnd.randrange(10, 200)
+            content = "".join(f"line {j} of file {i}\n" for j in range(lines))
+            total += len(content)
+            with open(f"{d}/f{i}.txt", "w") as f:
+                f.write(content)
+
+        for workers in sorted({1, os.cpu_count() or 1}):
+            vc_dir = root + "/.vc"
+            shutil.rmtree(vc_dir, ignore_errors=True)
+            repo = create_repo(root, True)
+            os.chdir(root)
+            start = time.perf_counter()
+            repo.index.stage_files(["src"], workers=workers)
+            elapsed = time.perf_counter() - start
+            print(
+                f"workers={workers:3} {nfiles} files in {elapsed:7.2f}s:"
+                + f" {nfiles / elapsed:9.0f} files/s {total / elapsed / 1e6:7.2f} MB/s"
+            )
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
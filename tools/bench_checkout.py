@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+"""Benchmark fresh checkouts of a tree, with different numbers of threads.
+
+A tree of small files (20000 by default) is committed on top of an empty
+commit. For each number of threads, the empty commit is checked out (which
+removes every file) and then the tree is checked out again and timed, so
+all the files are written each time. Objects are packed first, as they
+would be after a clone.
+
+Usage: PYTHONPATH=. python3 tools/bench_checkout.py [files [threads ...]]
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import time
+from typing import List
+from vc.impl import create_repo
+
+
+def main(nfiles: int, threads: List[int]) -> None:
+    root = tempfile.mkdtemp()
+    try:
+        repo = create_repo(root, True)
+        repo.init_repo()
+        os.chdir(root)
+        empty = repo.index.commit("Empty")
+        for i in range(nfiles):
+            d = f"{root}/src/d{i % 97}/s{i % 7}"
+            os.makedirs(d, exist_ok=True)
+            with open(f"{d}/f{i}.txt", "w") as f:
+                f.write(f"contents of file {i}\n" * (1 + i % 50))
+        repo.index.stage_files(["src"])
+        full = repo.index.commit("Files")
+        repo.repack(all_objects=True)
+
+        for n in threads:
+            repo.checkout(empty)
+            repo.db.clear()  # type: ignore
+            start = time.perf_counter()
+            res = repo.checkout(full, workers=n)
+            elapsed = time.perf_counter() - start
+            print(
+                f"{n:>3} threads: {res.files_written} files, "
+                + f"{res.bytes_written / 1e6:.1f}MB in {elapsed:.2f}s"
+            )
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:]]
+    main(args[0] if args else 20000, args[1:] or [1, 4, 16])
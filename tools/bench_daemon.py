@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+"""Benchmark running vc commands through the daemon and without it.
+
+A repo with a tree of small files (2000 by default) is committed, and each
+command run a number of times (50 by default) as separate 'python -m vc'
+processes, as build tools do, first with VC_NO_DAEMON set and then with
+the daemon of the repo running.
+
+Usage: PYTHONPATH=. python3 tools/bench_daemon.py [files [runs]]
+"""
+
+import os
+import sys
+import shutil
+import subprocess
+import tempfile
+import time
+from typing import Dict, List
+from vc.impl import create_repo
+from vc.cli import daemon
+
+COMMANDS = [["status"], ["log", "-n", "10"], ["branch"], ["diff"]]
+
+
+def run(root: str, args: List[str], runs: int, env: Dict[str, str]) -> float:
+    """Return the mean time (in seconds) of running vc with args in root."""
+    start = time.perf_counter()
+    for _ in range(runs):
+        subprocess.run(
+            [sys.executable, "-m", "vc"] + args,
+            cwd=root,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+    return (time.perf_counter() - start) / runs
+
+
+def main(nfiles: int, runs: int) -> None:
+    root = tempfile.mkdtemp()
+    try:
+        repo = create_repo(root, True)
+        repo.init_repo()
+        os.chdir(root)
+        for i in range(nfiles):
+            d = f"{root}/src/d{i % 37}"
+            os.makedirs(d, exist_ok=True)
+            with open(f"{d}/f{i}.txt", "w") as f:
+                f.write(f"contents of file {i}\n")
+        repo.index.stage_files(["src"])
+        repo.index.commit("Files")
+        with open(f"{root}/src/d0/f0.txt", "a") as f:
+            f.write("changed\n")
+
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        no_daemon = dict(env, **{daemon.NO_DAEMON_ENV: "1"})
+        before = {" ".join(c): run(root, c, runs, no_daemon) for c in COMMANDS}
+        daemon.start(root + "/.vc")
+        try:
+            for c in COMMANDS:
+                name = " ".join(c)
+                after = run(root, c, runs, env)
+                print(
+                    f"{name:>12}: {before[name] * 1000:6.1f}ms without the daemon, "
+                    + f"{after * 1000:6.1f}ms with it"
+                )
+        finally:
+            daemon.stop(root + "/.vc")
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:]]
+    main(args[0] if args else 2000, args[1] if len(args) > 1 else 50)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+"""Benchmark the line diff algorithms against difflib, on growing files.
+
+For each size (10000, 100000 and 1000000 lines by default), a file is
+generated along with a version with a fixed number of edits (lines changed,
+removed and added) spread over it. The unified diff between them is timed
+with myers, histogram and difflib.unified_diff (the default settings of
+SequenceMatcher, as vc used before).
+
+Usage: PYTHONPATH=. python3 tools/bench_diff.py [lines ...]
+"""
+
+import sys
+import difflib
+import random
+import time
+from typing import List, Tuple
+from vc.impl.linediff import unified_diff
+
+EDITS = 200
+
+
+def main(sizes: List[int]) -> None:
+    for nlines in sizes:
+        old, new = texts(nlines)
+        print(f"{nlines} lines, {EDITS} edits:")
+        for algorithm in ["myers", "histogram"]:
+            start = time.perf_counter()
+            n = sum(1 for _ in unified_diff(old, new, "a", "b", algorithm=algorithm))
+            print(f"{algorithm:>12}: {n} lines in {time.perf_counter() - start:.2f}s")
+        start = time.perf_counter()
+        a, b = old.splitlines(True), new.splitlines(True)
+        n = sum(1 for _ in difflib.unified_diff(a, b, "a", "b"))
+        print(f"{'difflib':>12}: {n} lines in {time.perf_counter() - start:.2f}s")
+
+
+def texts(nlines: int) -> Tuple[str, str]:
+    """Return a text of nlines lines, and a version of it with EDITS edits."""
+    rnd = random.Random(nlines)
+    lines = [_line(rnd, i) for i in range(nlines)]
+    edited = list(lines)
+    for pos in sorted(rnd.sample(range(nlines), EDITS), reverse=True):
+        kind = rnd.randrange(3)
+        if kind == 0:
+            edited[pos] = _line(rnd, -pos)
+        elif kind == 1:
+            del edited[pos]
+        else:
+            edited.insert(pos, _line(rnd, -pos))
+    return "".join(lines), "".join(edited)
+
+
+def _line(rnd: random.Random, i: int) -> str:
+    """Return a line like those of source code: some repeated, most unique."""
+    if rnd.random() < 0.2:
+        return rnd.choice(["\n", "}\n", "    }\n", "        return None\n"])
+    return f"    value_{i} = compute({rnd.randrange(1000)}, {i})\n"
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [10000, 100000, 1000000])
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+"""Benchmark the compiled '.vcignore' matcher against thousands of patterns.
+
+A synthetic ignore file mixing literal names, '*.ext' suffixes, anchored
+globs, directory patterns and negations is compiled, then random paths are
+checked against it. For comparison, the same paths are checked by trying
+each pattern in turn, as a regular expression, as the old matcher did.
+
+Usage: PYTHONPATH=. python3 tools/bench_ignore.py [patterns] [paths]
+"""
+
+import re
+import sys
+import random
+import time
+from typing import List
+from vc.impl.ignore import IgnoreRules, _translate
+
+
+def main(npatterns: int, npaths: int) -> None:
+    rnd = random.Random(42)
+    patterns = []
+    for i in range(npatterns):
+        kind = i % 5
+        if kind == 0:
+            patterns.append(f"name{i}.txt")
+        elif kind == 1:
+            patterns.append(f"*.ext{i}")
+        elif kind == 2:
+            patterns.append(f"src/m{i}/*.gen")
+        elif kind == 3:
+            patterns.append(f"cache{i}/")
+        else:
+            patterns.append(f"tmp{i}_?.[ch]")
+    patterns.append("!name0.txt")
+    paths = []
+    for _ in range(npaths):
+        i = rnd.randrange(npatterns * 2)
+        name = rnd.choice([f"name{i}.txt", f"f.ext{i}", f"x.gen", f"tmp{i}_1.c", "a.py"])
+        paths.append(f"src/m{i}/{name}")
+
+    start = time.perf_counter()
+    rules = IgnoreRules("\n".join(patterns))
+    compile_time = time.perf_counter() - start
+    start = time.perf_counter()
+    ignored = sum(1 for p in paths if rules.match(p, False))
+    _report("compiled", npaths, time.perf_counter() - start, ignored)
+    print(f"{'':12} compiled {len(patterns)} patterns in {compile_time:.3f}s")
+
+    sample = paths[: max(1, npaths // 2000)]
+    start = time.perf_counter()
+    ignored = sum(1 for p in sample if _naive(patterns, p))
+    _report("one by one", len(sample), time.perf_counter() - start, ignored)
+
+
+def _naive(patterns: List[str], path: str) -> bool:
+    name = path.split("/")[-1]
+    ret = False
+    for p in patterns:
+        negated = p.startswith("!")
+        p = p.lstrip("!").rstrip("/")
+        if re.match(f"^{_translate(p)}$", path if "/" in p else name):
+            ret = not negated
+    return ret
+
+
+def _report(name: str, n: int, elapsed: float, ignored: int) -> None:
+    print(f"{name:12} {n / elapsed:12.0f} matches/s ({ignored} of {n} ignored)")
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:]]
+    main(*(args + [5000, 100000][len(args) :]))
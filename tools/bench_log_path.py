@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+"""Benchmark path-limited 'vc log' over a long synthetic history.
+
+A history of the given number of commits (100000 by default) is written
+directly to the object db: each commit changes one file out of 1000, in
+100 directories. 'log -- <path>' is then timed without commit-graph, with
+the commit-graph and with the changed-path filters too. With the filters,
+only the commits which may have changed the path have their trees read,
+so the time should be close to that of a plain walk over the graph.
+
+Usage: PYTHONPATH=. python3 tools/bench_log_path.py [commits]
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import time
+from vc.api import DBObjectType
+from vc.impl import create_repo
+from vc.impl.commitgraph import GRAPH_FILE
+from vc.impl.bloom import BLOOM_FILE
+
+NDIRS = 100
+NFILES = 10
+PATH = "d7/f1.txt"  # Changed by one commit out of 100
+
+
+def main(ncommits: int) -> None:
+    root = tempfile.mkdtemp()
+    try:
+        repo = create_repo(root, True)
+        repo.init_repo()
+        os.chdir(root)
+        start = time.perf_counter()
+        write_history(repo.db, ncommits)
+        print(f"{ncommits} commits written in {time.perf_counter() - start:.1f}s")
+
+        timed(repo, "no commit-graph")
+        start = time.perf_counter()
+        repo.write_commit_graph()
+        print(f"commit-graph written in {time.perf_counter() - start:.1f}s")
+        timed(repo, "commit-graph")
+        start = time.perf_counter()
+        repo.write_commit_graph(changed_paths=True)
+        print(f"commit-graph and filters written in {time.perf_counter() - start:.1f}s")
+        timed(repo, "changed-path filters")
+        size = os.path.getsize(f"{root}/.vc/{BLOOM_FILE}")
+        gsize = os.path.getsize(f"{root}/.vc/{GRAPH_FILE}")
+        print(f"commit-graph: {gsize / 1e6:.1f}MB, filters: {size / 1e6:.1f}MB")
+    finally:
+        shutil.rmtree(root)
+
+
+def write_history(db, ncommits: int) -> None:
+    """Write ncommits linear commits, each one changing a single file."""
+    dirs = {
+        f"d{d}": {f"d{d}/f{f}.txt": db.put("initial\n") for f in range(NFILES)}
+        for d in range(NDIRS)
+    }
+    dir_keys = {d: db.put(_tree(files, "f"), DBObjectType.TREE) for d, files in dirs.items()}
+    parent = ""
+    for i in range(ncommits):
+        d = f"d{(i * 7) % NDIRS}"
+        dirs[d][f"{d}/f{i % NFILES}.txt"] = db.put(f"version {i}\n")
+        dir_keys[d] = db.put(_tree(dirs[d], "f"), DBObjectType.TREE)
+        tree = db.put(_tree(dir_keys, "d"), DBObjectType.TREE)
+        commit = f"tree {tree}\n"
+        if parent:
+            commit += f"parent {parent}\n"
+        ident = f"bench <bench@example.com> {1_000_000_000 + i} +0000"
+        commit += f"author {ident}\ncommitter {ident}\n\ncommit {i}\n"
+        parent = db.put(commit, DBObjectType.COMMIT)
+    with open(".vc/refs/heads/master", "w") as f:
+        f.write(parent)
+
+
+def timed(repo, label: str) -> None:
+    start = time.perf_counter()
+    log = repo.iter_log(paths=[PATH])
+    next(log)
+    first = time.perf_counter() - start
+    n = 1 + sum(1 for _ in log)
+    total = time.perf_counter() - start
+    print(f"{label:>22}: {n} commits, first after {first * 1000:.1f}ms, all in {total:.2f}s")
+
+
+def _tree(entries, typ: str) -> str:
+    return "".join(f"{typ} {key} {name}\n" for name, key in sorted(entries.items()))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
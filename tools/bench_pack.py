@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+"""Benchmark on-disk size and read latency of loose objects vs packs.
+
+A synthetic history of successive revisions of a large text file is written
+as loose objects, then packed without and with deltas. For each layout, the
+total size and the average time to read every revision are reported.
+
+Usage: PYTHONPATH=. python3 tools/bench_pack.py [revisions] [lines]
+"""
+
+import os
+import sys
+import glob
+import random
+import shutil
+import tempfile
+import time
+from typing import List
+from vc.impl.db import DB
+from vc.impl.fs import create_vc_root_dir
+
+
+def main(revisions: int, nlines: int) -> None:
+    rnd = random.Random(42)
+    root = tempfile.mkdtemp()
+    try:
+        vc_dir = create_vc_root_dir(root)
+        db = DB(vc_dir)
+        lines = [f"{i:08} {rnd.getrandbits(128):032x}\n" for i in range(nlines)]
+        keys = []
+        for _ in range(revisions):
+            for _ in range(10):
+                lines[rnd.randrange(len(lines))] = f"edit {rnd.getrandbits(64):016x}\n"
+            lines.insert(rnd.randrange(len(lines)), f"new {rnd.getrandbits(64):016x}\n")
+            keys.append(db.put("".join(lines)))
+        hints = {k: "file.txt" for k in keys}
+
+        _report("loose", _size(vc_dir), _read_all(DB(vc_dir), keys))
+        db.repack(hints=hints, window=0)
+        _report("pack", _size(vc_dir), _read_all(DB(vc_dir), keys))
+        db.repack(all_objects=True, hints=hints)
+        fresh = DB(vc_dir)
+        _report("pack+delta", _size(vc_dir), _read_all(fresh, keys))
+        _report("pack+delta (warm)", _size(vc_dir), _read_all(fresh, keys))
+    finally:
+        shutil.rmtree(root)
+
+
+def _size(vc_dir: str) -> int:
+    files = glob.glob(vc_dir + "/objects/**/*", recursive=True)
+    return sum(os.path.getsize(f) for f in files if os.path.isfile(f))
+
+
+def _read_all(db: DB, keys: List[str]) -> float:
+    start = time.perf_counter()
+    for k in reversed(keys):  # Newest first, as 'log' and 'checkout' would
+        db.get(k)
+    return (time.perf_counter() - start) / len(keys)
+
+
+def _report(name: str, size: int, latency: float) -> None:
+    print(f"{name:20} {size / 1024:10.1f} KiB {latency * 1000:8.3f} ms/read")
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:]]
+    main(*(args + [200, 20000][len(args) :]))
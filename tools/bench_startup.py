@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+"""Benchmark the startup of 'vc status' in an empty repo.
+
+'vc status' is run several times (5 by default) with 'python -X importtime',
+printing the time spent importing the modules from vc on in each run and
+the modules that took longest to import in the fastest one. Exits with an
+error if the fastest run is over the budget, in milliseconds (BUDGET_MS by
+default). tests/test_startup.py checks which modules are imported.
+
+Usage: PYTHONPATH=. python3 tools/bench_startup.py [runs [budget_ms]]
+"""
+
+import os
+import sys
+import shutil
+import subprocess
+import tempfile
+from typing import Dict, Tuple
+from vc.impl import create_repo
+
+# Import time of 'vc status' in an empty repo, measured at about 55ms: the
+# budget leaves room for slower machines, but not for pulling in every
+# command or the worker pools again (which took it to over 90ms)
+BUDGET_MS = 150
+TOP = 15
+
+
+def import_times(cwd: str) -> Tuple[int, Dict[str, Tuple[int, int]]]:
+    """Run 'vc status' in cwd, returning the time importing vc and each module's (us).
+
+    The times of the modules are their self and cumulative ones. The total
+    is the sum of the top level modules imported from vc on, as the command
+    modules are imported through importlib, whose imports aren't reported.
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    res = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "vc", "status"],
+        cwd=cwd,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    total = 0
+    ret: Dict[str, Tuple[int, int]] = {}
+    for line in res.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            own, cumulative, module = line[len("import time:") :].split("|")
+            if not own.strip().isdigit():
+                continue
+            ret[module.strip()] = (int(own), int(cumulative))
+            if "vc" in ret and not module.startswith("  "):  # Top level
+                total += int(cumulative)
+    return total, ret
+
+
+def main(runs: int, budget_ms: int) -> None:
+    root = tempfile.mkdtemp()
+    try:
+        create_repo(root, True).init_repo()
+        results = [import_times(root) for _ in range(runs)]
+    finally:
+        shutil.rmtree(root)
+    for i, (total, _) in enumerate(results):
+        print(f"run {i + 1}: {total / 1000:.1f}ms")
+    total, fastest = min(results, key=lambda r: r[0])
+    print(f"\n{len(fastest)} modules imported. Slowest (self, cumulative):")
+    for module, (own, cumulative) in sorted(fastest.items(), key=lambda m: -m[1][0])[:TOP]:
+        print(f"  {own / 1000:6.1f}ms {cumulative / 1000:6.1f}ms  {module}")
+    total_ms = total / 1000
+    if total_ms >= budget_ms:
+        print(f"\nOver budget: {total_ms:.1f}ms >= {budget_ms}ms", file=sys.stderr)
+        sys.exit(1)
+    print(f"\nWithin budget: {total_ms:.1f}ms < {budget_ms}ms")
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:]]
+    main(args[0] if args else 5, args[1] if len(args) > 1 else BUDGET_MS)
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+"""Benchmark 'vc status' on unchanged trees of growing size.
+
+For each size, a synthetic tree of small files is staged and committed,
+then 'status' is timed. The cost per file should stay flat as the tree
+grows; a quadratic lookup shows up as a growing cost per file.
+
+Usage: PYTHONPATH=. python3 tools/bench_status.py [files ...]
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import time
+from typing import List
+from vc.impl import create_repo
+
+PAST_NS = 1_000_000_000  # Files older than the index, so their stat is trusted
+
+
+def main(sizes: List[int]) -> None:
+    for nfiles in sizes:
+        root = tempfile.mkdtemp()
+        try:
+            for i in range(nfiles):
+                d = f"{root}/src/d{i % 97}"
+                os.makedirs(d, exist_ok=True)
+                fn = f"{d}/f{i}.txt"
+                with open(fn, "w") as f:
+                    f.write(f"contents of file {i}\n")
+                os.utime(fn, ns=(PAST_NS, PAST_NS))
+            repo = create_repo(root, True)
+            os.chdir(root)
+            repo.index.stage_files(["src"])
+            repo.index.commit("Initial import")
+
+            start = time.perf_counter()
+            st = repo.status()
+            elapsed = time.perf_counter() - start
+            assert not st.staged and not st.not_staged
+            print(
+                f"{nfiles:8} files: status in {elapsed:8.3f}s"
+                + f" {elapsed / nfiles * 1e6:7.2f} us/file"
+            )
+        finally:
+            os.chdir(tempfile.gettempdir())
+            shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [1000, 10000, 50000, 200000])
@@ -3,7 +3,12 @@
 """Entry point to the vc module."""
 
 import sys
-from .cli.main import main
+from .cli.daemon import forward
 
 if __name__ == "__main__":
+    code = forward(sys.argv)  # Run by the daemon of the repo, if there's one
+    if code is not None:
+        sys.exit(code)
+    from .cli.main import main
+
     main(sys.argv)
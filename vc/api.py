@@ -1,7 +1,17 @@
 """Protocols for the different components of the VC."""
 
 from dataclasses import dataclass
-from typing import Protocol, List, Optional, NamedTuple, Dict, Union, Tuple
+from typing import (
+    Protocol,
+    List,
+    Optional,
+    NamedTuple,
+    Dict,
+    Union,
+    Tuple,
+    BinaryIO,
+    Iterator,
+)
 from enum import Enum
 
 
@@ -36,24 +46,58 @@ class FileWithStatus:
 FileType = str  # "f" or "d" FIXME: make it typesafe
 
 
+class StatData(NamedTuple):
+    """Metadata of a file, used to detect changes without reading it."""
+
+    mtime_ns: int
+    ctime_ns: int
+    size: int
+    ino: int
+    mode: int
+
+
 @dataclass
 class DirEntry:
-    """Entry of a directory. It has a name, a type and an optional hash."""
+    """Entry of a directory. It has a name, a type and an optional hash.
+
+    estat is the metadata the file had when ehash was calculated, if known.
+    """
 
     ename: FileName
     etype: FileType
     ehash: Key
+    estat: Optional[StatData] = None
 
 
 class DirDict(Dict[DirName, List[DirEntry]]):
-    """Dict mapping directories to the list of their contents."""
+    """Dict mapping directories to the list of their contents.
+
+    Lookups by file name use an index of all the entries, built on first use.
+    Entries must be added with add_entry (or by setting whole directories) to
+    keep it up to date.
+    """
+
+    _by_name: Optional[Dict[FileName, DirEntry]] = None
+
+    def __setitem__(self, d: DirName, entries: List[DirEntry]) -> None:
+        """Set the entries of the directory d."""
+        super().__setitem__(d, entries)
+        self._by_name = None
+
+    def __delitem__(self, d: DirName) -> None:
+        """Remove the directory d and its entries."""
+        super().__delitem__(d)
+        self._by_name = None
+
+    def add_entry(self, d: DirName, entry: DirEntry) -> None:
+        """Add the entry to the directory d, creating it if needed."""
+        self.setdefault(d, []).append(entry)
+        if self._by_name is not None:
+            self._by_name.setdefault(entry.ename, entry)
 
     def contains_file(self, f: FileName) -> bool:
         """Return True is the DirTree contains the given file."""
-        for _, fs in self.items():
-            if f in [fl.ename for fl in fs]:
-                return True
-        return False
+        return f in self._index()
 
     def all_file_names(self) -> List[FileName]:
         """Return all the (complete) file names in this DirTree."""
@@ -66,11 +110,15 @@ class DirDict(Dict[DirName, List[DirEntry]]):
 
     def find_entry(self, f: FileName) -> Optional[DirEntry]:
         """Find the entry for the given filename and return it."""
-        for _, fs in self.items():
-            for fl in fs:
-                if fl.ename == f:
-                    return fl
-        return None  # FIXME: implement contains_file on top of this method
+        return self._index().get(f)
+
+    def _index(self) -> Dict[FileName, DirEntry]:
+        if self._by_name is None:
+            self._by_name = {}
+            for fs in self.values():
+                for fl in fs:
+                    self._by_name.setdefault(fl.ename, fl)
+        return self._by_name
 
 
 #####################################
@@ -88,6 +136,10 @@ class DBObjectType(Enum):
 DBObjectKey = str
 
 
+class AmbiguousKeyError(FileNotFoundError):
+    """A partial key matches more than one object."""
+
+
 @dataclass
 class DBObject:
     """Representation of an object in the DB."""
@@ -115,10 +167,25 @@ class PObjectDB(Protocol):
         """
         ...
 
+    def put_stream(
+        self, fileobj: BinaryIO, size: int, typ: DBObjectType = DBObjectType.BLOB
+    ) -> DBObjectKey:
+        """Store the size bytes read from fileobj, returning their key.
+
+        Same as 'put', but without keeping the whole contents in memory.
+        """
+        ...
+
     def calculate_key(self, content: bytes):
         """Calculate the key for a given contents, same as in 'put'."""
         ...
 
+    def calculate_key_stream(
+        self, fileobj: BinaryIO, size: int, typ: DBObjectType = DBObjectType.BLOB
+    ) -> DBObjectKey:
+        """Calculate the key for the size bytes read from fileobj, as 'put_stream'."""
+        ...
+
     def get(self, key: str) -> DBObject:
         """Get the contents associated with a key.
 
@@ -127,14 +194,35 @@ class PObjectDB(Protocol):
         ...
 
     def get_full_key(self, commit_id: str) -> str:
-        """Return the full key from a partial key."""
+        """Return the full key from a partial key.
+
+        Raise a FileNotFoundError if not found, or an AmbiguousKeyError if
+        more than one object matches.
+        """
+        ...
+
+    def repack(
+        self, all_objects: bool = False, hints: Optional[Dict[str, str]] = None
+    ) -> int:
+        """Move the loose objects into a pack, returning how many were packed.
+
+        If all_objects is True, the existing packs are merged into the new one.
+        hints maps object keys to paths, to choose good delta bases.
+        """
         ...
 
 
 #####################################
 # Index (staging area)
 #####################################
-IndexEntry = NamedTuple("IndexEntry", [("key", str), ("type", str), ("name", str)])
+class IndexEntry(NamedTuple):
+    """Entry of the index, with the metadata of the file when staged (if known)."""
+
+    key: str
+    type: str
+    name: str
+    stat: Optional[StatData] = None
+
 
 IndexStatus = NamedTuple(
     "IndexStatus",
@@ -158,6 +246,13 @@ class PIndex(Protocol):
         """
         ...
 
+    def stage_files(self, paths: List[str], workers: Optional[int] = None) -> None:
+        """Stage the given files and directories (recursively) to the index file.
+
+        The index is written only once, and the files may be hashed in parallel.
+        """
+        ...
+
     def unstage_file(self, fil: str):
         """Unstages the file, from the file, reverting it to the previous state."""
         ...
@@ -199,6 +294,17 @@ class RepoStatus:
     staged: List[FileWithStatus]
 
 
+@dataclass
+class CheckoutResult:
+    """Outcome of a checkout: the commit message and what had to change."""
+
+    message: str  # First line of the commit message
+    detached: bool
+    files_written: int = 0
+    bytes_written: int = 0
+    files_removed: int = 0
+
+
 @dataclass
 class LogEntry:
     """Represent an entry in the 'log'."""
@@ -218,15 +324,42 @@ class PRepo(Protocol):
         """Return the log entries for the current HEAD."""
         ...
 
+    def iter_log(
+        self,
+        revisions: Optional[List[str]] = None,
+        max_count: Optional[int] = None,
+        since: Optional[int] = None,
+        first_parent: bool = False,
+        topo_order: bool = False,
+        paths: Optional[List[str]] = None,
+    ) -> Iterator[LogEntry]:
+        """Yield the log entries for the revisions, as they are found.
+
+        revisions are commits or branches ('HEAD' if none is given), with
+        'A..B' meaning the commits in B but not in A, and '^A' excluding
+        the commits in A. Entries come newest first, by commit date or,
+        with topo_order, never before their descendants. first_parent only
+        follows the first parent of merges. since is a timestamp: older
+        commits are left out. With paths, only the commits changing some of
+        them (compared to their first parent) are yielded. Raise an
+        Exception for unknown revisions.
+        """
+        ...
+
     def checkout(
-        self, commit_id_or_branch: str, create_branch: bool = False
-    ) -> Tuple[str, bool]:
-        """Checkout the commit and return its short message.
-
-        Any errors are thrown as an exception, with a message ready to
-        be shown to the end user. if create_branch is true, commit_id_or_branch
-        is assumed to be the name of a branch which will be created if it doesn't
-        exist.
+        self,
+        commit_id_or_branch: str,
+        create_branch: bool = False,
+        workers: Optional[int] = None,
+    ) -> CheckoutResult:
+        """Checkout the commit and return its short message, and what changed.
+
+        Only the files which differ between HEAD and the commit are written
+        or removed, by 'workers' threads (by default, a fixed number), and
+        the changes staged for other files are kept. Any errors are thrown as an exception, with a message ready
+        to be shown to the end user. if create_branch is true,
+        commit_id_or_branch is assumed to be the name of a branch which will
+        be created if it doesn't exist.
         """
         ...
 
@@ -261,14 +394,83 @@ class PRepo(Protocol):
         """List the existing branches.."""
         ...
 
-    def diff(self, files: List[str]) -> List[str]:
+    def diff(
+        self,
+        files: List[str],
+        revisions: Optional[List[str]] = None,
+        cached: bool = False,
+        context: int = 3,
+        algorithm: str = "myers",
+    ) -> List[str]:
         """Calculates the diff for the given list of files.
 
         If the list is empty, provide the diff for all files.
         By default, the diff is between the file in the workdir and the head.
+        With two revisions, the diff is between those commits; with one, from
+        the commit to the workdir. With cached, from the commit (or HEAD)
+        to the index. Raise an Exception for unknown revisions.
+        Diffs are unified, with context lines around the changes, computed
+        with the algorithm ("myers" or "histogram"). Binary files (with a NUL
+        in their first bytes) are only reported to differ.
         """
         ...
 
+    def iter_diff(
+        self,
+        files: List[str],
+        revisions: Optional[List[str]] = None,
+        cached: bool = False,
+        context: int = 3,
+        algorithm: str = "myers",
+    ) -> Iterator[str]:
+        """Yield the diff of each changed file, as 'diff' but one file at a time.
+
+        The arguments are checked (and revisions resolved) before returning.
+        """
+        ...
+
+    def repack(self, all_objects: bool = False) -> int:
+        """Pack the objects of the repo, returning how many were packed.
+
+        Objects are delta compressed against other revisions of the same path.
+        """
+        ...
+
+    def write_commit_graph(self, changed_paths: bool = False) -> int:
+        """Write the commit-graph file, returning the number of commits in it.
+
+        The commit-graph lets history walks avoid reading commit objects.
+        With changed_paths (or if they were already written), Bloom filters
+        of the paths changed by each commit are written too, for 'log <path>'.
+        """
+        ...
+
+    def pack_refs(self) -> int:
+        """Move the branches into the packed-refs file, returning how many it has.
+
+        Branches are still written as loose refs, which override packed ones.
+        """
+        ...
+
+    def merge_base(self, commit1: str, commit2: str) -> List[str]:
+        """Return the best common ancestors of the two commits (or branches)."""
+        ...
+
+    def is_ancestor(self, ancestor: str, commit: str) -> bool:
+        """Return True if ancestor is commit or one of its ancestors."""
+        ...
+
+    def start_fsmonitor(self) -> bool:
+        """Start the filesystem monitor, returning False if already running.
+
+        While it runs, status and diff only check the files it reports as changed.
+        """
+        ...
+
+    def stop_fsmonitor(self) -> bool:
+        """Stop the filesystem monitor, returning False if it wasn't running."""
+        ...
+
     @property
     def db(self) -> PObjectDB:
         """Return the db used by this repo."""
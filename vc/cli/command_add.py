@@ -27,5 +27,4 @@ class AddCommand(PCommandProcessor):
         require_initialized_repo(self.repo)
         r = self.parser.parse_args(args)
 
-        for f in r.files:
-            self.repo.index.stage_file(f)
+        self.repo.index.stage_files(r.files)
@@ -3,7 +3,7 @@
 import argparse
 import sys
 from typing import List
-from ..api import PCommandProcessor, PRepo
+from ..api import PCommandProcessor, PRepo, AmbiguousKeyError
 from .util import require_initialized_repo
 
 
@@ -38,6 +38,9 @@ class CatFileCommand(PCommandProcessor):
         hsh = r.hash
         try:
             ob = self.repo.db.get(hsh)
+        except AmbiguousKeyError:
+            print(f"error: short object ID {hsh} is ambiguous", file=sys.stderr)
+            ob = None
         except FileNotFoundError:
             ob = None
         if r.e:
@@ -18,6 +18,17 @@ class CheckoutCommand(PCommandProcessor):
         parser = argparse.ArgumentParser()
         parser.add_argument("commit_id", nargs=1)
         parser.add_argument("-b", "--branch", action="store_true")
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            type=int,
+            help="Number of threads writing files",
+        )
+        parser.add_argument(
+            "--stats",
+            action="store_true",
+            help="Show how many files were written and removed",
+        )
         try:
             self.parser = parser
         except Exception:
@@ -36,8 +47,13 @@ class CheckoutCommand(PCommandProcessor):
             return
 
         try:
-            message, detached = self.repo.checkout(r.commit_id[0], r.branch)
-            _print_success(r.commit_id[0], detached, message)
+            res = self.repo.checkout(r.commit_id[0], r.branch, r.jobs)
+            _print_success(r.commit_id[0], res.detached, res.message)
+            if r.stats:
+                print(
+                    f"Updated {res.files_written} files ({res.bytes_written} bytes), "
+                    + f"removed {res.files_removed} files"
+                )
         except Exception as e:
             print(f"{e}", file=sys.stderr)
 
@@ -0,0 +1,37 @@
+"""'commit-graph' command."""
+
+import argparse
+from typing import List
+from ..api import PCommandProcessor, PRepo
+from .util import require_initialized_repo
+
+
+class CommitGraphCommand(PCommandProcessor):
+    """Implementation of the 'commit-graph' command."""
+
+    repo: PRepo
+
+    def __init__(self, repo: PRepo):
+        """Initialize object, preparing the parser."""
+        self.repo = repo
+        parser = argparse.ArgumentParser(
+            description="Write the commit-graph file, to speed up history walks"
+        )
+        parser.add_argument("action", choices=["write"])
+        parser.add_argument(
+            "--changed-paths",
+            action="store_true",
+            help="Also write Bloom filters of the paths changed by each commit",
+        )
+        self.parser = parser
+
+    @property
+    def key(self):
+        return "commit-graph"
+
+    def process_command(self, args: List[str]) -> None:
+        """Process the command with the given args."""
+        require_initialized_repo(self.repo)
+        r = self.parser.parse_args(args)
+        n = self.repo.write_commit_graph(r.changed_paths)
+        print(f"Wrote {n} commits to the commit-graph")
@@ -0,0 +1,45 @@
+"""'daemon' command."""
+
+import argparse
+from typing import List
+from ..api import PCommandProcessor, PRepo
+from ..impl.fs import find_vc_root_dir
+from . import daemon
+from .util import require_initialized_repo
+
+
+class DaemonCommand(PCommandProcessor):
+    """Implementation of the 'daemon' command."""
+
+    repo: PRepo
+
+    def __init__(self, repo: PRepo):
+        """Initialize object, preparing the parser."""
+        self.repo = repo
+        parser = argparse.ArgumentParser(
+            description="Start or stop the daemon, which runs the commands in this repo"
+            + " without starting vc for each one"
+        )
+        parser.add_argument("action", choices=["start", "stop"])
+        self.parser = parser
+
+    @property
+    def key(self):
+        return "daemon"
+
+    def process_command(self, args: List[str]) -> None:
+        """Process the command with the given args."""
+        require_initialized_repo(self.repo)
+        r = self.parser.parse_args(args)
+        root = find_vc_root_dir()
+        assert root is not None
+        if r.action == "start":
+            if daemon.start(root):
+                print("Daemon started")
+            else:
+                print("Daemon already running")
+        else:
+            if daemon.stop(root):
+                print("Daemon stopped")
+            else:
+                print("Daemon not running")
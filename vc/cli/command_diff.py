@@ -1,10 +1,12 @@
 """'diff' command."""
 
+import os
 import sys
 import argparse
-from typing import List
+from typing import List, Optional
 from ..api import PCommandProcessor, PRepo
-from .util import require_initialized_repo
+from ..impl.linediff import ALGORITHMS
+from .util import discard_stdout, require_initialized_repo
 
 
 class DiffCommand(PCommandProcessor):
@@ -15,7 +17,31 @@ class DiffCommand(PCommandProcessor):
         self.repo = repo
 
         parser = argparse.ArgumentParser()
-        parser.add_argument("files", nargs="*")
+        parser.add_argument(
+            "--cached",
+            "--staged",
+            action="store_true",
+            help="Show the changes in the index, from HEAD or the given commit",
+        )
+        parser.add_argument(
+            "-U",
+            "--unified",
+            type=int,
+            default=3,
+            metavar="<n>",
+            help="Number of lines of context around the changes",
+        )
+        parser.add_argument(
+            "--diff-algorithm",
+            choices=ALGORITHMS,
+            default="myers",
+            help="Algorithm to compute the diffs with",
+        )
+        parser.add_argument(
+            "files",
+            nargs="*",
+            help="Commits to compare (at most two), then the files to limit the diff to",
+        )
         try:
             self.parser = parser
         except Exception:
@@ -29,20 +55,36 @@ class DiffCommand(PCommandProcessor):
 
     def process_command(self, args: List[str]) -> None:
         """Process the command with the given args."""
-        # FIXME: implement option to specify files
         require_initialized_repo(self.repo)
+        paths: Optional[List[str]] = None
+        if "--" in args:
+            args, paths = args[: args.index("--")], args[args.index("--") + 1 :]
         r = self.parser.parse_args(args)
         if r.__contains__("h"):
             self.parser.print_help(sys.stderr)
             return
 
+        revisions: List[str] = r.files
+        if paths is None:  # Leading arguments which are not files are commits
+            n = 0
+            while n < len(r.files) and not os.path.exists(r.files[n]):
+                n += 1
+            revisions, paths = r.files[:n], r.files[n:]
         try:
-            diff = self.repo.diff(r.files)
-            for e in diff:
-                print(e, end="")
+            diff = self.repo.iter_diff(
+                paths, revisions, r.cached, r.unified, r.diff_algorithm
+            )
+            for e in diff:  # Printed as each file is diffed
+                print(e, end="", flush=True)
+        except BrokenPipeError:  # The reader is gone (ex. 'vc diff | head')
+            discard_stdout()
+            exit(0)
         except FileNotFoundError:
             print(
                 "fatal: not a vc repository (or any of the parent directories): .vc",
                 file=sys.stderr,
             )
             exit(1)
+        except Exception as e:
+            print(f"{e}", file=sys.stderr)
+            exit(128)
@@ -0,0 +1,40 @@
+"""'fsmonitor' command."""
+
+import argparse
+from typing import List
+from ..api import PCommandProcessor, PRepo
+from .util import require_initialized_repo
+
+
+class FsMonitorCommand(PCommandProcessor):
+    """Implementation of the 'fsmonitor' command."""
+
+    repo: PRepo
+
+    def __init__(self, repo: PRepo):
+        """Initialize object, preparing the parser."""
+        self.repo = repo
+        parser = argparse.ArgumentParser(
+            description="Start or stop the filesystem monitor, which speeds up status"
+        )
+        parser.add_argument("action", choices=["start", "stop"])
+        self.parser = parser
+
+    @property
+    def key(self):
+        return "fsmonitor"
+
+    def process_command(self, args: List[str]) -> None:
+        """Process the command with the given args."""
+        require_initialized_repo(self.repo)
+        r = self.parser.parse_args(args)
+        if r.action == "start":
+            if self.repo.start_fsmonitor():
+                print("Filesystem monitor started")
+            else:
+                print("Filesystem monitor already running")
+        else:
+            if self.repo.stop_fsmonitor():
+                print("Filesystem monitor stopped")
+            else:
+                print("Filesystem monitor not running")
@@ -1,9 +1,11 @@
 """'hash-object' command."""
 
 import argparse
+import os.path
 import sys
 from typing import List
 from ..api import PCommandProcessor, PRepo
+from ..impl.db import STREAM_THRESHOLD
 from .util import require_initialized_repo
 
 
@@ -50,6 +52,14 @@ class HashObjectCommand(PCommandProcessor):
             if r.file is None:
                 self.parser.print_help(sys.stderr)
                 return
+            size = os.path.getsize(fil)
+            if size >= STREAM_THRESHOLD:
+                with open(fil, "rb") as f:
+                    if r.w:
+                        print(self.repo.db.put_stream(f, size))
+                    else:
+                        print(self.repo.db.calculate_key_stream(f, size))
+                return
             with open(fil, "rb") as f:
                 content = f.read()
 
@@ -1,10 +1,15 @@
 """'log' command."""
 
+import re
 import sys
+import time
 import argparse
+from datetime import datetime
 from typing import List
 from ..api import PCommandProcessor, PRepo
-from .util import require_initialized_repo
+from .util import discard_stdout, require_initialized_repo
+
+_UNITS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400, "week": 604800}
 
 
 class LogCommand(PCommandProcessor):
@@ -17,7 +22,30 @@ class LogCommand(PCommandProcessor):
 
         parser = argparse.ArgumentParser()
         parser.add_argument("--oneline", action="store_true")
-        parser.add_argument("files", nargs="*")
+        parser.add_argument(
+            "-n", "--max-count", type=int, help="Show at most this number of commits"
+        )
+        parser.add_argument(
+            "--since",
+            type=_parse_date,
+            help="Show commits more recent than a date ('2024-01-31', '2 weeks ago')",
+        )
+        parser.add_argument(
+            "--first-parent",
+            action="store_true",
+            help="Follow only the first parent of merge commits",
+        )
+        parser.add_argument(
+            "--topo-order",
+            action="store_true",
+            help="Show no parents before all of their children",
+        )
+        parser.add_argument(
+            "--date-order",
+            action="store_true",
+            help="Show commits by commit date (the default)",
+        )
+        parser.add_argument("revisions", nargs="*", help="Commits, branches or A..B")
         try:
             self.parser = parser
         except Exception:
@@ -29,13 +57,38 @@ class LogCommand(PCommandProcessor):
 
     def process_command(self, args: List[str]) -> None:
         """Process the command with the given args."""
-        # FIXME: implement option to specify files
         require_initialized_repo(self.repo)
+        paths: List[str] = []
+        if "--" in args:
+            args, paths = args[: args.index("--")], args[args.index("--") + 1 :]
         r = self.parser.parse_args(args)
         if r.__contains__("h"):
             self.parser.print_help(sys.stderr)
             return
 
-        log = self.repo.log()
-        for le in log:
-            print(f"{le.key[0:6]} {le.comment}")
+        try:
+            log = self.repo.iter_log(
+                r.revisions, r.max_count, r.since, r.first_parent, r.topo_order, paths
+            )
+        except Exception as e:
+            print(f"{e}", file=sys.stderr)
+            exit(128)
+        try:
+            for le in log:
+                print(f"{le.key[0:6]} {le.comment}")
+        except BrokenPipeError:  # The reader is gone (ex. 'vc log | head')
+            discard_stdout()
+            exit(0)
+
+
+def _parse_date(s: str) -> int:
+    """Return the timestamp for a date, a timestamp or an 'N units ago' string."""
+    if s.isdigit():
+        return int(s)
+    m = re.fullmatch(r"(\d+)[ .]([a-z]+?)s?[ .]ago", s.strip())
+    if m and m.group(2) in _UNITS:
+        return int(time.time()) - int(m.group(1)) * _UNITS[m.group(2)]
+    try:
+        return int(datetime.fromisoformat(s).timestamp())
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid date: '{s}'")
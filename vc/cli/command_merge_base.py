@@ -0,0 +1,51 @@
+"""'merge-base' command."""
+
+import sys
+import argparse
+from typing import List
+from ..api import PCommandProcessor, PRepo
+from .util import require_initialized_repo
+
+
+class MergeBaseCommand(PCommandProcessor):
+    """Implementation of the 'merge-base' command."""
+
+    repo: PRepo
+
+    def __init__(self, repo: PRepo):
+        """Initialize object, preparing the parser."""
+        self.repo = repo
+        parser = argparse.ArgumentParser(
+            description="Find the best common ancestors of two commits"
+        )
+        parser.add_argument("commit1")
+        parser.add_argument("commit2")
+        parser.add_argument(
+            "--is-ancestor",
+            action="store_true",
+            help="Exit with 0 if commit1 is an ancestor of commit2, 1 if not",
+        )
+        parser.add_argument(
+            "-a", "--all", action="store_true", help="Output all the merge bases"
+        )
+        self.parser = parser
+
+    @property
+    def key(self):
+        return "merge-base"
+
+    def process_command(self, args: List[str]) -> None:
+        """Process the command with the given args."""
+        require_initialized_repo(self.repo)
+        r = self.parser.parse_args(args)
+        try:
+            if r.is_ancestor:
+                exit(0 if self.repo.is_ancestor(r.commit1, r.commit2) else 1)
+            bases = self.repo.merge_base(r.commit1, r.commit2)
+        except Exception as e:
+            print(f"{e}", file=sys.stderr)
+            exit(128)
+        if not bases:
+            exit(1)
+        for b in bases if r.all else bases[:1]:
+            print(b)
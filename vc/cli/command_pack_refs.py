@@ -0,0 +1,31 @@
+"""'pack-refs' command."""
+
+import argparse
+from typing import List
+from ..api import PCommandProcessor, PRepo
+from .util import require_initialized_repo
+
+
+class PackRefsCommand(PCommandProcessor):
+    """Implementation of the 'pack-refs' command."""
+
+    repo: PRepo
+
+    def __init__(self, repo: PRepo):
+        """Initialize object, preparing the parser."""
+        self.repo = repo
+        parser = argparse.ArgumentParser(
+            description="Move the branches into the packed-refs file"
+        )
+        self.parser = parser
+
+    @property
+    def key(self):
+        return "pack-refs"
+
+    def process_command(self, args: List[str]) -> None:
+        """Process the command with the given args."""
+        require_initialized_repo(self.repo)
+        self.parser.parse_args(args)
+        n = self.repo.pack_refs()
+        print(f"Packed {n} refs")
@@ -0,0 +1,37 @@
+"""'repack' command."""
+
+import argparse
+from typing import List
+from ..api import PCommandProcessor, PRepo
+from .util import require_initialized_repo
+
+
+class RepackCommand(PCommandProcessor):
+    """Implementation of the 'repack' command."""
+
+    repo: PRepo
+
+    def __init__(self, repo: PRepo):
+        """Initialize object, preparing the parser."""
+        self.repo = repo
+        parser = argparse.ArgumentParser(
+            description="Move loose objects into a pack file"
+        )
+        parser.add_argument(
+            "-a", action="store_true", help="Pack all objects into a single pack"
+        )
+        self.parser = parser
+
+    @property
+    def key(self):
+        return "repack"
+
+    def process_command(self, args: List[str]) -> None:
+        """Process the command with the given args."""
+        require_initialized_repo(self.repo)
+        r = self.parser.parse_args(args)
+        n = self.repo.repack(r.a)
+        if n == 0:
+            print("Nothing new to pack.")
+        else:
+            print(f"Packed {n} objects")
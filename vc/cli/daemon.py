@@ -0,0 +1,342 @@
+"""Daemon running the vc commands of a repo, to save starting each of them.
+
+Tools running many vc commands pay, for each one, for starting Python,
+importing vc and reading the repo. 'vc daemon start' starts a process for
+the repo which serves commands on a Unix socket, '.vc/daemon.sock', with a
+Repo built once: the modules are imported, the objects and parsed trees
+cached, the packs mapped and the index parsed.
+
+When the socket is there, 'python -m vc' is a thin client (this module
+imports little): it sends the arguments, working dir and environment, writes
+the output of the command to its stdout and stderr as it arrives and exits
+with its exit code. The command is run in the client if there's no daemon
+(or it can't be reached), if VC_NO_DAEMON is set, or if it can't run in the
+daemon (LOCAL_COMMANDS, and commands reading stdin).
+
+Other processes can modify the repo meanwhile, so nothing read from it is
+reused without checking it: the index and the packed refs are read again
+when their files change, the packs listed again when their dir changes
+(DB.refresh) and the loose objects on each command. Objects never change,
+so the cached ones are always valid.
+
+Commands are run one at a time, in the order they arrive. A command whose
+client goes away (ex. 'vc log | head') is stopped at its next output. The
+daemon runs the code it was started with: restart it after updating vc.
+
+Requests and responses are sequences of frames, each a kind and the length
+of its data. A request has frames with the arguments (b"a"), the working
+dir (b"d"), the variables of the environment (b"e", 'name=value') and the
+output encoding (b"o"), and ends with b"r" (run), b"p" (ping) or b"s"
+(stop). The response has frames with the output of the command, b"1"
+(stdout) and b"2" (stderr), and ends with b"x", with the exit code.
+"""
+
+from __future__ import annotations  # The annotations only need typing when checking
+import io
+import os
+import sys
+import struct
+import time
+
+TYPE_CHECKING = False  # As typing.TYPE_CHECKING: the client doesn't import typing
+if TYPE_CHECKING:
+    import socket
+    from typing import BinaryIO, Dict, List, Optional, Tuple
+    from ..api import PRepo
+
+SOCKET_FILE = "daemon.sock"
+NO_DAEMON_ENV = "VC_NO_DAEMON"
+LOCAL_COMMANDS = ["init", "daemon"]  # Always run in the client
+_VC_DIR = ".vc"  # fs.VC_DIR, which isn't imported to keep the client light
+_FRAME = struct.Struct(">cI")  # kind, data length
+_ARG = b"a"
+_CWD = b"d"
+_ENV = b"e"
+_ENCODING = b"o"
+_RUN = b"r"
+_PING = b"p"
+_STOP = b"s"
+_STDOUT = b"1"
+_STDERR = b"2"
+_EXIT = b"x"
+_BUFFER_SIZE = 64 * 1024
+
+
+def forward(args: List[str]) -> Optional[int]:
+    """Run the command in args (as sys.argv) in the daemon of the repo, if any.
+
+    Return its exit code, or None if the command must be run here.
+    """
+    if len(args) < 2 or args[1] in LOCAL_COMMANDS or "--stdin" in args:
+        return None
+    if os.environ.get(NO_DAEMON_ENV, "") not in ("", "0"):
+        return None
+    try:
+        cwd = os.getcwd()
+    except FileNotFoundError:
+        return None
+    root = _find_root(cwd)
+    if root is None:
+        return None
+    request = [(_ARG, os.fsencode(a)) for a in args]
+    request.append((_CWD, os.fsencode(cwd)))
+    request.extend((_ENV, k + b"=" + v) for k, v in os.environb.items())
+    request.append((_ENCODING, sys.stdout.encoding.encode()))
+    request.append((_RUN, b""))
+    return _request(root, request)
+
+
+def is_running(root: str) -> bool:
+    """Return True if the daemon of the repo at root answers."""
+    return _request(root, [(_PING, b"")]) is not None
+
+
+def start(root: str) -> bool:
+    """Start the daemon for the repo at root, in the background.
+
+    Return False if it was already running.
+    """
+    import subprocess
+
+    if is_running(root):
+        return False
+    pkg_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        p for p in [pkg_dir, env.get("PYTHONPATH", "")] if p
+    )
+    subprocess.Popen(
+        [sys.executable, "-m", "vc.cli.daemon", root],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+        env=env,
+    )
+    for _ in range(100):  # Wait until it answers
+        if is_running(root):
+            return True
+        time.sleep(0.05)
+    raise Exception("error: the vc daemon didn't start")
+
+
+def stop(root: str) -> bool:
+    """Stop the daemon for the repo at root, returning False if not running."""
+    return _request(root, [(_STOP, b"")]) is not None
+
+
+class ClientGone(BaseException):
+    """Raised writing the output of a command whose client is gone.
+
+    Not an Exception, so that it isn't handled by the commands: it stops
+    the command, as SystemExit does.
+    """
+
+
+class Server:
+    """Run the commands sent to the socket of the repo at root, on a warm Repo."""
+
+    root: str
+    repo: PRepo
+
+    def __init__(self, root: str):
+        """Build the repo at root (the '.vc' dir), kept for all the commands."""
+        from ..impl.cache import CachedDB
+        from ..impl.db import DB
+        from ..impl.index import Index
+        from ..impl.repo import Repo
+
+        self.root = root
+        self._db = DB(root)
+        db = CachedDB(self._db)
+        self.repo = Repo(Index(db, root), db, root)
+
+    def serve_forever(self) -> None:
+        """Serve requests on the socket of the repo until asked to stop."""
+        import socket
+
+        path = self.root + "/" + SOCKET_FILE
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        server.listen()
+        try:
+            while True:
+                conn, _ = server.accept()
+                with conn:
+                    try:
+                        kind, request = _read_request(conn.makefile("rb"))
+                        if kind == _STOP:
+                            os.unlink(path)  # Gone when the client gets the answer
+                            _send(conn, _EXIT, b"0")
+                            return
+                        code = self.run(conn, request) if kind == _RUN else 0
+                        _send(conn, _EXIT, str(code).encode())
+                    except (OSError, ValueError, ClientGone):
+                        pass  # The client is gone, or the request is wrong
+        finally:
+            server.close()
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def run(self, conn: socket.socket, request: Dict[bytes, List[bytes]]) -> int:
+        """Run the command of request, sending its output to conn. Return its exit code.
+
+        The command runs in the working dir and environment of the client,
+        with its output sent as it's flushed, as it would be to a pipe.
+        """
+        import traceback
+        from .main import main
+
+        argv = [os.fsdecode(a) for a in request.get(_ARG, [])]
+        if argv[1:2] and argv[1] in LOCAL_COMMANDS:
+            _send(conn, _STDERR, f"fatal: '{argv[1]}' can't run in the daemon\n".encode())
+            return 1
+        env = dict(e.partition(b"=")[::2] for e in request.get(_ENV, []))
+        encoding = request[_ENCODING][0].decode() if _ENCODING in request else "UTF-8"
+        saved = (sys.argv, sys.stdin, sys.stdout, sys.stderr, dict(os.environ))
+        sys.argv = argv
+        sys.stdin = io.StringIO()
+        sys.stdout = io.TextIOWrapper(
+            io.BufferedWriter(_Output(conn, _STDOUT), _BUFFER_SIZE), encoding
+        )
+        sys.stderr = io.TextIOWrapper(
+            io.BufferedWriter(_Output(conn, _STDERR), _BUFFER_SIZE),
+            encoding,
+            "backslashreplace",
+            line_buffering=True,
+        )
+        code = 0
+        try:
+            os.chdir(request[_CWD][0])
+            os.environb.clear()
+            os.environb.update(env)
+            time.tzset()  # For the timezone of commits
+            self._db.refresh()
+            main(argv, self.repo)
+        except SystemExit as e:
+            code = _exit_code(e.code)
+        except ClientGone:
+            code = 0
+        except Exception:
+            traceback.print_exc()
+            code = 1
+        finally:
+            for f in (sys.stdout, sys.stderr):
+                try:
+                    f.flush()
+                except ClientGone:
+                    pass
+            sys.argv, sys.stdin, sys.stdout, sys.stderr, environ = saved
+            os.environ.clear()
+            os.environ.update(environ)
+            time.tzset()
+        return code
+
+
+class _Output(io.RawIOBase):
+    """Binary output of a command, sent to the client in frames of kind."""
+
+    lost: bool  # The client is gone
+
+    def __init__(self, conn: socket.socket, kind: bytes):
+        super().__init__()
+        self._conn = conn
+        self._kind = kind
+        self.lost = False
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:  # type: ignore
+        """Send data, raising ClientGone if the client is gone (once, then drop it)."""
+        if not self.lost:
+            try:
+                _send(self._conn, self._kind, bytes(data))
+            except OSError:
+                self.lost = True
+                raise ClientGone()
+        return len(data)
+
+
+def _find_root(d: str) -> Optional[str]:
+    """Return the '.vc' dir of the repo containing d, if it has a daemon socket."""
+    while True:
+        vc_dir = d.rstrip("/") + "/" + _VC_DIR
+        if os.path.isdir(vc_dir):
+            return vc_dir if os.path.exists(vc_dir + "/" + SOCKET_FILE) else None
+        parent = os.path.dirname(d)
+        if parent == d:
+            return None
+        d = parent
+
+
+def _request(root: str, request: List[Tuple[bytes, bytes]]) -> Optional[int]:
+    """Send the frames of request to the daemon at root, writing the output.
+
+    Return the exit code, or None if the daemon can't be reached.
+    """
+    import socket
+
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(root + "/" + SOCKET_FILE)
+    except OSError:  # Not running, though the socket was left behind
+        s.close()
+        return None
+    with s:
+        s.sendall(b"".join(_FRAME.pack(k, len(d)) + d for k, d in request))
+        f = s.makefile("rb")
+        outputs = {_STDOUT: sys.stdout.buffer, _STDERR: sys.stderr.buffer}
+        while True:
+            header = f.read(_FRAME.size)
+            if len(header) < _FRAME.size:
+                print("fatal: the vc daemon closed the connection", file=sys.stderr)
+                return 128
+            kind, length = _FRAME.unpack(header)
+            data = f.read(length)
+            if kind == _EXIT:
+                return int(data)
+            try:
+                outputs[kind].write(data)
+                outputs[kind].flush()
+            except BrokenPipeError:  # The reader is gone (ex. 'vc log | head')
+                os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+                return 0
+
+
+def _read_request(f: BinaryIO) -> Tuple[bytes, Dict[bytes, List[bytes]]]:
+    """Read the frames of a request from f, returning its last kind and the data by kind."""
+    request: Dict[bytes, List[bytes]] = {}
+    while True:
+        header = f.read(_FRAME.size)
+        if len(header) < _FRAME.size:
+            raise ValueError("Incomplete request")
+        kind, length = _FRAME.unpack(header)
+        data = f.read(length)
+        if kind in (_RUN, _PING, _STOP):
+            return kind, request
+        request.setdefault(kind, []).append(data)
+
+
+def _send(conn: socket.socket, kind: bytes, data: bytes) -> None:
+    conn.sendall(_FRAME.pack(kind, len(data)) + data)
+
+
+def _exit_code(code: object) -> int:
+    """Return the exit status of a process exiting with SystemExit(code)."""
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code & 0xFF
+    print(code, file=sys.stderr)
+    return 1
+
+
+if __name__ == "__main__":
+    Server(sys.argv[1]).serve_forever()
@@ -3,46 +3,59 @@
 """Entry point to the vc module."""
 
 import sys
-from typing import Dict, List
-from ..api import PCommandProcessor
-from .command_hash_object import HashObjectCommand
-from .command_cat_file import CatFileCommand
-from .command_init import InitCommand
-from .command_add import AddCommand
-from .command_commit import CommitCommand
-from .command_status import StatusCommand
-from .command_log import LogCommand
-from .command_checkout import CheckoutCommand
-from .command_branch import BranchCommand
-from .command_diff import DiffCommand
+from importlib import import_module
+from typing import Dict, List, Optional, Tuple
+from ..api import PCommandProcessor, PRepo
 from ..impl.fs import find_vc_root_dir
 from ..impl import create_repo
+from ..impl.trace import count_syscalls, tracing
+
+# Command name -> module (in vc.cli) and class of its processor. Only the
+# module of the command run is imported, and only its processor built.
+COMMANDS: Dict[str, Tuple[str, str]] = {
+    "init": ("command_init", "InitCommand"),
+    "hash-object": ("command_hash_object", "HashObjectCommand"),
+    "cat-file": ("command_cat_file", "CatFileCommand"),
+    "add": ("command_add", "AddCommand"),
+    "commit": ("command_commit", "CommitCommand"),
+    "status": ("command_status", "StatusCommand"),
+    "log": ("command_log", "LogCommand"),
+    "checkout": ("command_checkout", "CheckoutCommand"),
+    "branch": ("command_branch", "BranchCommand"),
+    "diff": ("command_diff", "DiffCommand"),
+    "repack": ("command_repack", "RepackCommand"),
+    "fsmonitor": ("command_fsmonitor", "FsMonitorCommand"),
+    "commit-graph": ("command_commit_graph", "CommitGraphCommand"),
+    "merge-base": ("command_merge_base", "MergeBaseCommand"),
+    "pack-refs": ("command_pack_refs", "PackRefsCommand"),
+    "daemon": ("command_daemon", "DaemonCommand"),
+}
+NO_REPO_COMMANDS = ["init"]  # Commands available outside of a repo
+
+
+def load_command(name: str, repo: Optional[PRepo]) -> PCommandProcessor:
+    """Import the module of the command name and build its processor.
+
+    The processors of the commands in NO_REPO_COMMANDS take no repo.
+    """
+    module, cls = COMMANDS[name]
+    command = getattr(import_module("." + module, __package__), cls)
+    return command() if name in NO_REPO_COMMANDS else command(repo)
 
 
 class MainCommandProcessor(PCommandProcessor):
     """Main CommandProcessor."""
 
-    processors: Dict[str, PCommandProcessor] = {}
-
-    def __init__(self):
-        """Build the object tree."""
-        root = find_vc_root_dir()
-        procs = []
-        procs.append(InitCommand())
-        if root is not None:
-            repo = create_repo(root)
-            procs.append(HashObjectCommand(repo))
-            procs.append(CatFileCommand(repo))
-            procs.append(AddCommand(repo))
-            procs.append(CommitCommand(repo))
-            procs.append(StatusCommand(repo))
-            procs.append(LogCommand(repo))
-            procs.append(CheckoutCommand(repo))
-            procs.append(BranchCommand(repo))
-            procs.append(DiffCommand(repo))
-
-        for p in procs:
-            self.processors[p.key] = p
+    root: Optional[str]
+    repo: Optional[PRepo]
+    available: List[str]
+
+    def __init__(self, repo: Optional[PRepo] = None):
+        """Find the repo, if not given. Commands are only loaded when run."""
+        self.repo = repo
+        self.root = find_vc_root_dir() if repo is None else None
+        in_repo = repo is not None or self.root is not None
+        self.available = list(COMMANDS) if in_repo else NO_REPO_COMMANDS
 
     @property
     def key(self):
@@ -53,24 +66,39 @@ class MainCommandProcessor(PCommandProcessor):
         if len(args) < 2:
             print(
                 "Command required. Available commands:"
-                + f" {', '.join(self.processors.keys())}",
+                + f" {', '.join(self.available)}",
                 file=sys.stderr,
             )
             exit(-1)
 
         cmd = args[1]
 
-        if cmd not in self.processors.keys():
+        if cmd not in self.available:
             print(
                 f"Command '{cmd}' not implemented. Available commands:"
-                + f" {', '.join(self.processors.keys())}",
+                + f" {', '.join(self.available)}",
                 file=sys.stderr,
             )
             exit(-1)
 
-        self.processors[cmd].process_command((args[2:]))
+        repo = None
+        if cmd not in NO_REPO_COMMANDS:
+            if self.repo is None:
+                assert self.root is not None, "Not in a repo"
+                self.repo = create_repo(self.root)
+            repo = self.repo
+        load_command(cmd, repo).process_command(args[2:])
 
 
-def main(args: List[str]) -> None:
-    p = MainCommandProcessor()
-    p.process_command(args)
+def main(args: List[str], repo: Optional[PRepo] = None) -> None:
+    """Run the command in args (as sys.argv), on repo if given (see daemon.py)."""
+    if not tracing():
+        p = MainCommandProcessor(repo)
+        p.process_command(args)
+        return
+    with count_syscalls() as counts:
+        try:
+            p = MainCommandProcessor(repo)
+            p.process_command(args)
+        finally:
+            print(f"trace: {' '.join(args[1:2])}: {counts.summary()}", file=sys.stderr)
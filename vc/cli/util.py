@@ -1,5 +1,8 @@
 """Utility functions."""
 
+import io
+import os
+import sys
 from ..api import PRepo
 
 
@@ -8,3 +11,20 @@ def require_initialized_repo(repo: PRepo):
     if not repo.initialized():
         print("fatal: not a vc repository (or any of the parent directories): .vc")
         exit(1)
+
+
+def discard_stdout() -> None:
+    """Send what is left to write to stdout to /dev/null, once its reader is gone.
+
+    Otherwise Python fails again flushing stdout on exit. Nothing is done
+    when stdout isn't a file (ex. when run in the daemon).
+    """
+    try:
+        fd = sys.stdout.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        return
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    try:
+        os.dup2(devnull, fd)
+    finally:
+        os.close(devnull)
@@ -1,6 +1,7 @@
 import os
 import os.path
 from .db import DB
+from .cache import CachedDB
 from .index import Index
 from .repo import Repo
 from ..api import PRepo
@@ -19,6 +20,6 @@ def create_repo(root: str, initialise: bool = False) -> PRepo:
             else:
                 raise FileNotFoundError("The repo does not exist")
 
-    db = DB(root)
+    db = CachedDB(DB(root))
     index = Index(db, root)
     return Repo(index, db, root)
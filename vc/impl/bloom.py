@@ -0,0 +1,133 @@
+"""Changed-path Bloom filters for the commits in the commit-graph.
+
+'.vc/commit-graph-bloom' has, for each commit of the commit-graph (in the
+order of the graph), a Bloom filter of the paths it changed compared to its
+first parent, directories included. A path missing from the filter of a
+commit was certainly not changed by it, so path-limited walks only need to
+diff the trees of the few commits whose filters say it may have been.
+
+The file has a header (magic, version, number of filters and the sha1 of
+the graph records they were written for, so filters for an older graph
+aren't used), the end offset of each filter and then the filters. Filters
+take BITS_PER_PATH bits per changed path. An empty filter means the commit
+changed too many paths for a filter to be useful: anything may have changed.
+
+Commits appended to the graph after the filters were written have none.
+"""
+
+from __future__ import annotations  # For the factory method in ChangedPathFilters
+import mmap
+import struct
+import hashlib
+from typing import Callable, Iterable, List, Optional, Tuple
+from .commitgraph import CommitGraph
+from .lockfile import write_locked
+
+BLOOM_FILE = "commit-graph-bloom"
+BLOOM_MAGIC = b"VCBF"
+BLOOM_VERSION = 1
+NUM_HASHES = 7
+BITS_PER_PATH = 10
+MAX_PATHS = 512  # Commits changing more paths get an empty filter
+
+_HEADER = struct.Struct(">4sII20s")  # magic, version, count, graph checksum
+_OFFSET = struct.Struct(">I")
+
+PathHash = Tuple[int, int]
+
+
+def path_hash(path: str) -> PathHash:
+    """Return the hash of path, to be used with 'may_have_changed'."""
+    h = hashlib.blake2b(path.encode("UTF-8"), digest_size=8).digest()
+    return int.from_bytes(h[:4], "big"), int.from_bytes(h[4:], "big") | 1
+
+
+def path_hashes(path: str) -> List[PathHash]:
+    """Return the hashes of path and of the directories containing it."""
+    parts = path.split("/")
+    return [path_hash("/".join(parts[: i + 1])) for i in range(len(parts))]
+
+
+class ChangedPathFilters:
+    """Read access to the changed-path filters of a repo."""
+
+    count: int
+
+    def __init__(self, path: str, graph: CommitGraph):
+        """Map the file at path, checking it was written for graph."""
+        with open(path, "rb") as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count, checksum = _HEADER.unpack_from(self._data, 0)
+        if magic != BLOOM_MAGIC or version != BLOOM_VERSION:
+            raise ValueError(f"Incorrect changed-path filters file: '{path}'")
+        if self.count > graph.count or checksum != graph.checksum(self.count):
+            raise ValueError(f"Stale changed-path filters file: '{path}'")
+        self._start = _HEADER.size + self.count * _OFFSET.size
+
+    @staticmethod
+    def load(root: str, graph: CommitGraph) -> Optional[ChangedPathFilters]:
+        """Return the filters of the repo at root (the '.vc' dir) for graph, if any."""
+        try:
+            return ChangedPathFilters(root + "/" + BLOOM_FILE, graph)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def close(self) -> None:
+        """Release the mapped file."""
+        self._data.close()
+
+    def may_have_changed(self, pos: int, hashes: List[PathHash]) -> bool:
+        """Return False if the commit at pos (in the graph) didn't change the path.
+
+        hashes are those of the path and its directories ('path_hashes').
+        """
+        if pos >= self.count:
+            return True
+        end = self._offset(pos)
+        start = self._offset(pos - 1) if pos > 0 else 0
+        if start == end:
+            return True
+        bits = self._data[self._start + start : self._start + end]
+        return all(_contains(bits, h) for h in hashes)
+
+    def _offset(self, pos: int) -> int:
+        return _OFFSET.unpack_from(self._data, _HEADER.size + pos * _OFFSET.size)[0]
+
+
+def write(
+    root: str, graph: CommitGraph, changed: Callable[[str], Optional[Iterable[str]]]
+) -> int:
+    """Write the filters for the commits in graph, returning how many were written.
+
+    changed returns the paths changed by the commit with the given key (None
+    if they can't be known: the commit gets an empty filter).
+    """
+    offsets = bytearray()
+    filters = bytearray()
+    for pos in range(graph.count):
+        paths = changed(graph.key(pos))
+        paths = list(paths) if paths is not None else None
+        if paths is not None and len(paths) <= MAX_PATHS:
+            filters += _filter(paths)
+        offsets += _OFFSET.pack(len(filters))
+    header = _HEADER.pack(BLOOM_MAGIC, BLOOM_VERSION, graph.count, graph.checksum(graph.count))
+    write_locked(root + "/" + BLOOM_FILE, header + offsets + filters)
+    return graph.count
+
+
+def _filter(paths: List[str]) -> bytes:
+    ret = bytearray(max(1, (len(paths) * BITS_PER_PATH + 7) // 8))
+    for p in paths:
+        for b in _bits(path_hash(p), len(ret) * 8):
+            ret[b >> 3] |= 1 << (b & 7)
+    return bytes(ret)
+
+
+def _contains(bits: bytes, h: PathHash) -> bool:
+    return all(bits[b >> 3] & (1 << (b & 7)) for b in _bits(h, len(bits) * 8))
+
+
+def _bits(h: PathHash, nbits: int) -> List[int]:
+    """Return the bits for h in a filter of nbits, by double hashing."""
+    h1, h2 = h
+    return [(h1 + i * h2) % nbits for i in range(NUM_HASHES)]
@@ -0,0 +1,204 @@
+"""In-memory cache of DB objects, wrapping any PObjectDB."""
+
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    Hashable,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
+from ..api import PObjectDB, DBObject, DBObjectType, DBObjectKey
+
+T = TypeVar("T")
+
+KEY_LEN = 40
+ENTRY_OVERHEAD = 200  # Rough cost in bytes of an entry, besides its contents
+
+# Default budgets in bytes, per object type. Blobs get a small budget and are
+# only cached if small, so reading big files doesn't evict trees and commits.
+DEFAULT_BUDGETS: Dict[DBObjectType, int] = {
+    DBObjectType.BLOB: 8 * 1024 * 1024,
+    DBObjectType.TREE: 32 * 1024 * 1024,
+    DBObjectType.COMMIT: 8 * 1024 * 1024,
+    DBObjectType.TAG: 1024 * 1024,
+}
+DEFAULT_MAX_OBJECT_SIZES: Dict[DBObjectType, int] = {
+    DBObjectType.BLOB: 256 * 1024,
+}
+
+
+@dataclass
+class CacheStats:
+    """Counters of a cache, to tune its budget."""
+
+    hits: int = 0  # Objects (or parsed objects) served from memory
+    misses: int = 0  # Objects read from the wrapped db
+    evictions: int = 0
+    entries: int = 0
+    size: int = 0
+    budget: int = 0
+
+
+class LRU:
+    """Least recently used cache with a budget in bytes, safe to share by threads."""
+
+    def __init__(self, budget: int, max_entry_size: Optional[int] = None):
+        """Initialize an empty cache."""
+        self._entries: OrderedDict[Hashable, Tuple[Any, int]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = CacheStats(budget=budget)
+        self.max_entry_size = budget if max_entry_size is None else max_entry_size
+
+    def get(self, key: Hashable, count: bool = True) -> Optional[Any]:
+        """Return the value for key (marking it as recently used), or None.
+
+        If count is False, the caller is in charge of updating the hit/miss stats.
+        """
+        with self._lock:
+            en = self._entries.get(key)
+            if en is None:
+                if count:
+                    self.stats.misses += 1
+                return None
+            if count:
+                self.stats.hits += 1
+            self._entries.move_to_end(key)
+            return en[0]
+
+    def put(self, key: Hashable, value: Any, size: int) -> None:
+        """Add value to the cache, evicting the least recently used entries."""
+        size += ENTRY_OVERHEAD
+        with self._lock:
+            if size > self.max_entry_size or key in self._entries:
+                return
+            self._entries[key] = (value, size)
+            self.stats.entries += 1
+            self.stats.size += size
+            while self.stats.size > self.stats.budget:
+                _, (_, old_size) = self._entries.popitem(last=False)
+                self.stats.entries -= 1
+                self.stats.size -= old_size
+                self.stats.evictions += 1
+
+    def __contains__(self, key: Hashable) -> bool:
+        """Return True if key is cached, without touching stats or order."""
+        return key in self._entries
+
+    def clear(self) -> None:
+        """Remove all the entries."""
+        with self._lock:
+            self._entries.clear()
+            self.stats.entries = self.stats.size = 0
+
+
+class CachedDB(PObjectDB):
+    """PObjectDB keeping the objects read (and their parsed forms) in memory.
+
+    Objects are immutable, so entries never need to be invalidated. Each
+    object type has its own LRU, with its own budget.
+    """
+
+    db: PObjectDB
+
+    def __init__(
+        self,
+        db: PObjectDB,
+        budgets: Optional[Dict[DBObjectType, int]] = None,
+        max_object_sizes: Optional[Dict[DBObjectType, int]] = None,
+    ):
+        """Wrap db, with the given budgets (in bytes) per object type."""
+        self.db = db
+        budgets = {**DEFAULT_BUDGETS, **(budgets or {})}
+        max_sizes = {**DEFAULT_MAX_OBJECT_SIZES, **(max_object_sizes or {})}
+        self._caches = {t: LRU(budgets[t], max_sizes.get(t)) for t in DBObjectType}
+
+    def put(
+        self, content: Union[bytes, str], typ: DBObjectType = DBObjectType.BLOB
+    ) -> DBObjectKey:
+        """Associate the content bb to the key."""
+        return self.db.put(content, typ)
+
+    def put_stream(
+        self, fileobj: BinaryIO, size: int, typ: DBObjectType = DBObjectType.BLOB
+    ) -> DBObjectKey:
+        """Store the size bytes read from fileobj, returning their key."""
+        return self.db.put_stream(fileobj, size, typ)
+
+    def calculate_key(self, content: bytes):
+        """Calculate the key for a given contents, same as in 'put'."""
+        return self.db.calculate_key(content)
+
+    def calculate_key_stream(
+        self, fileobj: BinaryIO, size: int, typ: DBObjectType = DBObjectType.BLOB
+    ) -> DBObjectKey:
+        """Calculate the key for the size bytes read from fileobj, as 'put_stream'."""
+        return self.db.calculate_key_stream(fileobj, size, typ)
+
+    def get(self, key: str) -> DBObject:
+        """Get the contents associated with a key, from the cache if possible."""
+        return self._get(self._full_key(key))
+
+    def parsed(self, key: str, kind: str, parse: Callable[[DBObject], T]) -> T:
+        """Return parse(get(key)), caching the result under kind.
+
+        This is used to keep parsed trees and commits, not only their bytes.
+        """
+        key = self._full_key(key)
+        ret = self._lookup((kind, key))
+        if ret is None:
+            ob = self._get(key)
+            ret = parse(ob)
+            self._caches[ob.type].put((kind, key), ret, ob.size)
+        return ret
+
+    def get_full_key(self, commit_id: str) -> str:
+        """Return the full key from a partial key."""
+        if commit_id is not None and len(commit_id) == KEY_LEN:
+            if any(("", commit_id) in c for c in self._caches.values()):
+                return commit_id
+        return self.db.get_full_key(commit_id)
+
+    def repack(
+        self, all_objects: bool = False, hints: Optional[Dict[str, str]] = None
+    ) -> int:
+        """Move the loose objects into a pack, returning how many were packed."""
+        return self.db.repack(all_objects, hints)
+
+    def stats(self) -> Dict[DBObjectType, CacheStats]:
+        """Return the counters of the cache of each object type."""
+        return {t: c.stats for t, c in self._caches.items()}
+
+    def clear(self) -> None:
+        """Empty the caches."""
+        for c in self._caches.values():
+            c.clear()
+
+    def _get(self, key: str) -> DBObject:
+        ob = self._lookup(("", key))
+        if ob is None:
+            ob = self.db.get(key)
+            cache = self._caches[ob.type]
+            cache.stats.misses += 1
+            cache.put(("", key), ob, ob.size)
+        return ob
+
+    def _lookup(self, key: Tuple[str, str]) -> Optional[Any]:
+        # The type is only known once read, so look for the entry in all caches
+        for c in self._caches.values():
+            ret = c.get(key, count=False)
+            if ret is not None:
+                c.stats.hits += 1
+                return ret
+        return None
+
+    def _full_key(self, key: str) -> str:
+        if key is not None and len(key) == KEY_LEN:
+            return key
+        return self.db.get_full_key(key)
@@ -0,0 +1,59 @@
+"""Writing of files to the working tree for checkout, with a pool of threads.
+
+Each file is read from the db (and inflated) and written by a worker
+thread: zlib and file I/O release the GIL, so the threads do run in
+parallel. The directories are all created first, once, so the workers
+don't race to create them.
+
+Files are written to a temporary name next to them and then renamed over
+the final name, so no one sees a half-written file, and a failed checkout
+leaves the previous version in place.
+"""
+
+import os
+from typing import List, Optional, Sequence, Tuple
+from ..api import PObjectDB, StatData
+from .fs import file_stat, worktree_path
+
+CHECKOUT_PARALLEL_THRESHOLD = 64  # Fewer files are written in this thread
+CHECKOUT_THREADS = 16
+
+
+def write_files(
+    db: PObjectDB,
+    root: str,
+    files: Sequence[Tuple[str, str]],
+    workers: Optional[int] = None,
+) -> List[Tuple[Optional[StatData], int]]:
+    """Write the blobs for files (pairs of path and key) to the working tree.
+
+    Return the stat data and size of each file, in order. workers is the
+    number of threads writing files (by default, CHECKOUT_THREADS).
+    """
+    for d in sorted({os.path.dirname(p) for p, _ in files} - {""}):
+        os.makedirs(worktree_path(root, d), exist_ok=True)
+    if workers is None:
+        workers = CHECKOUT_THREADS
+    if workers <= 1 or len(files) < CHECKOUT_PARALLEL_THRESHOLD:
+        return [_write_file(db, root, p, k) for p, k in files]
+    from concurrent.futures import ThreadPoolExecutor  # Slow to import, rarely needed
+
+    with ThreadPoolExecutor(workers) as ex:
+        return list(ex.map(lambda f: _write_file(db, root, f[0], f[1]), files))
+
+
+def _write_file(
+    db: PObjectDB, root: str, path: str, key: str
+) -> Tuple[Optional[StatData], int]:
+    contents = db.get(key).contents
+    final = worktree_path(root, path)
+    tmp = f"{final}.{os.getpid()}.vc-tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(contents)
+        os.replace(tmp, final)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return file_stat(final), len(contents)
@@ -0,0 +1,239 @@
+"""Commit-graph file: the history metadata needed to walk it, in fixed-width records.
+
+'.vc/commit-graph' has a header (magic, version, record count and how many
+of the records are sorted by key) followed by one record per commit: its
+key, its tree, the positions of its first two parents, its generation number
+and its commit timestamp. The first records are sorted by key, so commits
+are found by binary search. Commits added afterwards (see 'append') are
+appended, unsorted, and found through a dict built when the file is read;
+rewriting the file with 'write' sorts them again.
+
+The generation of a commit is 1 plus the maximum generation of its parents
+(1 for root commits): a commit can't be an ancestor of another one with a
+lower or equal generation, which lets walks stop early.
+
+A commit is only added once all its parents are in the graph, so parent
+positions always point into the file. Commits with more than two parents
+have the OCTOPUS flag as second parent, and their parents are read from the
+commit object.
+"""
+
+from __future__ import annotations  # For the factory method in CommitGraph
+import os
+import mmap
+import struct
+import hashlib
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+from .lockfile import LockFile, write_locked
+
+GRAPH_FILE = "commit-graph"
+GRAPH_MAGIC = b"VCGR"
+GRAPH_VERSION = 1
+NO_PARENT = 0xFFFFFFFF
+OCTOPUS = 0xFFFFFFFE
+MAX_UNSORTED = 4096  # Beyond this, commits are no longer appended
+
+_HEADER = struct.Struct(">4sIII")  # magic, version, count, sorted count
+# key, tree, first parent, second parent, generation, timestamp
+_RECORD = struct.Struct(">20s20sIIIq")
+
+
+@dataclass
+class CommitInfo:
+    """What the graph stores about a commit, with the parents as keys."""
+
+    key: str
+    tree: str
+    parents: List[str]
+    timestamp: int
+
+
+class CommitGraph:
+    """Read access to the commit-graph file of a repo."""
+
+    count: int
+    sorted_count: int
+
+    def __init__(self, path: str):
+        """Map the file at path."""
+        with open(path, "rb") as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count, self.sorted_count = _HEADER.unpack_from(self._data, 0)
+        if magic != GRAPH_MAGIC or version != GRAPH_VERSION:
+            raise ValueError(f"Incorrect commit-graph file: '{path}'")
+        if _HEADER.size + self.count * _RECORD.size > len(self._data):
+            raise ValueError(f"Truncated commit-graph file: '{path}'")
+        self._tail: Dict[bytes, int] = {
+            self._record(i)[0]: i for i in range(self.sorted_count, self.count)
+        }
+
+    @staticmethod
+    def load(root: str) -> Optional[CommitGraph]:
+        """Return the graph of the repo at root (the '.vc' dir), if there's one."""
+        try:
+            return CommitGraph(root + "/" + GRAPH_FILE)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def close(self) -> None:
+        """Release the mapped file."""
+        self._data.close()
+
+    def position(self, key: str) -> Optional[int]:
+        """Return the position of the commit with the (full) key, or None."""
+        try:
+            bkey = bytes.fromhex(key)
+        except ValueError:
+            return None
+        lo, hi = 0, self.sorted_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            k = self._key_bytes(mid)
+            if k == bkey:
+                return mid
+            if k < bkey:
+                lo = mid + 1
+            else:
+                hi = mid
+        return self._tail.get(bkey)
+
+    def key(self, pos: int) -> str:
+        """Return the key of the commit at pos."""
+        return self._key_bytes(pos).hex()
+
+    def tree(self, pos: int) -> str:
+        """Return the tree of the commit at pos."""
+        return self._record(pos)[1].hex()
+
+    def parents(self, pos: int) -> Optional[List[int]]:
+        """Return the positions of the parents of pos, or None for octopus merges."""
+        _, _, p1, p2, _, _ = self._record(pos)
+        if p2 == OCTOPUS:
+            return None
+        return [p for p in (p1, p2) if p != NO_PARENT]
+
+    def generation(self, pos: int) -> int:
+        """Return the generation number of the commit at pos."""
+        return self._record(pos)[4]
+
+    def timestamp(self, pos: int) -> int:
+        """Return the commit timestamp of the commit at pos."""
+        return self._record(pos)[5]
+
+    def checksum(self, count: int) -> bytes:
+        """Return the sha1 of the first count records (which can't change)."""
+        records = self._data[_HEADER.size : _HEADER.size + count * _RECORD.size]
+        return hashlib.sha1(records).digest()
+
+    def _record(self, pos: int) -> Tuple[bytes, bytes, int, int, int, int]:
+        return _RECORD.unpack_from(self._data, _HEADER.size + pos * _RECORD.size)
+
+    def _key_bytes(self, pos: int) -> bytes:
+        start = _HEADER.size + pos * _RECORD.size
+        return self._data[start : start + 20]
+
+
+def write(root: str, commits: Iterable[CommitInfo]) -> int:
+    """Write the graph with the given commits, returning how many were written.
+
+    Commits whose parents are not all among the given ones are left out
+    (with their descendants).
+    """
+    data, count = _graph_data(commits)
+    write_locked(root + "/" + GRAPH_FILE, data)
+    return count
+
+
+def append(root: str, commit: CommitInfo) -> bool:
+    """Add the commit at the end of the graph, returning False if not possible.
+
+    It's not possible if a parent is not in the graph, or if there are too
+    many unsorted commits already ('write' must be used then). A graph is
+    created for root commits when there's none. The graph is locked while
+    appending, so concurrent commits don't write the same record.
+    """
+    path = root + "/" + GRAPH_FILE
+    with LockFile(path) as lock:
+        graph = CommitGraph.load(root)
+        if graph is None:
+            if commit.parents or os.path.exists(path):
+                return False
+            data, count = _graph_data([commit])
+            lock.write(data)
+            lock.commit()
+            return count == 1
+        try:
+            if graph.count - graph.sorted_count >= MAX_UNSORTED:
+                return False
+            if graph.position(commit.key) is not None:
+                return True
+            positions: Dict[str, int] = {}
+            generation = 0
+            for p in commit.parents:
+                pos = graph.position(p)
+                if pos is None:
+                    return False
+                positions[p] = pos
+                generation = max(generation, graph.generation(pos))
+            count = graph.count
+        finally:
+            graph.close()
+        with open(path, "r+b") as f:
+            # The record goes first: readers ignore it until the count includes it
+            f.seek(_HEADER.size + count * _RECORD.size)
+            f.write(_pack(commit, positions, generation + 1))
+            f.seek(struct.calcsize(">4sI"))
+            f.write(struct.pack(">I", count + 1))
+    return True
+
+
+def _graph_data(commits: Iterable[CommitInfo]) -> Tuple[bytes, int]:
+    """Return the contents of a graph file with the commits, and how many it has."""
+    by_key = {c.key: c for c in commits}
+    generations: Dict[str, int] = {}
+    for key in by_key:
+        _generation(key, by_key, generations)
+    keys = sorted(k for k, g in generations.items() if g > 0)
+    positions = {k: i for i, k in enumerate(keys)}
+    out = bytearray(_HEADER.pack(GRAPH_MAGIC, GRAPH_VERSION, len(keys), len(keys)))
+    for k in keys:
+        out += _pack(by_key[k], positions, generations[k])
+    return bytes(out), len(keys)
+
+
+def _pack(c: CommitInfo, positions: Dict[str, int], generation: int) -> bytes:
+    parents = [positions[p] for p in c.parents]
+    if len(parents) > 2:
+        p1, p2 = parents[0], OCTOPUS
+    else:
+        p1, p2 = (parents + [NO_PARENT, NO_PARENT])[:2]
+    return _RECORD.pack(
+        bytes.fromhex(c.key), bytes.fromhex(c.tree), p1, p2, generation, c.timestamp
+    )
+
+
+def _generation(key: str, by_key: Dict[str, CommitInfo], acc: Dict[str, int]) -> int:
+    """Return the generation of key, or 0 if some ancestor is missing.
+
+    Iterative, as histories are deeper than the recursion limit.
+    """
+    stack = [key]
+    while stack:
+        k = stack[-1]
+        if k in acc:
+            stack.pop()
+            continue
+        c = by_key.get(k)
+        if c is None:
+            acc[k] = 0
+            stack.pop()
+            continue
+        pending = [p for p in c.parents if p not in acc]
+        if pending:
+            stack.extend(pending)
+            continue
+        gens = [acc[p] for p in c.parents]
+        acc[k] = 0 if 0 in gens else 1 + max(gens, default=0)
+        stack.pop()
+    return acc[key]
@@ -5,22 +5,36 @@ import os.path
 import glob
 import zlib
 import hashlib
-from typing import Tuple, Union
-from ..api import PObjectDB, DBObject, DBObjectType, DBObjectKey
+from bisect import bisect_left, insort
+from typing import BinaryIO, Dict, List, Optional, Tuple, Union
+from ..api import PObjectDB, DBObject, DBObjectType, DBObjectKey, AmbiguousKeyError
+from .pack import PACK_DIR, Pack, list_packs, write_pack, DELTA_WINDOW, DELTA_DEPTH
 
 VC_DIR = ".vc"
+KEY_LEN = 40  # Length of a full key (hex sha1)
+MIN_KEY_LEN = 4  # Shortest abbreviation accepted for a key
+STREAM_THRESHOLD = 8 * 1024 * 1024  # Files from this size on are streamed
+STREAM_CHUNK = 1024 * 1024
 
 
 class DB(PObjectDB):
     """Default implementation of the PDB protocol."""
 
     root: str
+    _packs: Optional[List[Pack]]
+    _loose_keys: Dict[str, List[str]]  # Sorted keys of each listed objects/xx dir
+    _packs_signature: Tuple[int, int]  # Of the packs dir, at the last refresh
+    _checked: bool
 
     def __init__(self, root: str):
         """Configure the hasher to use in the DB."""
         if root and not os.path.isdir(root):
             raise FileNotFoundError(f"File path doesn't exist: '{root}'")
         self.root = root
+        self._packs = None
+        self._loose_keys = {}
+        self._packs_signature = (0, 0)
+        self._checked = False
 
     def calculate_key(self, content: Union[bytes, str]):
         """Calculate the key using the internal hasher."""
@@ -32,40 +46,199 @@ class DB(PObjectDB):
         self, content: Union[bytes, str], typ: DBObjectType = DBObjectType.BLOB
     ) -> DBObjectKey:
         """Associate the content bb to the key."""
-        # FIXME: write (and read...) the type of the object
         self._check_repo()
-        key, bcontent = _prepare_to_save(content)
-        lfname, ldirs, _ = self._filename_from_key(key)
-        if os.path.exists(lfname):
+        key, bcontent = _prepare_to_save(content, typ)
+        if self._exists(key):
             return key
-        os.makedirs(ldirs, exist_ok=True)
-        with open(lfname, "wb") as f:
+        tmp = self._temp_object()
+        with open(tmp, "wb") as f:
             f.write(bcontent)
+        self._store_loose(key, tmp)
         return key
 
+    def put_stream(
+        self, fileobj: BinaryIO, size: int, typ: DBObjectType = DBObjectType.BLOB
+    ) -> DBObjectKey:
+        """Store the size bytes read from fileobj, returning their key.
+
+        The contents are hashed and compressed in chunks to a temporary file,
+        which is then renamed into place, so memory use doesn't depend on size.
+        """
+        self._check_repo()
+        tmp = self._temp_object()
+        try:
+            with open(tmp, "wb") as f:
+                key = _compress_stream(fileobj, size, typ, f)
+            if self._exists(key):
+                os.remove(tmp)
+            else:
+                self._store_loose(key, tmp)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return key
+
+    def calculate_key_stream(
+        self, fileobj: BinaryIO, size: int, typ: DBObjectType = DBObjectType.BLOB
+    ) -> DBObjectKey:
+        """Calculate the key of the size bytes read from fileobj, as put_stream."""
+        self._check_repo()
+        return _compress_stream(fileobj, size, typ, None)
+
+    def _exists(self, key: str) -> bool:
+        lfname, _, _ = self._filename_from_key(key)
+        return self._packed(key) is not None or os.path.exists(lfname)
+
+    def _temp_object(self) -> str:
+        """Return the path of a new temporary file in the objects dir."""
+        import tempfile  # Only needed when writing objects
+
+        objects = self.root + "/objects"
+        os.makedirs(objects, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix="tmp_obj_", dir=objects)
+        os.close(fd)
+        return tmp
+
+    def _store_loose(self, key: str, tmp: str) -> None:
+        """Atomically move the complete object file tmp to its place."""
+        lfname, ldirs, _ = self._filename_from_key(key)
+        os.makedirs(ldirs, exist_ok=True)
+        os.replace(tmp, lfname)
+        keys = self._loose_keys.get(key[0:2])
+        if keys is not None and key not in keys:
+            insort(keys, key)
+
     def get(self, key: str) -> DBObject:
         """Get the contents associated with a key, returning them or None."""
         self._check_repo()
         if key is None or key.strip() == "":
             raise FileNotFoundError("Empty key")
-        lfname, _, _ = self._filename_from_key(key)
-        files = glob.glob(lfname + "*")
-        if len(files) != 1:
+        if len(key) != KEY_LEN:
+            key = self.get_full_key(key)
+        return _parse_object(self._read(key))
+
+    def _read(self, key: str) -> bytes:
+        """Return the decompressed contents of the object with the (full) key."""
+        pack = self._packed(key)
+        if pack is None:
+            lfname, _, _ = self._filename_from_key(key)
+            try:
+                with open(lfname, "rb") as f:
+                    return zlib.decompress(f.read())
+            except FileNotFoundError:
+                pass
+            self._forget_listings()  # It might have been packed meanwhile
+            pack = self._packed(key)
+        contents = pack.read(key) if pack is not None else None
+        if contents is None:
             raise FileNotFoundError("Object not found")
-        with open(files[0], "rb") as f:
-            contents = f.read()
-            contents = zlib.decompress(contents)
-            idx_typ = contents.index(b" ")
-            idx_len = contents.index(0)
-            typ = contents[0:idx_typ].decode("UTF-8")
-            length = contents[idx_typ:idx_len].decode("UTF-8")
-            contents = contents[idx_len + 1 :]
-            return DBObject(DBObjectType(typ), int(length), contents)
+        return contents
 
-    def _filename_from_key(self, key: str) -> Tuple[str, str, str]:
+    def repack(
+        self,
+        all_objects: bool = False,
+        hints: Optional[Dict[str, str]] = None,
+        window: int = DELTA_WINDOW,
+        depth: int = DELTA_DEPTH,
+    ) -> int:
+        """Move the loose objects into a new pack, returning how many were packed.
+
+        If all_objects is True, the objects in the existing packs are also
+        moved to the new one, which then replaces them. hints maps keys to
+        paths, to choose good delta bases.
+        """
         self._check_repo()
+        loose = self._loose_objects()
+        old_packs = self._get_packs() if all_objects else []
+        objects: Dict[str, bytes] = {}
+        for p in old_packs:
+            for pos, key in enumerate(p.keys()):
+                objects[key] = p.read_at(pos)
+        for key, path in loose:
+            with open(path, "rb") as f:
+                objects[key] = zlib.decompress(f.read())
+        base = write_pack(self.root, objects.items(), hints, window, depth)
+        if base is None:
+            return 0
+        self._forget_listings()
+        for p in old_packs:
+            if p.path != base:
+                os.remove(p.path + ".idx")
+                os.remove(p.path + ".pack")
+        for _, path in loose:
+            os.remove(path)
+            try:
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass  # Not empty
+        return len(objects)
+
+    def _loose_objects(self) -> List[Tuple[str, str]]:
+        """Return the (key, path) of all the loose objects."""
+        ret = []
+        for path in glob.glob(self.root + "/objects/[0-9a-f][0-9a-f]/*"):
+            ret.append(("".join(path.split("/")[-2:]), path))
+        return ret
+
+    def _packed(self, key: str) -> Optional[Pack]:
+        """Return the pack containing the (full) key, if any."""
+        for p in self._get_packs():
+            if p.find(key) is not None:
+                return p
+        return None
+
+    def refresh(self) -> None:
+        """Forget what is known of the objects in the repo, if it may have changed.
+
+        The loose objects are listed again, and the packs only if their dir
+        changed since the last refresh. This is for long running processes
+        (the daemon), as others may have written or packed objects meanwhile.
+        Objects not found are looked for again anyway (see _read).
+        """
+        self._loose_keys = {}
+        try:
+            st = os.stat(self.root + "/" + PACK_DIR)
+            signature = (st.st_mtime_ns, st.st_ino)
+        except FileNotFoundError:
+            signature = (0, 0)
+        if signature != self._packs_signature:
+            self._forget_listings()
+            self._packs_signature = signature
+
+    def _get_packs(self) -> List[Pack]:
+        if self._packs is None:
+            self._packs = list_packs(self.root)
+        return self._packs
+
+    def _forget_listings(self) -> None:
+        """Drop the cached lists of packs and loose keys, to read them again."""
+        for p in self._packs or []:
+            p.close()
+        self._packs = None
+        self._loose_keys = {}
+
+    def _loose_with_prefix(self, prefix: str) -> List[str]:
+        """Return the loose keys starting with prefix (at least 2 chars long)."""
+        d = prefix[0:2]
+        keys = self._loose_keys.get(d)
+        if keys is None:
+            try:
+                files = os.listdir(self.root + "/objects/" + d)
+            except (FileNotFoundError, NotADirectoryError):
+                files = []
+            keys = sorted(d + f for f in files)
+            self._loose_keys[d] = keys
+        ret = []
+        i = bisect_left(keys, prefix)
+        while i < len(keys) and keys[i].startswith(prefix):
+            ret.append(keys[i])
+            i += 1
+        return ret
+
+    def _filename_from_key(self, key: str) -> Tuple[str, str, str]:
         root = self.root
-        if not (isinstance(key, str)) or len(key) < 4:
+        if not (isinstance(key, str)) or len(key) < MIN_KEY_LEN:
             raise FileNotFoundError(f"Incorrect key format: '{key}'")
         d = key[0:2]
         fname = key[2:]
@@ -74,8 +247,11 @@ class DB(PObjectDB):
         return lfname, ldirs, fname
 
     def _check_repo(self) -> None:
+        if self._checked:
+            return
         if self.root is None or not os.path.isdir(self.root):
             raise FileNotFoundError("Not in a repo")
+        self._checked = True  # Don't stat the root on every single access
 
     def get_full_key(self, key: str) -> str:
         """Return the full key from a partial key."""
@@ -83,11 +259,67 @@ class DB(PObjectDB):
         if key is None or key.strip() == "":
             raise FileNotFoundError("Empty key")
         lfname, _, _ = self._filename_from_key(key)
-        files = glob.glob(lfname + "*")
-        if len(files) != 1:
+        if len(key) == KEY_LEN and self._exists(key):
+            return key
+        keys = self._keys_with_prefix(key)
+        if not keys:
+            self._forget_listings()  # Written or packed by someone else?
+            keys = self._keys_with_prefix(key)
+        if not keys:
             raise FileNotFoundError("Object not found")
-        f = files[0]
-        return "".join(f.split("/")[-2:])
+        if len(keys) > 1:
+            raise AmbiguousKeyError(
+                f"Ambiguous key '{key}', candidates: {', '.join(keys)}"
+            )
+        return keys[0]
+
+    def _keys_with_prefix(self, prefix: str) -> List[str]:
+        keys = set(self._loose_with_prefix(prefix))
+        for p in self._get_packs():
+            keys.update(p.keys_with_prefix(prefix))
+        return sorted(keys)
+
+
+def _parse_object(contents: bytes) -> DBObject:
+    """Build a DBObject from the decompressed contents of an object."""
+    idx_typ = contents.index(b" ")
+    idx_len = contents.index(0)
+    typ = contents[0:idx_typ].decode("UTF-8")
+    length = contents[idx_typ:idx_len].decode("UTF-8")
+    return DBObject(DBObjectType(typ), int(length), contents[idx_len + 1 :])
+
+
+def _compress_stream(
+    fileobj: BinaryIO, size: int, typ: DBObjectType, out: Optional[BinaryIO]
+) -> DBObjectKey:
+    """Compress the object read from fileobj to out (if any), returning its key.
+
+    The result is the same as with _prepare_to_save, a chunk at a time.
+    """
+    compressor = zlib.compressobj()
+    hasher = hashlib.sha1()
+
+    def emit(data: bytes) -> None:
+        hasher.update(data)
+        if out is not None:
+            out.write(data)
+
+    emit(compressor.compress(f"{typ.name.lower()} {size}\0".encode("UTF-8")))
+    remaining = size
+    while remaining > 0:
+        chunk = fileobj.read(min(STREAM_CHUNK, remaining))
+        if not chunk:
+            raise ValueError(f"Stream ended {remaining} bytes before its size")
+        remaining -= len(chunk)
+        emit(compressor.compress(chunk))
+    emit(compressor.flush())
+    return hasher.hexdigest()
+
+
+def object_key(content: Union[bytes, str], typ: DBObjectType) -> DBObjectKey:
+    """Return the key content would be stored with, as an object of type typ."""
+    key, _ = _prepare_to_save(content, typ)
+    return key
 
 
 def _prepare_to_save(
@@ -0,0 +1,151 @@
+"""Copy/insert deltas between two byte strings, used inside packs.
+
+The format follows the one used by git:
+
+- The sizes of the base and of the result, as little endian base-128 varints.
+- A sequence of instructions. A byte with the high bit set is a copy from
+  the base: its low 4 bits flag which offset bytes follow and the next 3 bits
+  which size bytes follow (a size of 0 means 0x10000). Any other non-zero
+  byte is an insert of that many literal bytes, which follow it.
+
+Matching is done line by line, which is cheap to compute and works well for
+the successive revisions of text files that make most of our history.
+"""
+
+from typing import Dict, List, Optional
+
+MAX_COPY = 0xFFFFFF
+MAX_INSERT = 0x7F
+MIN_MATCH = 8  # Shorter lines are only copied when they extend a match
+
+
+def create_delta(
+    base: bytes, target: bytes, index: Optional[Dict[bytes, int]] = None
+) -> bytes:
+    """Return the delta that transforms base into target.
+
+    index is the result of line_index(base), for callers trying several
+    targets against the same base.
+    """
+    if index is None:
+        index = line_index(base)
+    out = bytearray(_varint(len(base)) + _varint(len(target)))
+    pending = bytearray()
+    copy_start = copy_len = 0
+    for line in target.splitlines(keepends=True):
+        if copy_len and base.startswith(line, copy_start + copy_len):
+            copy_len += len(line)
+            continue
+        src = index.get(line) if len(line) >= MIN_MATCH else None
+        if src is None:
+            if copy_len:
+                _emit_copy(out, copy_start, copy_len)
+                copy_len = 0
+            pending += line
+        else:
+            if copy_len:
+                _emit_copy(out, copy_start, copy_len)
+            _emit_insert(out, pending)
+            pending = bytearray()
+            copy_start, copy_len = src, len(line)
+    if copy_len:
+        _emit_copy(out, copy_start, copy_len)
+    _emit_insert(out, pending)
+    return bytes(out)
+
+
+def apply_delta(base: bytes, delta: bytes) -> bytes:
+    """Return the result of applying delta to base."""
+    base_size, pos = _read_varint(delta, 0)
+    size, pos = _read_varint(delta, pos)
+    if base_size != len(base):
+        raise ValueError("Delta base size mismatch")
+    out: List[bytes] = []
+    dlen = len(delta)
+    while pos < dlen:
+        op = delta[pos]
+        pos += 1
+        if op & 0x80:
+            offset = length = 0
+            for i in range(4):
+                if op & (1 << i):
+                    offset |= delta[pos] << (8 * i)
+                    pos += 1
+            for i in range(3):
+                if op & (0x10 << i):
+                    length |= delta[pos] << (8 * i)
+                    pos += 1
+            if length == 0:
+                length = 0x10000
+            out.append(base[offset : offset + length])
+        elif op:
+            out.append(delta[pos : pos + op])
+            pos += op
+        else:
+            raise ValueError("Incorrect delta instruction")
+    ret = b"".join(out)
+    if len(ret) != size:
+        raise ValueError("Delta result size mismatch")
+    return ret
+
+
+def line_index(base: bytes) -> Dict[bytes, int]:
+    """Map each (long enough) line of base to the offset of its first occurrence."""
+    ret: Dict[bytes, int] = {}
+    pos = 0
+    for line in base.splitlines(keepends=True):
+        if len(line) >= MIN_MATCH and line not in ret:
+            ret[line] = pos
+        pos += len(line)
+    return ret
+
+
+def _emit_copy(out: bytearray, offset: int, length: int) -> None:
+    while length > 0:
+        n = min(length, MAX_COPY)
+        op = 0x80
+        args = bytearray()
+        for i in range(4):
+            b = (offset >> (8 * i)) & 0xFF
+            if b:
+                op |= 1 << i
+                args.append(b)
+        for i in range(3):
+            b = (n >> (8 * i)) & 0xFF
+            if b:
+                op |= 0x10 << i
+                args.append(b)
+        out.append(op)
+        out += args
+        offset += n
+        length -= n
+
+
+def _emit_insert(out: bytearray, data: bytearray) -> None:
+    for i in range(0, len(data), MAX_INSERT):
+        chunk = data[i : i + MAX_INSERT]
+        out.append(len(chunk))
+        out += chunk
+
+
+def _varint(n: int) -> bytes:
+    ret = bytearray()
+    while True:
+        b = n & 0x7F
+        n >>= 7
+        if n:
+            ret.append(b | 0x80)
+        else:
+            ret.append(b)
+            return bytes(ret)
+
+
+def _read_varint(data: bytes, pos: int):
+    ret = shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        ret |= (b & 0x7F) << shift
+        shift += 7
+        if not b & 0x80:
+            return ret, pos
@@ -2,24 +2,53 @@
 
 import os
 import os.path
-from typing import Optional, List
+from dataclasses import dataclass
+from typing import Dict, Optional, List
+from ..api import StatData
+from .lockfile import write_locked
 
 VC_DIR = ".vc"
 
 
-def find_vc_root_dir(startdir=os.curdir) -> Optional[str]:
-    """Find the current repo root dir '.vc', if we are in a repo."""
-    curr = startdir
-    prev = None
+@dataclass(frozen=True)
+class RepoDirs:
+    """The directories of a repo: '.vc' and the working tree, as absolute paths."""
+
+    vc_dir: str
+    worktree: str
+
+
+_found: Dict[str, RepoDirs] = {}  # Repos found by find_repo, by start dir
 
+
+def find_repo(startdir: str = os.curdir) -> Optional[RepoDirs]:
+    """Find the repo containing startdir (the current dir by default).
+
+    The repo is looked for once per process for each start dir: the
+    directories found are remembered, and then resolved without any call
+    to the file system.
+    """
+    start = os.path.abspath(startdir)
+    repo = _found.get(start)
+    if repo is not None:
+        return repo
+    curr = start
     while True:
-        if prev and os.path.realpath(curr) == os.path.realpath(prev):
+        if os.path.isdir(curr + "/" + VC_DIR):
+            vc_dir = os.path.realpath(curr + "/" + VC_DIR)  # Found it!
+            repo = RepoDirs(vc_dir, os.path.dirname(vc_dir))
+            _found[start] = repo
+            return repo
+        parent = os.path.dirname(curr)
+        if parent == curr:
             return None
-        d = curr + "/" + VC_DIR
-        if os.path.isdir(d):
-            return os.path.realpath(d)  # Found it!
-        prev = curr
-        curr = prev + "/.."
+        curr = parent
+
+
+def find_vc_root_dir(startdir=os.curdir) -> Optional[str]:
+    """Find the current repo root dir '.vc', if we are in a repo."""
+    repo = find_repo(startdir)
+    return repo.vc_dir if repo else None
 
 
 def create_vc_root_dir(parent_dir=os.curdir) -> str:
@@ -52,19 +81,20 @@ def head_read(base_dir: str) -> str:
 
 
 def write_file(base_dir: str, file: str, contents: str) -> None:
-    """Write to the file from the repo at base_dir, creating it if needed."""
-    path = _create_path_if_needed(base_dir, file)
-    with open(path, "w") as f:
-        f.write(contents + "\n")
+    """Write to the file from the repo at base_dir, creating it if needed.
+
+    The file is replaced at once, under its lock (see lockfile.py).
+    """
+    write_locked(_build_full_path(base_dir, file), (contents + "\n").encode())
 
 
 def read_file(base_dir: str, file: str) -> str:
-    """Read the file from the repo at base_dir, creating it if needed."""
-    path = _build_full_path(base_dir, file)
-    if not os.path.exists(path):
+    """Read the file from the repo at base_dir ('' if it doesn't exist)."""
+    try:
+        with open(_build_full_path(base_dir, file), "r") as f:
+            return f.read().rstrip()
+    except FileNotFoundError:
         return ""
-    with open(path, "r") as f:
-        return f.read().rstrip()
 
 
 def remove_file(base_dir: str, file_dir: str) -> None:
@@ -91,22 +121,45 @@ def list_files(base_dir: str, rel_path: str) -> List[str]:
     return [f for f in files if os.path.isfile(full_path + "/" + f)]
 
 
-def _create_path_if_needed(base_dir: str, file: str) -> str:
-    """Creathe the dires for the given file path, if they don't already exist"""
-    path = _build_full_path(base_dir, file)
-    dir = "/".join(path.split("/")[:-1])
-    if dir and not dir.strip() == "":
-        if os.path.exists(dir) and not os.path.isdir(dir):
-            raise FileExistsError(f"Internal error: dir '{dir}' exists but it's a file")
-        elif not os.path.exists(dir):
-            os.makedirs(dir)
-    if not os.path.exists(path):
-        with open(path, "w"):
-            pass  # Force create file
-    return path
+def file_stat(path: str) -> Optional[StatData]:
+    """Return the metadata of the file at path, or None if it doesn't exist."""
+    try:
+        st = os.lstat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    return StatData(st.st_mtime_ns, st.st_ctime_ns, st.st_size, st.st_ino, st.st_mode)
+
+
+def worktree_path(base_dir: str, name: str) -> str:
+    """Return the path of name (relative to the working tree) for the repo at base_dir."""
+    if base_dir.endswith("/" + VC_DIR):
+        return base_dir[: -len(VC_DIR)] + name
+    return base_dir + "/../" + name
+
+
+def remove_worktree_file(base_dir: str, name: str) -> None:
+    """Remove name from the working tree, and its directories if they end up empty."""
+    try:
+        os.remove(worktree_path(base_dir, name))
+    except FileNotFoundError:
+        pass
+    d = os.path.dirname(name)
+    while d:
+        try:
+            os.rmdir(worktree_path(base_dir, d))
+        except OSError:  # Not empty
+            break
+        d = os.path.dirname(d)
 
 
 def _build_full_path(base_dir: str, file: str) -> str:
+    """Return the full path of file in the repo at base_dir.
+
+    base_dir is usually the absolute path of the '.vc' dir (the root of a
+    PRepo), which is used as is. Otherwise, the repo containing it is found.
+    """
+    if base_dir.endswith("/" + VC_DIR) and os.path.isabs(base_dir):
+        return base_dir + "/" + file
     root = find_vc_root_dir(base_dir)
     if root is None or root.strip() == "":
         raise FileNotFoundError("Not in a repo")
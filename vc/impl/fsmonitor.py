@@ -0,0 +1,400 @@
+"""Filesystem monitor: a daemon recording the paths changed in the working tree.
+
+The daemon watches every directory of the working tree with inotify (Linux
+only) and serves queries on a Unix socket, '.vc/fsmonitor.sock'. A query
+carries the token returned by the previous one and gets back a new token
+and the paths changed since the old one, or None when they aren't known
+(the token comes from another run of the daemon, or events were lost): the
+caller must then scan the whole working tree. Tokens are
+'<instance>:<sequence>', the instance being random for each run.
+
+Requests and responses are single lines of JSON:
+
+- {"query": "<token>"} -> {"token": "<token>", "changed": [paths] or null}
+- {"stop": true} -> {"stopped": true}
+
+Clients keep the last token in '.vc/fsmonitor', with the signature of the
+index it was obtained for and the paths that were found modified then. The
+files that may have changed since are the ones reported by the daemon plus
+those. Anything unexpected (no daemon, a stale token, a changed index) makes
+the caller fall back to the full scan.
+"""
+
+from __future__ import annotations  # For the annotations with socket
+import os
+import sys
+import errno
+import struct
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Set, Tuple
+from .fs import VC_DIR, file_stat, worktree_path
+from .lockfile import LockError, write_locked
+
+if TYPE_CHECKING:  # Imported where used, as the daemon and its clients need it
+    import socket
+
+SOCKET_FILE = "fsmonitor.sock"
+STATE_FILE = "fsmonitor"
+STATE_VERSION = 1
+MAX_CHANGES = 100000  # More changed paths make all tokens stale
+QUERY_TIMEOUT = 2.0  # Seconds
+
+_IN_MODIFY = 0x2
+_IN_ATTRIB = 0x4
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_FROM = 0x40
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_DELETE_SELF = 0x400
+_IN_MOVE_SELF = 0x800
+_IN_Q_OVERFLOW = 0x4000
+_IN_IGNORED = 0x8000
+_IN_ONLYDIR = 0x01000000
+_IN_DONT_FOLLOW = 0x02000000
+_IN_ISDIR = 0x40000000
+_WATCH_MASK = (
+    _IN_MODIFY
+    | _IN_ATTRIB
+    | _IN_CLOSE_WRITE
+    | _IN_MOVED_FROM
+    | _IN_MOVED_TO
+    | _IN_CREATE
+    | _IN_DELETE
+    | _IN_DELETE_SELF
+    | _IN_MOVE_SELF
+    | _IN_ONLYDIR
+    | _IN_DONT_FOLLOW
+)
+_EVENT = struct.Struct("iIII")  # wd, mask, cookie, name length
+
+
+class Inotify:
+    """Minimal wrapper of the inotify API, through ctypes."""
+
+    def __init__(self) -> None:
+        """Create the inotify instance (non blocking)."""
+        import ctypes
+        import ctypes.util
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path: str, mask: int) -> int:
+        """Watch the directory at path, returning the watch descriptor."""
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            import ctypes
+
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def read(self) -> List[Tuple[int, int, str]]:
+        """Return the pending (wd, mask, name) events, without blocking."""
+        ret = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return ret
+            pos = 0
+            while pos < len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, pos)
+                pos += _EVENT.size
+                name = os.fsdecode(data[pos : pos + length].rstrip(b"\0"))
+                pos += length
+                ret.append((wd, mask, name))
+
+    def close(self) -> None:
+        """Release the inotify instance."""
+        os.close(self.fd)
+
+
+class Monitor:
+    """Record the paths changed in the working tree of the repo at root."""
+
+    root: str
+    worktree: str
+
+    def __init__(self, root: str):
+        """Start watching the working tree of the repo at root (the '.vc' dir)."""
+        self.root = root
+        self.worktree = os.path.realpath(worktree_path(root, ""))
+        self._inotify = Inotify()
+        self._dirs: Dict[int, str] = {}  # Watch descriptor -> dir (relative)
+        self._changes: Dict[str, int] = {}  # Path -> sequence of its last change
+        self._instance = os.urandom(6).hex()
+        self._seq = 0
+        self._watch_tree("")
+
+    def query(self, since: str) -> Tuple[str, Optional[List[str]]]:
+        """Return a new token and the paths changed since the token since.
+
+        The paths are None if they are not known.
+        """
+        self.process_events()
+        instance, _, seq = since.partition(":")
+        self._seq += 1
+        token = f"{self._instance}:{self._seq}"
+        if instance != self._instance or not seq.isdigit():
+            return token, None
+        old = int(seq)
+        return token, sorted(p for p, s in self._changes.items() if s > old)
+
+    def process_events(self) -> None:
+        """Record the changes notified since the last call."""
+        for wd, mask, name in self._inotify.read():
+            if mask & _IN_Q_OVERFLOW:
+                self._reset()
+                continue
+            d = self._dirs.get(wd)
+            if d is None:
+                continue
+            if mask & _IN_IGNORED:
+                del self._dirs[wd]
+                continue
+            path = d + "/" + name if d and name else d or name
+            if path == VC_DIR or path.startswith(VC_DIR + "/"):
+                continue
+            self._changed(path)
+            if mask & _IN_ISDIR and mask & (_IN_CREATE | _IN_MOVED_TO):
+                self._watch_tree(path, record=True)
+
+    def serve_forever(self) -> None:
+        """Serve queries on the socket of the repo until asked to stop."""
+        import selectors
+        import socket
+
+        path = self.root + "/" + SOCKET_FILE
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        server.listen()
+        sel = selectors.DefaultSelector()
+        sel.register(server, selectors.EVENT_READ)
+        sel.register(self._inotify.fd, selectors.EVENT_READ)
+        try:
+            while True:
+                for key, _ in sel.select():
+                    if key.fileobj is server:
+                        conn, _ = server.accept()
+                        with conn:
+                            if not self._handle(conn):
+                                return
+                    else:
+                        self.process_events()
+        finally:
+            sel.close()
+            server.close()
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            self._inotify.close()
+
+    def _handle(self, conn: socket.socket) -> bool:
+        """Answer the request on conn, returning False if asked to stop."""
+        import json
+
+        conn.settimeout(QUERY_TIMEOUT)
+        try:
+            request = json.loads(_read_line(conn))
+        except (OSError, ValueError):
+            return True
+        if request.get("stop"):
+            _send(conn, {"stopped": True})
+            return False
+        token, changed = self.query(str(request.get("query", "")))
+        _send(conn, {"token": token, "changed": changed})
+        return True
+
+    def _changed(self, path: str) -> None:
+        self._changes[path] = self._seq + 1  # Reported to the next query
+        if len(self._changes) > MAX_CHANGES:
+            self._reset()
+
+    def _reset(self) -> None:
+        """Forget the changes, making all the tokens given out stale."""
+        self._changes.clear()
+        self._instance = os.urandom(6).hex()
+
+    def _watch_tree(self, d: str, record: bool = False) -> None:
+        """Watch d and its subdirectories, recording their contents if record.
+
+        Entries created in a new dir before it's watched are only noticed by
+        listing it, so they are all recorded as changed.
+        """
+        for top, dirs, files in os.walk(self.worktree + "/" + d):
+            rel = os.path.relpath(top, self.worktree)
+            rel = "" if rel == "." else rel
+            if rel == "":
+                dirs[:] = [x for x in dirs if x != VC_DIR]
+            try:
+                self._dirs[self._inotify.add_watch(top, _WATCH_MASK)] = rel
+            except OSError as e:
+                if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                    raise
+            if record:
+                prefix = rel + "/" if rel else ""
+                for name in dirs + files:
+                    self._changed(prefix + name)
+
+
+@dataclass
+class MonitorQuery:
+    """Answer of the monitor for a repo: the files that may have changed.
+
+    changed is None when the monitor doesn't know, so all the files have to
+    be checked.
+    """
+
+    root: str
+    token: str
+    index: str  # Signature of the index the token is valid for
+    changed: Optional[Set[str]]
+
+    def may_have_changed(self, name: str) -> bool:
+        """Return True if name (or one of its parent dirs) may have changed."""
+        if self.changed is None:
+            return True
+        while name:
+            if name in self.changed:
+                return True
+            name = os.path.dirname(name)
+        return False
+
+    def save(self, modified: Iterable[str]) -> None:
+        """Remember the token, with the files found modified for it."""
+        lines = [str(STATE_VERSION), self.token, self.index] + sorted(modified)
+        path = self.root + "/" + STATE_FILE
+        try:  # Not waiting if another process is writing it
+            write_locked(path, ("\n".join(lines) + "\n").encode(), timeout=0)
+        except (OSError, LockError):
+            pass  # The next query will just scan everything
+
+
+def query(root: str) -> Optional[MonitorQuery]:
+    """Ask the monitor of the repo at root what changed since the last query.
+
+    Return None if there's no monitor running.
+    """
+    old_token, old_index, modified = _read_state(root)
+    response = _request(root, {"query": old_token})
+    if response is None or "token" not in response:
+        return None
+    index = _index_signature(root)
+    changed = response.get("changed")
+    if changed is None or index != old_index:
+        return MonitorQuery(root, response["token"], index, None)
+    return MonitorQuery(root, response["token"], index, set(changed) | set(modified))
+
+
+def is_running(root: str) -> bool:
+    """Return True if the monitor of the repo at root answers."""
+    return _request(root, {"query": ""}) is not None
+
+
+def start(root: str) -> bool:
+    """Start the monitor for the repo at root, in the background.
+
+    Return False if it was already running.
+    """
+    if is_running(root):
+        return False
+    import subprocess
+
+    pkg_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        p for p in [pkg_dir, env.get("PYTHONPATH", "")] if p
+    )
+    subprocess.Popen(
+        [sys.executable, "-m", "vc.impl.fsmonitor", root],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+        env=env,
+    )
+    for _ in range(100):  # Wait until it answers
+        if is_running(root):
+            return True
+        time.sleep(0.05)
+    raise Exception("error: the filesystem monitor didn't start")
+
+
+def stop(root: str) -> bool:
+    """Stop the monitor for the repo at root, returning False if not running."""
+    return _request(root, {"stop": True}) is not None
+
+
+def _request(root: str, request: dict) -> Optional[dict]:
+    if not os.path.exists(root + "/" + SOCKET_FILE):
+        return None  # Not running: no need to import socket and json
+    import json
+    import socket
+
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.settimeout(QUERY_TIMEOUT)
+    try:
+        s.connect(root + "/" + SOCKET_FILE)
+        _send(s, request)
+        return json.loads(_read_line(s))
+    except (OSError, ValueError):
+        return None
+    finally:
+        s.close()
+
+
+def _send(s: socket.socket, message: dict) -> None:
+    import json
+
+    s.sendall(json.dumps(message).encode("UTF-8") + b"\n")
+
+
+def _read_line(s: socket.socket) -> str:
+    data = bytearray()
+    while not data.endswith(b"\n"):
+        chunk = s.recv(64 * 1024)
+        if not chunk:
+            break
+        data += chunk
+    return data.decode("UTF-8")
+
+
+def _read_state(root: str) -> Tuple[str, str, List[str]]:
+    """Return the last token, its index signature and the files modified then.
+
+    The state is dropped if the index was modified in the instant it was
+    saved, as it could have changed again without its signature changing.
+    """
+    try:
+        with open(root + "/" + STATE_FILE, "r") as f:
+            lines = f.read().splitlines()
+            mtime_ns = os.fstat(f.fileno()).st_mtime_ns
+    except FileNotFoundError:
+        return "", "", []
+    index = file_stat(root + "/index")
+    if index is not None and index.mtime_ns >= mtime_ns:
+        return "", "", []
+    if len(lines) < 3 or lines[0] != str(STATE_VERSION):
+        return "", "", []
+    return lines[1], lines[2], lines[3:]
+
+
+def _index_signature(root: str) -> str:
+    st = file_stat(root + "/index")
+    if st is None:
+        return ""
+    return f"{st.mtime_ns}:{st.ctime_ns}:{st.size}:{st.ino}"
+
+
+if __name__ == "__main__":
+    Monitor(sys.argv[1]).serve_forever()
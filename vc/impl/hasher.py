@@ -0,0 +1,90 @@
+"""Comparison of the working tree with a list of entries, using worker pools.
+
+Checking a file is done in two steps. First its metadata is compared with
+the one recorded for the entry, which is cheap but I/O bound: many stat()
+calls are run in a thread pool. Then the files whose metadata changed are
+hashed, which is CPU bound: when there are enough of them, they are hashed
+in a process pool. Results are always returned in the order of the entries.
+"""
+
+import os
+import stat
+from typing import List, Optional, Sequence, Tuple
+from ..api import PObjectDB, DirEntry, StatData
+from .db import DB, STREAM_THRESHOLD
+from .fs import file_stat, worktree_path
+
+STAT_PARALLEL_THRESHOLD = 1024  # Fewer files are stat'ed in this thread
+HASH_PARALLEL_THRESHOLD = 64  # Fewer files are hashed without a process pool
+STAT_THREADS = 16
+
+
+def changed_entries(
+    entries: Sequence[DirEntry],
+    db: PObjectDB,
+    root: str,
+    workers: Optional[int] = None,
+) -> List[DirEntry]:
+    """Return the entries whose file in the working tree has other contents.
+
+    Missing files and directories are not considered changed. workers is
+    the size of the process pool used to hash files (by default, one per CPU).
+    """
+    paths = [worktree_path(root, e.ename) for e in entries]
+    stats = _stat_files(paths)
+    candidates: List[Tuple[DirEntry, str, StatData]] = [
+        (e, p, st)
+        for e, p, st in zip(entries, paths, stats)
+        if st is not None and not stat.S_ISDIR(st.mode) and st != e.estat
+    ]
+    keys = hash_files(db, root, [(p, st.size) for _, p, st in candidates], workers)
+    return [e for (e, _, _), key in zip(candidates, keys) if key != e.ehash]
+
+
+def hash_files(
+    db: PObjectDB,
+    root: str,
+    files: Sequence[Tuple[str, int]],
+    workers: Optional[int] = None,
+) -> List[str]:
+    """Return the keys of the (path, size) files, in the same order."""
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(files) < HASH_PARALLEL_THRESHOLD:
+        return [hash_file(db, p, size) for p, size in files]
+    from concurrent.futures import ProcessPoolExecutor  # Slow to import, rarely needed
+
+    chunksize = max(1, min(256, len(files) // (workers * 4)))
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(root,)) as ex:
+        return list(ex.map(_hash_file_in_worker, files, chunksize=chunksize))
+
+
+def hash_file(db: PObjectDB, path: str, size: int) -> str:
+    """Return the key the file at path would have in the db."""
+    with open(path, "rb") as f:
+        if size >= STREAM_THRESHOLD:
+            return db.calculate_key_stream(f, size)
+        return db.calculate_key(f.read())
+
+
+def _stat_files(paths: List[str]) -> List[Optional[StatData]]:
+    if len(paths) < STAT_PARALLEL_THRESHOLD:
+        return [file_stat(p) for p in paths]
+    from concurrent.futures import ThreadPoolExecutor  # Slow to import, rarely needed
+
+    chunksize = max(1, len(paths) // (STAT_THREADS * 4))
+    with ThreadPoolExecutor(STAT_THREADS) as ex:
+        return list(ex.map(file_stat, paths, chunksize=chunksize))
+
+
+_worker_db: Optional[PObjectDB] = None
+
+
+def _init_worker(root: str) -> None:
+    global _worker_db
+    _worker_db = DB(root)
+
+
+def _hash_file_in_worker(file: Tuple[str, int]) -> str:
+    assert _worker_db is not None
+    return hash_file(_worker_db, *file)
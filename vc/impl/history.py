@@ -0,0 +1,196 @@
+"""Walks over the history: ancestry checks, merge bases and revision walks.
+
+Parents, generation numbers and timestamps come from the commit-graph when
+the commit is in it, so walks don't need to read commit objects. Commits not
+in the graph are read with the loader, and get an infinite generation (they
+might be descendants of anything).
+"""
+
+import heapq
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+from .commitgraph import CommitGraph, CommitInfo
+
+GENERATION_INFINITY = 0xFFFFFFFF
+
+_PARENT1 = 1
+_PARENT2 = 2
+_STALE = 4
+_RESULT = 8
+
+
+@dataclass
+class CommitNode:
+    """What is needed about a commit to walk the history."""
+
+    key: str
+    tree: str
+    parents: List[str]
+    generation: int
+    timestamp: int
+
+
+class History:
+    """Access to the commits of a repo, through its commit-graph if possible."""
+
+    def __init__(
+        self,
+        graph: Optional[CommitGraph],
+        load: Callable[[str], Optional[CommitInfo]],
+    ):
+        """Use graph (if any), and load for the commits not in it."""
+        self._graph = graph
+        self._load = load
+        self._nodes: Dict[str, CommitNode] = {}
+
+    def node(self, key: str) -> Optional[CommitNode]:
+        """Return the node for the commit with the (full) key, or None."""
+        ret = self._nodes.get(key)
+        if ret is not None:
+            return ret
+        g = self._graph
+        pos = g.position(key) if g is not None else None
+        if g is not None and pos is not None:
+            parent_pos = g.parents(pos)
+            if parent_pos is None:  # Octopus merge: parents only in the object
+                info = self._load(key)
+                parents = info.parents if info is not None else []
+            else:
+                parents = [g.key(p) for p in parent_pos]
+            ret = CommitNode(key, g.tree(pos), parents, g.generation(pos), g.timestamp(pos))
+        else:
+            info = self._load(key)
+            if info is None:
+                return None
+            ret = CommitNode(
+                key, info.tree, info.parents, GENERATION_INFINITY, info.timestamp
+            )
+        self._nodes[key] = ret
+        return ret
+
+    def is_ancestor(self, ancestor: str, key: str) -> bool:
+        """Return True if ancestor is key or one of its ancestors."""
+        target = self.node(ancestor)
+        if target is None:
+            return False
+        pending = [key]
+        seen: Set[str] = set()
+        while pending:
+            k = pending.pop()
+            if k == ancestor:
+                return True
+            if k in seen:
+                continue
+            seen.add(k)
+            n = self.node(k)
+            if n is None:
+                continue
+            # Ancestors have lower generations (and commits in the graph only
+            # have ancestors in the graph)
+            if n.generation <= target.generation and n.generation != GENERATION_INFINITY:
+                continue
+            pending.extend(n.parents)
+        return False
+
+    def merge_bases(self, a: str, b: str) -> List[str]:
+        """Return the best common ancestors of a and b.
+
+        Those are the common ancestors which are not ancestors of other
+        common ancestors. There's usually only one.
+        """
+        if a == b:
+            return [a]
+        candidates = self._paint_down_to_common(a, b)
+        ret = []
+        for c in candidates:
+            if not any(o != c and self.is_ancestor(c, o) for o in candidates):
+                ret.append(c)
+        return ret
+
+    def _paint_down_to_common(self, a: str, b: str) -> List[str]:
+        """Return the common ancestors of a and b reached first walking down.
+
+        Commits are visited by decreasing generation (then timestamp), each
+        one flagged with the side(s) it's reachable from. A commit reachable
+        from both is a result, and its ancestors are stale (results reached
+        later from another result are dropped). The walk stops when only
+        stale commits are left.
+        """
+        flags: Dict[str, int] = {a: _PARENT1, b: _PARENT2}
+        queue: List[Tuple[int, int, str]] = []
+        for k in (a, b):
+            self._push(queue, k)
+        ret: List[str] = []
+        while any(not flags[k] & _STALE for _, _, k in queue):
+            _, _, k = heapq.heappop(queue)
+            f = flags[k] & (_PARENT1 | _PARENT2 | _STALE)
+            if f & (_PARENT1 | _PARENT2) == _PARENT1 | _PARENT2:
+                if not flags[k] & _RESULT:
+                    flags[k] |= _RESULT
+                    ret.append(k)
+                f |= _STALE
+            n = self.node(k)
+            for p in n.parents if n is not None else []:
+                if flags.get(p, 0) & f == f:
+                    continue
+                flags[p] = flags.get(p, 0) | f
+                self._push(queue, p)
+        return [k for k in ret if not flags[k] & _STALE]
+
+    def walk(
+        self,
+        include: List[str],
+        exclude: Optional[List[str]] = None,
+        topo_order: bool = False,
+        first_parent: bool = False,
+        since: Optional[int] = None,
+    ) -> Iterator[CommitNode]:
+        """Yield the commits reachable from include but not from exclude.
+
+        Commits come newest first: by commit date, or by generation with
+        topo_order (so no commit comes before one of its descendants; those
+        out of the commit-graph can only be sorted by date). The
+        walk is lazy: each commit is produced after reading only the commits
+        which come before it, and the excluded ones with a higher generation
+        (all of them, without the graph). With first_parent, only the first
+        parent of merges is followed. Commits older than since (a timestamp)
+        are not shown nor walked through.
+        """
+        exclude = exclude or []
+        hidden: Set[str] = set(exclude)
+        hidden_queue: List[Tuple[int, int, str]] = []
+        for k in exclude:
+            self._push(hidden_queue, k)
+        seen: Set[str] = set(include)
+        queue: List[Tuple[int, int, str]] = []
+        for k in include:
+            self._push(queue, k, not topo_order)
+        while queue:
+            _, _, k = heapq.heappop(queue)
+            n = self.node(k)
+            if n is None:
+                continue
+            # Any excluded commit reaching n has a higher generation (or an
+            # infinite one, if n has it too)
+            while hidden_queue and -hidden_queue[0][0] >= n.generation:
+                _, _, h = heapq.heappop(hidden_queue)
+                hn = self.node(h)
+                for p in hn.parents if hn is not None else []:
+                    if p not in hidden:
+                        hidden.add(p)
+                        self._push(hidden_queue, p)
+            if k in hidden or (since is not None and n.timestamp < since):
+                continue
+            yield n
+            for p in n.parents[:1] if first_parent else n.parents:
+                if p not in seen:
+                    seen.add(p)
+                    self._push(queue, p, not topo_order)
+
+    def _push(
+        self, queue: List[Tuple[int, int, str]], key: str, by_date: bool = False
+    ) -> None:
+        """Queue key, by decreasing generation (or date) then date (or generation)."""
+        n = self.node(key)
+        gen, ts = (n.generation, n.timestamp) if n is not None else (0, 0)
+        heapq.heappush(queue, (-ts, -gen, key) if by_date else (-gen, -ts, key))
@@ -0,0 +1,292 @@
+"""Handling of the '.vcignore' files.
+
+The patterns follow the gitignore syntax:
+
+- Blank lines and lines starting with '#' are skipped.
+- '*' matches anything but '/', '?' any character but '/' and '[...]' a
+  character class. '**' matches across directories: '**/x', 'a/**' and
+  'a/**/b'. A backslash escapes the next character.
+- A pattern ending in '/' only matches directories.
+- A pattern with a '/' (other than a trailing one) is matched against the
+  path relative to the directory of the '.vcignore' file, otherwise it is
+  matched against the name of the entry, at any depth.
+- A pattern starting with '!' re-includes what previous patterns excluded.
+  As the contents of an ignored directory are never read, nothing below an
+  ignored directory can be re-included.
+
+Every directory can have a '.vcignore' file, whose patterns take precedence
+over the ones of its parent directories. The '.vc' dir is always ignored.
+
+Each file is compiled once into a matcher. The last pattern matching a path
+decides, so patterns are grouped into runs of consecutive patterns with the
+same sign, evaluated from the last one. In a group, literal patterns are
+looked up in sets (as are '*.ext' suffixes) and the rest are combined in a
+single regular expression per literal prefix.
+"""
+
+import os.path
+import re
+import hashlib
+from typing import Dict, List, Optional, Pattern, Set, Tuple
+from .fs import worktree_path
+
+IGNORE_FILE = ".vcignore"
+_GLOB_CHARS = re.compile(r"[*?\[\\]")
+
+
+class _Group:
+    """Patterns of the same sign, of one kind (anchored or not, dirs only or not).
+
+    The regular expressions are bucketed by the literal prefix of their
+    pattern, so only the ones that can match a string are tried. Patterns
+    like '*.ext' are kept as suffixes, unless anchored ('*' doesn't match '/').
+    """
+
+    def __init__(self, anchored: bool) -> None:
+        self.anchored = anchored
+        self.literals: Set[str] = set()
+        self.suffixes: Set[str] = set()
+        self.suffix_lens: Set[int] = set()
+        self.regexes: Dict[str, List[str]] = {}
+        self.prefix_lens: Set[int] = set()
+        self.compiled: Dict[str, Pattern[str]] = {}
+
+    def add(self, pattern: str) -> None:
+        rest = pattern[1:]
+        glob = _GLOB_CHARS.search(pattern)
+        if glob is None:
+            self.literals.add(pattern)
+        elif (
+            not self.anchored
+            and pattern.startswith("*")
+            and "/" not in rest
+            and not _GLOB_CHARS.search(rest)
+        ):
+            self.suffixes.add(rest)
+            self.suffix_lens.add(len(rest))
+        else:
+            prefix = pattern[: glob.start()]
+            self.regexes.setdefault(prefix, []).append(_translate(pattern))
+            self.prefix_lens.add(len(prefix))
+
+    def compile(self) -> None:
+        for prefix, regexes in self.regexes.items():
+            self.compiled[prefix] = re.compile("|".join(f"(?:{r})" for r in regexes))
+
+    def matches(self, s: str) -> bool:
+        if s in self.literals:
+            return True
+        for n in self.suffix_lens:
+            if len(s) >= n and s[len(s) - n :] in self.suffixes:
+                return True
+        for n in self.prefix_lens:
+            r = self.compiled.get(s[:n])
+            if r is not None and r.fullmatch(s):
+                return True
+        return False
+
+
+class IgnoreRules:
+    """The compiled patterns of one '.vcignore' file."""
+
+    def __init__(self, text: str):
+        """Parse and compile the patterns in text."""
+        # (negated, {(anchored, dir_only): group}), in the order of the file
+        self._runs: List[Tuple[bool, Dict[Tuple[bool, bool], _Group]]] = []
+        for line in text.splitlines():
+            self._add(line)
+        for _, groups in self._runs:
+            for g in groups.values():
+                g.compile()
+        self._runs.reverse()
+
+    def match(self, path: str, is_dir: bool) -> Optional[bool]:
+        """Return whether path (relative to the file's dir) is ignored, or None.
+
+        None means that no pattern applies to the path.
+        """
+        name = path[path.rfind("/") + 1 :]
+        for negated, groups in self._runs:
+            for (anchored, dir_only), g in groups.items():
+                if dir_only and not is_dir:
+                    continue
+                if g.matches(path if anchored else name):
+                    return not negated
+        return None
+
+    def _add(self, line: str) -> None:
+        line = _strip_trailing_spaces(line)
+        if line == "" or line.startswith("#"):
+            return
+        negated = line.startswith("!")
+        if negated:
+            line = line[1:]
+        elif line.startswith("\\!") or line.startswith("\\#"):
+            line = line[1:]
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        anchored = "/" in line
+        line = line.lstrip("/")
+        if line == "":
+            return
+        if not self._runs or self._runs[-1][0] != negated:
+            self._runs.append((negated, {}))
+        groups = self._runs[-1][1]
+        groups.setdefault((anchored, dir_only), _Group(anchored)).add(line)
+
+
+class IgnoreMatcher:
+    """Tell which paths of the working tree are ignored.
+
+    The '.vcignore' files are read (and compiled) the first time a path
+    below their directory is checked.
+    """
+
+    worktree: str
+
+    def __init__(self, root: str):
+        """Create the matcher for the repo at root (the '.vc' dir)."""
+        self.worktree = os.path.abspath(worktree_path(root, ""))
+        self._rules: Dict[str, Optional[IgnoreRules]] = {}
+        self._texts: Dict[str, str] = {}
+        self._dirs: Dict[str, bool] = {}
+
+    def __call__(self, path: str, is_dir: bool = False) -> bool:
+        """Return True if path (relative to the working tree) is ignored."""
+        return self.ignored(path, is_dir)
+
+    def ignored(self, path: str, is_dir: bool = False) -> bool:
+        """Return True if path (relative to the working tree) is ignored.
+
+        Paths inside ignored directories are ignored too.
+        """
+        if path in ("", "."):
+            return False
+        parent = os.path.dirname(path)
+        if parent and self._dir_ignored(parent):
+            return True
+        if not is_dir:
+            return self._matches(path, False)
+        return self._dir_ignored(path)
+
+    def signature(self, dirs: List[str]) -> str:
+        """Return a string that changes if the rules for the dirs change.
+
+        The parents of the dirs are taken into account.
+        """
+        all_dirs: Set[str] = {""}
+        for d in dirs:
+            while d and d not in all_dirs:
+                all_dirs.add(d)
+                d = os.path.dirname(d)
+        h = hashlib.sha1()
+        for d in sorted(all_dirs):
+            if self._rules_for(d) is not None:
+                h.update(f"{d}\0{len(self._texts[d])}\0{self._texts[d]}\0".encode())
+        return h.hexdigest()
+
+    def _dir_ignored(self, d: str) -> bool:
+        ret = self._dirs.get(d)
+        if ret is None:
+            parent = os.path.dirname(d)
+            ret = bool(parent and self._dir_ignored(parent)) or self._matches(d, True)
+            self._dirs[d] = ret
+        return ret
+
+    def _matches(self, path: str, is_dir: bool) -> bool:
+        if path == ".vc":  # Never track the .vc dir
+            return True
+        d = os.path.dirname(path)
+        while True:  # From the deepest ignore file to the root one
+            rules = self._rules_for(d)
+            if rules is not None:
+                ret = rules.match(path[len(d) + 1 :] if d else path, is_dir)
+                if ret is not None:
+                    return ret
+            if d == "":
+                return False
+            d = os.path.dirname(d)
+
+    def _rules_for(self, d: str) -> Optional[IgnoreRules]:
+        if d in self._rules:
+            return self._rules[d]
+        fn = self.worktree + "/" + (d + "/" if d else "") + IGNORE_FILE
+        try:
+            with open(fn, "r") as f:
+                text = f.read()
+        except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+            self._rules[d] = None
+            return None
+        self._texts[d] = text
+        self._rules[d] = IgnoreRules(text)
+        return self._rules[d]
+
+
+def read_ignore(root: str) -> IgnoreMatcher:
+    """Return the matcher telling whether a path must be ignored.
+
+    root is the '.vc' dir. Paths are relative to the working tree root.
+    """
+    return IgnoreMatcher(root)
+
+
+def _translate(pattern: str) -> str:
+    """Translate a glob pattern into a regular expression."""
+    ret = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == "*":
+            if pattern.startswith("**", i):
+                at_start = i == 0 or pattern[i - 1] == "/"
+                if at_start and pattern.startswith("**/", i):
+                    ret.append("(?:.*/)?")
+                    i += 3
+                    continue
+                if at_start and i + 2 == n:
+                    ret.append(".*")
+                    i += 2
+                    continue
+            ret.append("[^/]*")
+            while i + 1 < n and pattern[i + 1] == "*":
+                i += 1
+        elif c == "?":
+            ret.append("[^/]")
+        elif c == "[":
+            # A ']' right after '[' or '[!' is part of the class
+            j = pattern.find("]", i + 3 if pattern.startswith("[!", i) else i + 2)
+            cls = _translate_class(pattern[i + 1 : j]) if j >= 0 else None
+            if cls is None:  # Not a valid class: a literal '['
+                ret.append(re.escape(c))
+            else:
+                ret.append(cls)
+                i = j
+        elif c == "\\" and i + 1 < n:
+            i += 1
+            ret.append(re.escape(pattern[i]))
+        else:
+            ret.append(re.escape(c))
+        i += 1
+    return "".join(ret)
+
+
+def _translate_class(body: str) -> Optional[str]:
+    """Translate the body of a '[...]' glob into a regular expression, or None if invalid."""
+    negated = body.startswith("!")
+    if negated:
+        body = body[1:]
+    for c in "\\[]^":
+        body = body.replace(c, "\\" + c)
+    ret = "[" + ("^" if negated else "") + body + "]"
+    try:
+        re.compile(ret)
+    except re.error:
+        return None
+    return ret
+
+
+def _strip_trailing_spaces(line: str) -> str:
+    stripped = line.rstrip(" ")
+    if stripped.endswith("\\") and len(stripped) < len(line):
+        return stripped + " "  # Escaped space
+    return stripped
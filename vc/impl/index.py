@@ -1,8 +1,12 @@
 """Default implementation of the Index protocol."""
 
+import os
 import os.path
-
-from typing import Dict, Optional, List, Set, Optional, Tuple
+import hashlib
+import struct
+import time
+import threading
+from typing import Dict, Optional, List, Tuple
 from ..api import (
     PIndex,
     PObjectDB,
@@ -13,8 +17,33 @@ from ..api import (
     Key,
     FileType,
     FileName,
+    StatData,
 )
-from .fs import head_read, head_write, write_file, read_file
+from .db import DB, STREAM_THRESHOLD
+from .fs import file_stat
+from .lockfile import LockFile
+from .refs import branch_current, head_advance
+from .ignore import IgnoreMatcher, read_ignore
+from . import commitgraph
+from .commitgraph import CommitInfo
+from .treediff import build_trees
+
+PARALLEL_THRESHOLD = 64  # Fewer files are staged without a process pool
+
+# Binary index: header, then one fixed size record per entry followed by its
+# name, then the sha1 of all the preceding bytes.
+INDEX_MAGIC = b"VCIX"
+INDEX_VERSION = 1
+FLAG_STAT = 1  # The entry has valid stat data
+_INDEX_HEADER = struct.Struct(">4sII")  # magic, version, entry count
+# mtime_ns, ctime_ns, size, inode, mode, key, type, flags, name length
+_INDEX_ENTRY = struct.Struct(">qqQQI20scHH")
+_NO_STAT = StatData(0, 0, 0, 0, 0)
+
+# Parsed index files, by name: stat signature and entries. Long running
+# processes (the daemon) parse the index again only when it changes.
+_parsed: Dict[str, Tuple[Tuple[int, int, int, int], Dict[str, IndexEntry]]] = {}
+_lock = threading.Lock()
 
 
 class Index(PIndex):
@@ -34,20 +63,23 @@ class Index(PIndex):
         If the file has already been added, the entry is updated.
         If the file has not been added, add it.
         """
-        entries = _read_index_from_file(self.root + "/index")
-        if os.path.isdir(fil_or_dir):
-            raise Exception("Directories are not supported yet.")
-        if not (os.path.isfile(fil_or_dir)):
-            raise FileNotFoundError(f"Not a valid file '{fil_or_dir}'")
-        with open(fil_or_dir, "rb") as f:
-            bb = f.read()
-        key = self.db.put(bb)
-        entries[key] = IndexEntry(
-            key,
-            "f",
-            os.path.relpath(fil_or_dir, self.root + "/.."),
-        )
-        _write_index_to_file(entries, self.root + "/index")
+        self.stage_files([fil_or_dir])
+
+    def stage_files(self, paths: List[str], workers: Optional[int] = None) -> None:
+        """Stage the given files and directories, writing the index only once.
+
+        Directories are staged recursively, skipping the ignored entries. The
+        files are hashed and stored by a pool of 'workers' processes (by
+        default, one per CPU) when there are enough of them.
+        """
+        files = _expand_paths(paths, read_ignore(self.root))
+        stored = _store_files(self.db, self.root, files, workers)
+        with LockFile(self.root + "/index") as lock:  # Others could be staging too
+            entries = _read_index_from_file(self.root + "/index")
+            for f, (key, stat) in zip(files, stored):
+                name = os.path.relpath(f, self.root + "/..")
+                entries[name] = IndexEntry(key, "f", name, stat)
+            _write_index(entries, lock)
 
     def unstage_file(self, fil: str):
         """Unstages the file, from the file, reverting it to the previous state."""
@@ -55,45 +87,41 @@ class Index(PIndex):
 
     def remove_file(self, fil: str):
         """Remove the file from the index, making it not tracked."""
-        entries = _read_index_from_file(self.root + "/index")
-
         if os.path.isdir(fil):
             raise Exception("Directories are not supported yet.")
         if not (os.path.isfile(fil)):
             raise FileNotFoundError(f"Not a valid file '{fil}'")
 
-        del entries[os.path.relpath(fil, self.root)]
-        _write_index_to_file(entries, self.root + "/index")
+        with LockFile(self.root + "/index") as lock:
+            entries = _read_index_from_file(self.root + "/index")
+            del entries[os.path.relpath(fil, self.root)]
+            _write_index(entries, lock)
 
     def save_to_db(self) -> str:
         """Save the Index to the DB, returning the key of the saved object."""
         entries = _read_index_from_file(self.root + "/index")
-        raw_tree = _build_tree(entries)
-
-        # Ensure all the intermediate dirs are in the tree
-        dirs = _all_dirs_in_index(raw_tree)
-        for d in dirs:
-            if d not in raw_tree.keys():
-                raw_tree[d] = []
-        for d in raw_tree.keys():
-            p = _parent_dir(d)
-            if d == p:
-                continue
-            if p is None:
-                break
-            pn = raw_tree[p]
-            pn.append(IndexEntry("", "d", d))
-        return _save_to_db_node("", raw_tree, self.db)
+        files = ((e.name, e.key) for e in entries.values())
+        key, _ = build_trees(files, lambda ob: self.db.put(ob, DBObjectType.TREE))
+        return key
 
     def commit(self, message: Optional[str] = None) -> str:
-        """Commit the current index, returning the commit hash."""
+        """Commit the current index, returning the commit hash.
+
+        The index is locked meanwhile, so it can't be staged to or committed
+        by others. If the head moves anyway before it is advanced, the commit
+        fails with RefConflictError: it would drop the changes of the new head.
+        """
         if message is None:
             message = "<no commit message>"
-        _, parent = _branch_current(self.root)
-
-        commit = _prepare_commit(self.save_to_db(), parent, message)
-        nkey = self.db.put(commit)
-        _head_advance(self.root, nkey)
+        with LockFile(self.root + "/index"):
+            tree = self.save_to_db()
+            timestamp = int(os.environ.get("VC_COMMITTER_DATE", "") or time.time())
+            _, parent = branch_current(self.root)
+            commit = _prepare_commit(tree, parent, message, timestamp)
+            nkey = self.db.put(commit, DBObjectType.COMMIT)
+            head_advance(self.root, nkey, parent)
+            parents = [parent] if parent else []
+            commitgraph.append(self.root, CommitInfo(nkey, tree, parents, timestamp))
         return nkey
 
     def dirtree(self) -> DirDict:
@@ -103,105 +131,195 @@ class Index(PIndex):
         ret = DirDict()
         for k, en in raw_tree.items():
             for e in en:
-                if k not in ret.keys():
-                    ret[k] = []
-                ret[k].append(DirEntry(FileName(e.name), FileType(e.type), Key(e.key)))
+                ret.add_entry(
+                    k, DirEntry(FileName(e.name), FileType(e.type), Key(e.key), e.stat)
+                )
         return ret
 
     def set_to_dirtree(self, dd: DirDict) -> None:
         """Make the index correspond to the passed dd."""
         idx = _read_index_from_dirdict(dd)
-        _write_index_to_file(idx, self.root + "/index")
+        with LockFile(self.root + "/index") as lock:
+            _write_index(idx, lock)
 
 
-def _all_dirs_in_index(raw_tree: Dict[str, List[IndexEntry]]) -> Set[str]:
-    dirs = set("")
-    for d in set(raw_tree.keys()):
-        for c in _subdirs(d):
-            dirs.add(c)
-    return dirs
+def _expand_paths(paths: List[str], ignore: IgnoreMatcher) -> List[str]:
+    """Return the files in paths, recursively expanding the directories.
 
+    The ignored entries found inside the directories are skipped.
+    """
+    ret: List[str] = []
+    for p in paths:
+        if os.path.isdir(p):
+            for d, dirs, files in os.walk(p):
+                rel = os.path.relpath(d, ignore.worktree)
+                prefix = "" if rel == "." else rel + "/"
+                dirs[:] = sorted(dd for dd in dirs if not ignore(prefix + dd, True))
+                ret.extend(d + "/" + f for f in sorted(files) if not ignore(prefix + f))
+        elif os.path.isfile(p):
+            ret.append(p)
+        else:
+            raise FileNotFoundError(f"Not a valid file '{p}'")
+    return list(dict.fromkeys(ret))  # Remove duplicates, keeping the order
 
-def _prepare_commit(tree: str, parent_hash: str, message: str) -> str:
-    ret = f"tree {tree}\n"
 
-    if parent_hash and parent_hash.strip() != "":
-        ret = ret + f"parent {parent_hash}\n"
+def _store_files(
+    db: PObjectDB, root: str, files: List[str], workers: Optional[int]
+) -> List[Tuple[str, Optional[StatData]]]:
+    """Store the files in the db, returning their keys and stats in the same order."""
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(files) < PARALLEL_THRESHOLD:
+        return [_store_file(db, f) for f in files]
+    from concurrent.futures import ProcessPoolExecutor  # Slow to import, rarely needed
 
-    # ret = ret + "author\n"
-    # ret = ret + "committer\n"
-    ret = ret + "\n"
-    ret = ret + f"{message}\n"
+    chunksize = max(1, min(256, len(files) // (workers * 4)))
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(root,)) as ex:
+        return list(ex.map(_store_file_in_worker, files, chunksize=chunksize))
 
-    return ret
 
+def _store_file(db: PObjectDB, fil: str) -> Tuple[str, Optional[StatData]]:
+    stat = file_stat(fil)  # Before reading, so later changes are noticed
+    size = os.path.getsize(fil)
+    with open(fil, "rb") as f:
+        if size >= STREAM_THRESHOLD:
+            return db.put_stream(f, size), stat
+        return db.put(f.read()), stat
 
-def _save_to_db_node(d: str, tree: Dict[str, List[IndexEntry]], db: PObjectDB) -> str:
-    ob = _build_tree_object(d, tree, db)
-    return db.put(ob, DBObjectType.TREE)
 
+_worker_db: Optional[PObjectDB] = None
 
-def _build_tree_object(d: str, tree: Dict[str, List[IndexEntry]], db: PObjectDB) -> str:
-    ob = ""
-    for en in tree[d]:
-        if en.type == "f":
-            key = en.key
-        elif en.type == "d":
-            key = _save_to_db_node(en.name, tree, db)
-        else:
-            raise Exception(f"Internal error: index entry type incorrect ({en.type})")
-        ob = ob + en.type + " " + key + " " + en.name + "\n"
 
-    return ob
+def _init_worker(root: str) -> None:
+    global _worker_db
+    _worker_db = DB(root)
 
 
-def _subdirs(d: str) -> List[str]:
-    """Calculate all the subdirs of a given directory.
+def _store_file_in_worker(fil: str) -> Tuple[str, Optional[StatData]]:
+    assert _worker_db is not None
+    return _store_file(_worker_db, fil)
+
+
+def _prepare_commit(tree: str, parent_hash: str, message: str, timestamp: int) -> str:
+    ret = f"tree {tree}\n"
+
+    if parent_hash and parent_hash.strip() != "":
+        ret = ret + f"parent {parent_hash}\n"
+
+    ident = _identity()
+    author_date = int(os.environ.get("VC_AUTHOR_DATE", "") or timestamp)
+    ret = ret + f"author {ident} {author_date} {_timezone()}\n"
+    ret = ret + f"committer {ident} {timestamp} {_timezone()}\n"
+    ret = ret + "\n"
+    ret = ret + f"{message}\n"
 
-    Example:
-    _subdirs("src/com/inc") => ["src/com", "src"]
-    """
-    els = d.split("/")
-    ret = [""]
-    while len(els) > 0:
-        ret.append("/".join(els))
-        els = els[:-1]
     return ret
 
 
-def _parent_dir(d: str) -> Optional[str]:
-    """Return the parent dir of the given dir."""
-    if d.strip() == "":
-        return ""
-    return "".join(d.split("/")[:-1])
+def _identity() -> str:
+    """Return the 'Name <email>' of the user, from the environment."""
+    import getpass
+    import socket
+
+    user = os.environ.get("VC_AUTHOR_NAME") or getpass.getuser()
+    email = os.environ.get("VC_AUTHOR_EMAIL") or f"{user}@{socket.gethostname()}"
+    return f"{user} <{email}>"
 
 
-def _entry_to_str(e: IndexEntry) -> str:
-    return f"{e[0]} {e[1]} {e[2]}"
+def _timezone() -> str:
+    """Return the local UTC offset, as '+HHMM'."""
+    offset = time.localtime().tm_gmtoff // 60
+    sign = "-" if offset < 0 else "+"
+    return f"{sign}{abs(offset) // 60:02}{abs(offset) % 60:02}"
 
 
 def _str_to_entry(s: str) -> IndexEntry:
     return IndexEntry(s[0:40], s[41], s[43:])
 
 
-def _write_index_to_file(idx: Dict[str, IndexEntry], fil: str):
-    with open(fil, "w") as f:
-        for it in idx.values():
-            f.write(_entry_to_str(it) + "\n")
+def _write_index(idx: Dict[str, IndexEntry], lock: LockFile) -> None:
+    """Write the index through its lock, replacing the index file."""
+    out = bytearray(_INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(idx)))
+    for it in idx.values():
+        name = it.name.encode("UTF-8")
+        st = it.stat or _NO_STAT
+        out += _INDEX_ENTRY.pack(
+            st.mtime_ns,
+            st.ctime_ns,
+            st.size,
+            st.ino,
+            st.mode,
+            bytes.fromhex(it.key),
+            it.type.encode("UTF-8"),
+            FLAG_STAT if it.stat else 0,
+            len(name),
+        )
+        out += name
+    out += hashlib.sha1(out).digest()
+    lock.write(out)
+    lock.commit()
 
 
 def _read_index_from_file(filename: str) -> Dict[str, IndexEntry]:
+    """Read the index, in the binary format or in the old text one.
+
+    The stat data of entries modified in the same instant the index was
+    written is dropped: the file could have been modified again afterwards
+    without its metadata changing, so those entries must be hashed (the
+    'racy timestamp' problem).
+
+    The entries are kept while the file doesn't change (it's always replaced
+    when written, so its inode changes), and a copy returned, which callers
+    can modify.
+    """
     try:
-        with open(filename, "r") as f:
-            content: str = f.read()
-            lines = content.splitlines()
-            ret = {}
-            for s in lines:
-                en = _str_to_entry(s)
-                ret[en[2]] = en
-            return ret
-    except Exception:
+        with open(filename, "rb") as f:
+            st = os.fstat(f.fileno())
+            sig = (st.st_size, st.st_mtime_ns, st.st_ctime_ns, st.st_ino)
+            with _lock:
+                cached = _parsed.get(filename)
+            if cached is not None and cached[0] == sig:
+                return dict(cached[1])
+            content = f.read()
+    except FileNotFoundError:
         return {}
+    ret = _parse_index(filename, content, st.st_mtime_ns)
+    with _lock:
+        _parsed[filename] = (sig, ret)
+    return dict(ret)
+
+
+def _parse_index(filename: str, content: bytes, mtime_ns: int) -> Dict[str, IndexEntry]:
+    """Parse the contents of the index file filename, modified at mtime_ns."""
+    if not content.startswith(INDEX_MAGIC):
+        return _read_text_index(content.decode("UTF-8"))
+    if hashlib.sha1(content[:-20]).digest() != content[-20:]:
+        raise Exception(f"Index file corrupt: '{filename}'")
+    _, version, count = _INDEX_HEADER.unpack_from(content, 0)
+    if version != INDEX_VERSION:
+        raise Exception(f"Unknown index version {version}: '{filename}'")
+    ret = {}
+    pos = _INDEX_HEADER.size
+    for _ in range(count):
+        mtime, ctime, size, ino, mode, key, typ, flags, nlen = _INDEX_ENTRY.unpack_from(
+            content, pos
+        )
+        pos += _INDEX_ENTRY.size
+        name = content[pos : pos + nlen].decode("UTF-8")
+        pos += nlen
+        stat = None
+        if flags & FLAG_STAT and mtime < mtime_ns:
+            stat = StatData(mtime, ctime, size, ino, mode)
+        ret[name] = IndexEntry(key.hex(), typ.decode("UTF-8"), name, stat)
+    return ret
+
+
+def _read_text_index(content: str) -> Dict[str, IndexEntry]:
+    ret = {}
+    for s in content.splitlines():
+        en = _str_to_entry(s)
+        ret[en.name] = en
+    return ret
 
 
 def _read_index_from_dirdict(dd: DirDict) -> Dict[str, IndexEntry]:
@@ -214,43 +332,14 @@ def _read_index_from_dirdict(dd: DirDict) -> Dict[str, IndexEntry]:
 
 
 def _direntry_to_indexentry(f: DirEntry):
-    return IndexEntry(f.ehash, "f", f.ename)
+    return IndexEntry(f.ehash, "f", f.ename, f.estat)
 
 
 def _build_tree(idx: Dict[str, IndexEntry]):
     ret: Dict[str, list] = {}
     for e in idx.values():
-        _, _, n = e
-        d = os.path.dirname(n)
+        d = os.path.dirname(e.name)
         if not ret.get(d):
             ret[d] = []
         ret[d].append(e)
     return ret
-
-
-def _head_advance(root: str, commit_id: str) -> None:
-    """Writes the commit id to the head, following refs."""
-    branch, _ = _branch_current(root)
-    if branch is None:
-        head_write(root, commit_id)
-    else:
-        write_file(root, "refs/heads/" + branch, commit_id)
-
-
-def _branch_current(
-    root: str,
-) -> Tuple[Optional[str], str]:  # FIXME: BUG: Remove!!!!! Duplicated from repo.py
-    """Return the name and commit id of the current branch.
-
-    name can be None if head is detached.
-    """
-    headc = head_read(root)
-    if headc[:5] == "refs/":
-        rh = "refs/heads/"
-        branch = rh + headc[len(rh) :]
-        branch = headc[len(rh) :]
-
-        headc = read_file(root, rh + branch)
-        return (branch, headc)
-    else:
-        return (None, headc)
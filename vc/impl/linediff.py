@@ -0,0 +1,292 @@
+"""Line diff of two texts, in unified format.
+
+Lines are first mapped to integers (equal lines, equal numbers), so the
+algorithms compare ints instead of strings, and the common prefix and
+suffix are trimmed before running them. Two algorithms are available:
+
+- myers: Myers' O(ND) algorithm, in its linear space variant (splitting
+  each region at the middle snake), which gives a minimal diff.
+- histogram: regions are split around the matches of their least frequent
+  lines (as in git's histogram diff, or patience diff for unique lines),
+  falling back to myers where no line is rare enough. Diffs are often
+  easier to read, matching unique lines rather than blank lines or braces.
+"""
+
+from bisect import bisect_left
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+ALGORITHMS = ("myers", "histogram")
+BINARY_SNIFF = 8000  # Bytes checked for a NUL to tell binary contents, as git does
+MAX_CHAIN = 64  # Lines repeated more times are not used to split in histogram
+
+Block = Tuple[int, int, int]  # Start in a, start in b, length of a match
+OpCode = Tuple[str, int, int, int, int]  # As difflib: tag, a start, a end, b start, b end
+
+
+def unified_diff(
+    old: str,
+    new: str,
+    fromfile: str = "",
+    tofile: str = "",
+    context: int = 3,
+    algorithm: str = "myers",
+) -> Iterator[str]:
+    """Yield the lines of the unified diff from old to new (nothing if equal)."""
+    a = old.splitlines(True)
+    b = new.splitlines(True)
+    started = False
+    for group in _grouped(diff_lines(a, b, algorithm), context):
+        if not started:
+            started = True
+            yield f"--- {fromfile}\n"
+            yield f"+++ {tofile}\n"
+        first, last = group[0], group[-1]
+        yield f"@@ -{_range(first[1], last[2])} +{_range(first[3], last[4])} @@\n"
+        for tag, i1, i2, j1, j2 in group:
+            if tag == "equal":
+                yield from _lines(" ", a, i1, i2)
+                continue
+            yield from _lines("-", a, i1, i2)
+            yield from _lines("+", b, j1, j2)
+
+
+def is_binary(data: bytes) -> bool:
+    """Return True if data looks binary: a NUL in its first BINARY_SNIFF bytes."""
+    return b"\0" in data[:BINARY_SNIFF]
+
+
+def diff_lines(a: Sequence[str], b: Sequence[str], algorithm: str = "myers") -> List[OpCode]:
+    """Return the opcodes (as difflib's get_opcodes) to turn the lines a into b."""
+    if algorithm not in ALGORITHMS:
+        raise ValueError(f"Unknown diff algorithm: {algorithm}")
+    ids: Dict[str, int] = {}
+    x = [ids.setdefault(line, len(ids)) for line in a]
+    y = [ids.setdefault(line, len(ids)) for line in b]
+    blocks: List[Block] = []
+    if algorithm == "myers":
+        _myers(x, y, 0, len(x), 0, len(y), blocks)
+    else:
+        _histogram(x, y, blocks)
+    return _opcodes(blocks, len(x), len(y))
+
+
+def _myers(
+    a: List[int], b: List[int], alo: int, ahi: int, blo: int, bhi: int, out: List[Block]
+) -> None:
+    """Add to out the matches between a[alo:ahi] and b[blo:bhi] of a minimal diff."""
+    regions = [(alo, ahi, blo, bhi)]
+    while regions:
+        alo, ahi, blo, bhi = regions.pop()
+        n = 0
+        while alo + n < ahi and blo + n < bhi and a[alo + n] == b[blo + n]:
+            n += 1
+        if n:
+            out.append((alo, blo, n))
+            alo, blo = alo + n, blo + n
+        n = 0
+        while ahi - n > alo and bhi - n > blo and a[ahi - n - 1] == b[bhi - n - 1]:
+            n += 1
+        if n:
+            ahi, bhi = ahi - n, bhi - n
+            out.append((ahi, bhi, n))
+        if alo == ahi or blo == bhi:
+            continue
+        x, y, u, v = _middle_snake(a, b, alo, ahi, blo, bhi)
+        if u > x:
+            out.append((x, y, u - x))
+        regions.append((alo, x, blo, y))
+        regions.append((u, ahi, v, bhi))
+
+
+def _middle_snake(
+    a: List[int], b: List[int], alo: int, ahi: int, blo: int, bhi: int
+) -> Tuple[int, int, int, int]:
+    """Return the start and end (x, y, u, v) of the middle snake of a minimal path.
+
+    The ends of the region must differ (trimmed), so the snake splits it in
+    two smaller ones. V arrays hold the furthest x reached, by diagonal,
+    forwards and backwards (counting from the end of the region).
+    """
+    n = ahi - alo
+    m = bhi - blo
+    delta = n - m
+    odd = delta & 1
+    dmax = (n + m + 1) // 2
+    off = dmax + 1
+    vf = [0] * (2 * dmax + 3)
+    vb = [0] * (2 * dmax + 3)
+    for d in range(dmax + 1):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and vf[off + k - 1] < vf[off + k + 1]):
+                x = vf[off + k + 1]
+            else:
+                x = vf[off + k - 1] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            vf[off + k] = x
+            if odd and 1 - d <= delta - k <= d - 1 and x + vb[off + delta - k] >= n:
+                return alo + x0, blo + y0, alo + x, blo + y
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and vb[off + k - 1] < vb[off + k + 1]):
+                x = vb[off + k + 1]
+            else:
+                x = vb[off + k - 1] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < n and y < m and a[ahi - x - 1] == b[bhi - y - 1]:
+                x += 1
+                y += 1
+            vb[off + k] = x
+            if not odd and -d <= delta - k <= d and x + vf[off + delta - k] >= n:
+                return ahi - x, bhi - y, ahi - x0, bhi - y0
+    raise AssertionError("No middle snake")  # Unreachable: the paths always meet
+
+
+def _histogram(a: List[int], b: List[int], out: List[Block]) -> None:
+    """Add to out the matches between a and b of a histogram diff."""
+    regions = [(0, len(a), 0, len(b))]
+    while regions:
+        alo, ahi, blo, bhi = regions.pop()
+        n = 0
+        while alo + n < ahi and blo + n < bhi and a[alo + n] == b[blo + n]:
+            n += 1
+        if n:
+            out.append((alo, blo, n))
+            alo, blo = alo + n, blo + n
+        n = 0
+        while ahi - n > alo and bhi - n > blo and a[ahi - n - 1] == b[bhi - n - 1]:
+            n += 1
+        if n:
+            ahi, bhi = ahi - n, bhi - n
+            out.append((ahi, bhi, n))
+        if alo == ahi or blo == bhi:
+            continue
+        matches = _rarest_matches(a, b, alo, ahi, blo, bhi)
+        if not matches:
+            _myers(a, b, alo, ahi, blo, bhi, out)
+            continue
+        out.extend(matches)
+        i, j = alo, blo
+        for x, y, size in matches:
+            regions.append((i, x, j, y))
+            i, j = x + size, y + size
+        regions.append((i, ahi, j, bhi))
+
+
+def _rarest_matches(
+    a: List[int], b: List[int], alo: int, ahi: int, blo: int, bhi: int
+) -> List[Block]:
+    """Return matches around the lines least repeated in a[alo:ahi], in order.
+
+    The lines of b with the lowest count in a (at most MAX_CHAIN) are paired
+    with their occurrences in a, and the longest chain of pairs in order in
+    both is taken (so one region is split at all of them at once, instead of
+    one by one). Each pair is then extended to the equal lines around it.
+    """
+    where: Dict[int, List[int]] = {}
+    for i in range(alo, ahi):
+        where.setdefault(a[i], []).append(i)
+    lowest = min(
+        (len(where[line]) for line in b[blo:bhi] if line in where), default=MAX_CHAIN + 1
+    )
+    if lowest > MAX_CHAIN:
+        return []
+    # Longest increasing subsequence of the positions in a, following b
+    tails: List[int] = []  # Smallest position in a ending a chain, by length
+    ends: List[int] = []  # Index in pairs of the chains in tails
+    pairs: List[Tuple[int, int, int]] = []  # Position in a and b, previous pair
+    for j in range(blo, bhi):
+        at = where.get(b[j])
+        if at is None or len(at) != lowest:
+            continue
+        for i in reversed(at):  # Decreasing, so at most one is taken for j
+            k = bisect_left(tails, i)
+            pairs.append((i, j, ends[k - 1] if k else -1))
+            if k == len(tails):
+                tails.append(i)
+                ends.append(len(pairs) - 1)
+            else:
+                tails[k] = i
+                ends[k] = len(pairs) - 1
+    chain = []
+    p = ends[-1]
+    while p >= 0:
+        chain.append(pairs[p])
+        p = pairs[p][2]
+    matches: List[Block] = []
+    li, lj = alo, blo
+    for i, j, _ in reversed(chain):
+        if i < li or j < lj:
+            continue  # Already in the previous match
+        s, t = i, j
+        while s > li and t > lj and a[s - 1] == b[t - 1]:
+            s -= 1
+            t -= 1
+        li, lj = i + 1, j + 1
+        while li < ahi and lj < bhi and a[li] == b[lj]:
+            li += 1
+            lj += 1
+        matches.append((s, t, li - s))
+    return matches
+
+
+def _opcodes(blocks: List[Block], n: int, m: int) -> List[OpCode]:
+    ret: List[OpCode] = []
+    i = j = 0
+    for x, y, size in sorted(blocks) + [(n, m, 0)]:
+        if i < x and j < y:
+            ret.append(("replace", i, x, j, y))
+        elif i < x:
+            ret.append(("delete", i, x, j, y))
+        elif j < y:
+            ret.append(("insert", i, x, j, y))
+        if size:
+            if ret and ret[-1][0] == "equal":
+                ret[-1] = ("equal", ret[-1][1], x + size, ret[-1][3], y + size)
+            else:
+                ret.append(("equal", x, x + size, y, y + size))
+        i, j = x + size, y + size
+    return ret
+
+
+def _grouped(codes: List[OpCode], context: int) -> Iterator[List[OpCode]]:
+    """Yield the hunks: changes with up to context equal lines around them."""
+    if len(codes) == 1 and codes[0][0] == "equal" or not codes:
+        return
+    codes = list(codes)
+    if codes[0][0] == "equal":
+        _, i1, i2, j1, j2 = codes[0]
+        codes[0] = ("equal", max(i1, i2 - context), i2, max(j1, j2 - context), j2)
+    if codes[-1][0] == "equal":
+        _, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = ("equal", i1, min(i2, i1 + context), j1, min(j2, j1 + context))
+    group: List[OpCode] = []
+    for tag, i1, i2, j1, j2 in codes:
+        if tag == "equal" and i2 - i1 > 2 * context:
+            # Too many equal lines: end the hunk and start another one
+            group.append((tag, i1, i1 + context, j1, j1 + context))
+            yield group
+            group = []
+            i1, j1 = max(i1, i2 - context), max(j1, j2 - context)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == "equal"):
+        yield group
+
+
+def _range(start: int, stop: int) -> str:
+    """Return the range of lines start to stop in a hunk header, as diff does."""
+    length = stop - start
+    if length == 1:
+        return f"{start + 1}"
+    return f"{start + 1 if length else start},{length}"
+
+
+def _lines(prefix: str, lines: Sequence[str], start: int, stop: int) -> Iterator[str]:
+    for line in lines[start:stop]:
+        if line.endswith("\n"):
+            yield prefix + line
+        else:
+            yield prefix + line + "\n\\ No newline at end of file\n"
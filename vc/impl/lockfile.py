@@ -0,0 +1,110 @@
+"""Lock files, for updating the files of a repo with concurrent writers.
+
+A file (the index, a ref, HEAD...) is locked by creating '<file>.lock'
+exclusively. The new contents are written to the lock file, which is then
+renamed over the file: readers see either the old contents or the new ones,
+never a partial write, and writers holding the lock are serialised.
+
+Writers finding the file locked wait and try again, backing off
+exponentially (with jitter, so they don't wake up together), up to a
+timeout. A lock left behind by a killed process must be removed by hand,
+as with git.
+"""
+
+import os
+import random
+import time
+from types import TracebackType
+from typing import Optional, Type
+
+LOCK_SUFFIX = ".lock"
+LOCK_TIMEOUT = 10.0  # Seconds waiting for a lock before giving up
+_FIRST_DELAY = 0.001
+_MAX_DELAY = 0.1
+
+
+class LockError(Exception):
+    """The lock could not be taken before the timeout."""
+
+
+class LockFile:
+    """Exclusive lock on a file, holding its new contents until committed.
+
+    Use it as a context manager: the lock is released when leaving, and
+    the file only replaced if 'commit' was called.
+    """
+
+    path: str
+    lock_path: str
+
+    def __init__(self, path: str, timeout: float = LOCK_TIMEOUT):
+        """Prepare the lock for the file at path (not taken yet)."""
+        self.path = path
+        self.lock_path = path + LOCK_SUFFIX
+        self.timeout = timeout
+        self._fd: Optional[int] = None
+
+    def __enter__(self) -> "LockFile":
+        self.acquire()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        tb: Optional[TracebackType],
+    ) -> None:
+        self.rollback()
+
+    def acquire(self) -> None:
+        """Take the lock, waiting for it if needed. Raise LockError on timeout."""
+        deadline = time.monotonic() + self.timeout
+        delay = _FIRST_DELAY
+        while True:
+            try:
+                self._fd = os.open(
+                    self.lock_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666
+                )
+                return
+            except FileNotFoundError:  # The dir of a new file
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                continue
+            except FileExistsError:
+                pass
+            if time.monotonic() >= deadline:
+                raise LockError(
+                    f"fatal: Unable to create '{self.lock_path}': File exists.\n"
+                    + "Another vc process seems to be running in this repository;"
+                    + " if not, remove the file."
+                )
+            time.sleep(delay * (0.5 + random.random()))
+            delay = min(delay * 2, _MAX_DELAY)
+
+    def write(self, data: bytes) -> None:
+        """Write data to the new contents of the file."""
+        assert self._fd is not None, "Lock not taken"
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self._fd, view) :]
+
+    def commit(self) -> None:
+        """Replace the file with the contents written, releasing the lock."""
+        assert self._fd is not None, "Lock not taken"
+        os.close(self._fd)
+        self._fd = None
+        os.replace(self.lock_path, self.path)
+
+    def rollback(self) -> None:
+        """Release the lock (if still held), leaving the file as it was."""
+        if self._fd is None:
+            return
+        os.close(self._fd)
+        self._fd = None
+        os.remove(self.lock_path)
+
+
+def write_locked(path: str, data: bytes, timeout: float = LOCK_TIMEOUT) -> None:
+    """Replace the contents of the file at path with data, under its lock."""
+    with LockFile(path, timeout) as lock:
+        lock.write(data)
+        lock.commit()
@@ -0,0 +1,273 @@
+"""Pack files: many DB objects stored in a single file, with a sorted index.
+
+A pack is made of two files living in '.vc/objects/pack':
+
+- 'pack-<id>.pack': header (magic, version, object count) followed by the
+  entries. Each entry is a type byte, the length of its data and the data
+  itself. For full entries the data is the same zlib stream a loose object
+  would have on disk. Delta entries hold the offset of their base entry in
+  the same pack, followed by the zlib compressed delta (see delta.py).
+- 'pack-<id>.idx': header (magic, version, object count), a fanout table
+  with 256 cumulative counts indexed by the first byte of the key, the sorted
+  binary keys and, in the same order, the offset of each entry in the pack.
+
+Readers mmap both files and binary search the index, so reading an object
+is a seek into the pack instead of an open() per object.
+
+When writing, objects are sorted by path hint and size, and each one is
+tried as a delta against the previous ones in a sliding window, keeping the
+smallest result. Delta chains are bounded in depth and the objects
+reconstructed while resolving them are kept in a small cache.
+"""
+
+import os
+import os.path
+import mmap
+import threading
+import glob
+import struct
+import hashlib
+import zlib
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Tuple, Iterable
+from .delta import create_delta, apply_delta, line_index
+
+PACK_DIR = "objects/pack"
+PACK_MAGIC = b"VPCK"
+IDX_MAGIC = b"VIDX"
+PACK_VERSION = 2
+READABLE_VERSIONS = (1, 2)
+
+ENTRY_FULL = 1
+ENTRY_DELTA = 2
+
+DELTA_WINDOW = 10  # Number of previous objects tried as delta bases
+DELTA_DEPTH = 50  # Maximum length of a delta chain
+DELTA_MIN_SIZE = 64  # Smaller objects are always stored in full
+BASE_CACHE_BYTES = 16 * 1024 * 1024
+
+_HEADER = struct.Struct(">4sII")  # magic, version, count
+_ENTRY = struct.Struct(">BI")  # entry type, data length
+_FANOUT = struct.Struct(">256I")
+_OFFSET = struct.Struct(">Q")
+_KEY_LEN = 20
+
+
+class Pack:
+    """Read access to a pack file through its index."""
+
+    path: str
+    count: int
+
+    def __init__(self, idx_path: str):
+        """Map the index and the pack associated to it."""
+        self.path = idx_path[: -len(".idx")]
+        self._idx = _map(idx_path)
+        magic, version, self.count = _HEADER.unpack_from(self._idx, 0)
+        if magic != IDX_MAGIC or version not in READABLE_VERSIONS:
+            raise ValueError(f"Incorrect pack index: '{idx_path}'")
+        self._fanout = _FANOUT.unpack_from(self._idx, _HEADER.size)
+        self._keys_start = _HEADER.size + _FANOUT.size
+        self._offsets_start = self._keys_start + self.count * _KEY_LEN
+        self._pack = _map(self.path + ".pack")
+        self._bases: OrderedDict[int, bytes] = OrderedDict()
+        self._bases_size = 0
+        self._lock = threading.Lock()  # For the base cache, as readers can be threads
+
+    def close(self) -> None:
+        """Release the mapped files."""
+        self._idx.close()
+        self._pack.close()
+
+    def find(self, key: str) -> Optional[int]:
+        """Return the position in the index of the (full) key, or None."""
+        try:
+            bkey = bytes.fromhex(key)
+        except ValueError:
+            return None
+        if len(bkey) != _KEY_LEN:
+            return None
+        pos = self._lower_bound(bkey)
+        if pos < self.count and self._key_at(pos) == bkey:
+            return pos
+        return None
+
+    def keys_with_prefix(self, prefix: str) -> List[str]:
+        """Return the (hex) keys in this pack starting with prefix."""
+        padded = prefix if len(prefix) % 2 == 0 else prefix + "0"
+        try:
+            bprefix = bytes.fromhex(padded)
+        except ValueError:
+            return []
+        ret = []
+        pos = self._lower_bound(bprefix)
+        while pos < self.count:
+            k = self._key_at(pos).hex()
+            if not k.startswith(prefix):
+                break
+            ret.append(k)
+            pos += 1
+        return ret
+
+    def keys(self) -> List[str]:
+        """Return all the (hex) keys in this pack, sorted."""
+        return [self._key_at(i).hex() for i in range(self.count)]
+
+    def read(self, key: str) -> Optional[bytes]:
+        """Return the decompressed contents (header included) of key, or None."""
+        pos = self.find(key)
+        if pos is None:
+            return None
+        return self.read_at(pos)
+
+    def read_at(self, pos: int) -> bytes:
+        """Return the decompressed contents of the entry at index position pos."""
+        return self._read_offset(self._offset_at(pos))
+
+    def _read_offset(self, offset: int) -> bytes:
+        """Return the contents of the entry at offset, resolving delta chains."""
+        chain: List[Tuple[int, bytes]] = []  # (offset, delta), from target to base
+        while True:
+            with self._lock:
+                cached = self._bases.get(offset)
+                if cached is not None:
+                    self._bases.move_to_end(offset)
+            if cached is not None:
+                ret = cached
+                break
+            typ, data = self._entry(offset)
+            if typ == ENTRY_FULL:
+                ret = zlib.decompress(data)
+                break
+            if typ != ENTRY_DELTA:
+                raise ValueError(f"Unknown pack entry type: {typ}")
+            chain.append((offset, data[_OFFSET.size :]))
+            offset = _OFFSET.unpack_from(data, 0)[0]
+        while chain:
+            self._cache_base(offset, ret)  # Every object rebuilt here is a base
+            offset, delta = chain.pop()
+            ret = apply_delta(ret, zlib.decompress(delta))
+        return ret
+
+    def _cache_base(self, offset: int, contents: bytes) -> None:
+        with self._lock:
+            if offset < 0 or offset in self._bases or len(contents) > BASE_CACHE_BYTES:
+                return
+            self._bases[offset] = contents
+            self._bases_size += len(contents)
+            while self._bases_size > BASE_CACHE_BYTES:
+                _, old = self._bases.popitem(last=False)
+                self._bases_size -= len(old)
+
+    def _entry(self, offset: int) -> Tuple[int, bytes]:
+        typ, length = _ENTRY.unpack_from(self._pack, offset)
+        start = offset + _ENTRY.size
+        return typ, self._pack[start : start + length]
+
+    def _key_at(self, pos: int) -> bytes:
+        start = self._keys_start + pos * _KEY_LEN
+        return self._idx[start : start + _KEY_LEN]
+
+    def _offset_at(self, pos: int) -> int:
+        return _OFFSET.unpack_from(self._idx, self._offsets_start + pos * _OFFSET.size)[0]
+
+    def _lower_bound(self, bkey: bytes) -> int:
+        """Return the first position whose key is >= bkey."""
+        first = bkey[0]
+        lo = self._fanout[first - 1] if first > 0 else 0
+        hi = self._fanout[first]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key_at(mid) < bkey:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+
+def list_packs(root: str) -> List[Pack]:
+    """Return the packs present in the repo at root (the '.vc' dir)."""
+    ret = []
+    for idx in sorted(glob.glob(root + "/" + PACK_DIR + "/pack-*.idx")):
+        if os.path.exists(idx[: -len(".idx")] + ".pack"):
+            ret.append(Pack(idx))
+    return ret
+
+
+def write_pack(
+    root: str,
+    objects: Iterable[Tuple[str, bytes]],
+    hints: Optional[Dict[str, str]] = None,
+    window: int = DELTA_WINDOW,
+    depth: int = DELTA_DEPTH,
+) -> Optional[str]:
+    """Write a new pack with the given (key, decompressed contents) pairs.
+
+    hints maps keys to the path they were seen at, to group the revisions
+    of a file together when looking for delta bases. A window of 0 disables
+    deltas. Return the path of the pack (without extension), or None if there
+    was nothing to pack. The index is written last, so readers never see a
+    pack without its contents.
+    """
+    hints = hints or {}
+    entries = sorted(objects, key=lambda e: (hints.get(e[0], ""), -len(e[1]), e[0]))
+    if not entries:
+        return None
+    pack_dir = root + "/" + PACK_DIR
+    os.makedirs(pack_dir, exist_ok=True)
+    keys = sorted(k for k, _ in entries)
+    name = hashlib.sha1("".join(keys).encode("UTF-8")).hexdigest()
+    base = pack_dir + "/pack-" + name
+
+    offsets: Dict[str, int] = {}
+    # (offset, contents, line index, chain depth) of the last objects written
+    candidates: Deque[Tuple[int, bytes, Dict[bytes, int], int]] = deque(
+        maxlen=max(window, 1)
+    )
+    with open(base + ".pack.tmp", "wb") as f:
+        f.write(_HEADER.pack(PACK_MAGIC, PACK_VERSION, len(entries)))
+        offset = _HEADER.size
+        for key, raw in entries:
+            typ, data, chain = ENTRY_FULL, zlib.compress(raw), 0
+            if window > 0 and len(raw) >= DELTA_MIN_SIZE:
+                for base_offset, base_raw, base_index, base_chain in candidates:
+                    if base_chain >= depth or not _similar_size(base_raw, raw):
+                        continue
+                    delta = zlib.compress(create_delta(base_raw, raw, base_index))
+                    if len(delta) + _OFFSET.size < len(data):
+                        typ, chain = ENTRY_DELTA, base_chain + 1
+                        data = _OFFSET.pack(base_offset) + delta
+            offsets[key] = offset
+            f.write(_ENTRY.pack(typ, len(data)))
+            f.write(data)
+            if window > 0:
+                candidates.append((offset, raw, line_index(raw), chain))
+            offset += _ENTRY.size + len(data)
+
+    fanout = [0] * 256
+    for k in keys:
+        fanout[int(k[0:2], 16)] += 1
+    for i in range(1, 256):
+        fanout[i] += fanout[i - 1]
+    with open(base + ".idx.tmp", "wb") as f:
+        f.write(_HEADER.pack(IDX_MAGIC, PACK_VERSION, len(keys)))
+        f.write(_FANOUT.pack(*fanout))
+        for k in keys:
+            f.write(bytes.fromhex(k))
+        for k in keys:
+            f.write(_OFFSET.pack(offsets[k]))
+
+    os.replace(base + ".pack.tmp", base + ".pack")
+    os.replace(base + ".idx.tmp", base + ".idx")
+    return base
+
+
+def _similar_size(a: bytes, b: bytes) -> bool:
+    """Return True if the sizes of a and b are within a factor of 2."""
+    small, big = sorted((len(a), len(b)))
+    return small * 2 >= big
+
+
+def _map(path: str) -> mmap.mmap:
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
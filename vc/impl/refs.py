@@ -0,0 +1,211 @@
+"""References (branches and HEAD), loose and packed.
+
+A branch is either a loose ref, a file under '.vc/refs/heads' with the key
+of its commit, or a line in '.vc/packed-refs'. Loose refs override packed
+ones: branches are written loose, and 'pack_refs' moves them all to the
+packed file. This keeps repos with many branches to a couple of files.
+
+'.vc/packed-refs' has a header line and then one line per ref, 'key name',
+sorted by name, so a ref is found by binary search on the file contents.
+The contents are read once per process and kept while the file doesn't
+change (same size, mtime and inode), so looking refs up only costs a stat.
+
+Refs are written under their lock (see lockfile.py). update_ref also
+checks that the ref still has the value the writer read, so concurrent
+commits don't lose each other's updates.
+"""
+
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+from .fs import head_read, read_file, write_file
+from .lockfile import LOCK_SUFFIX, LockFile
+
+PACKED_REFS = "packed-refs"
+PACKED_HEADER = b"# pack-refs with: sorted\n"
+HEADS = "refs/heads/"
+
+
+class RefConflictError(Exception):
+    """A ref didn't have the expected value when updating it."""
+
+
+_packed: Dict[str, Tuple[Tuple[int, int, int], bytes]] = {}  # By root: stat, contents
+_lock = threading.Lock()
+
+
+def branch_current(root: str) -> Tuple[Optional[str], str]:
+    """Return the name and commit id of the current branch.
+
+    name is None if head is detached. The commit id is '' if the branch
+    has no commits yet.
+    """
+    headc = head_read(root)
+    if headc.startswith(HEADS):
+        branch = headc[len(HEADS) :]
+        return (branch, branch_head(root, branch))
+    return (None, headc)
+
+
+def head_advance(root: str, commit_id: str, old: Optional[str] = None) -> None:
+    """Write the commit id to the head, following refs.
+
+    With old, the head is only updated if it still points to old (see
+    update_ref), raising RefConflictError otherwise.
+    """
+    branch, _ = branch_current(root)
+    update_ref(root, HEADS + branch if branch else "HEAD", commit_id, old)
+
+
+def branch_head(root: str, branch: str) -> str:
+    """Return the commit id of the branch ('' if it doesn't exist)."""
+    return read_ref(root, HEADS + branch)
+
+
+def read_ref(root: str, name: str) -> str:
+    """Return the value of the ref name, loose or packed ('' if it doesn't exist)."""
+    return read_file(root, name) or _packed_lookup(_packed_refs(root), name)
+
+
+def write_ref(root: str, name: str, value: str) -> None:
+    """Write the ref name (loose), overriding its packed value, if any."""
+    write_file(root, name, value)
+
+
+def update_ref(root: str, name: str, value: str, old: Optional[str] = None) -> None:
+    """Write the ref name (loose), checking first that its value is still old.
+
+    The ref is locked while checking and writing it, so of two writers
+    with the same old value, only one succeeds: the other one gets a
+    RefConflictError, and can read the ref again and retry. old is not
+    checked if None ('' is a ref which doesn't exist).
+    """
+    with LockFile(root + "/" + name) as lock:
+        current = read_file(root, name) if name == "HEAD" else read_ref(root, name)
+        if old is not None and current != old:
+            raise RefConflictError(f"fatal: {name} changed from {old[:7]} to {current[:7]}")
+        lock.write((value + "\n").encode())
+        lock.commit()
+
+
+def delete_ref(root: str, name: str) -> None:
+    """Delete the ref name, from the loose refs and the packed ones."""
+    with LockFile(root + "/" + name):
+        try:
+            os.remove(root + "/" + name)
+        except FileNotFoundError:
+            pass
+        with LockFile(root + "/" + PACKED_REFS) as packed:
+            refs = _parse(_packed_refs(root))
+            if name in refs:
+                del refs[name]
+                _write_packed(packed, refs)
+
+
+def list_refs(root: str, prefix: str = HEADS) -> List[str]:
+    """Return the names of the refs starting with prefix (without it), sorted.
+
+    Only the loose refs dir is listed, without reading the refs, and the
+    packed refs read (if they changed since they were last read).
+    """
+    names = {n[len(prefix) :] for n in _parse(_packed_refs(root)) if n.startswith(prefix)}
+    names.update(_loose_ref_names(root, prefix))
+    return sorted(names)
+
+
+def pack_refs(root: str) -> int:
+    """Move the loose branches to the packed refs, returning how many refs are packed.
+
+    Loose refs are only removed if they didn't change while packing.
+    """
+    with LockFile(root + "/" + PACKED_REFS) as packed:
+        refs = _parse(_packed_refs(root))
+        loose = {n: read_file(root, HEADS + n) for n in _loose_ref_names(root, HEADS)}
+        for name, value in loose.items():
+            refs[HEADS + name] = value
+        _write_packed(packed, refs)
+    for name, value in loose.items():
+        with LockFile(root + "/" + HEADS + name):
+            if read_file(root, HEADS + name) == value:
+                os.remove(root + "/" + HEADS + name)
+        d = os.path.dirname(name)
+        while d:  # Remove the dirs of branches like 'a/b', if empty
+            try:
+                os.rmdir(root + "/" + HEADS + d)
+            except OSError:
+                break
+            d = os.path.dirname(d)
+    return len(refs)
+
+
+def _loose_ref_names(root: str, prefix: str) -> List[str]:
+    """Return the names of the loose refs under prefix (without it)."""
+    ret: List[str] = []
+    pending = [""]
+    while pending:
+        d = pending.pop()
+        try:
+            entries = list(os.scandir(root + "/" + prefix + d))
+        except FileNotFoundError:
+            continue
+        for e in entries:
+            if e.is_dir():
+                pending.append(d + e.name + "/")
+            elif not e.name.endswith(LOCK_SUFFIX):
+                ret.append(d + e.name)
+    return ret
+
+
+def _packed_refs(root: str) -> bytes:
+    """Return the contents of the packed refs file, read again only if it changed."""
+    try:
+        st = os.stat(root + "/" + PACKED_REFS)
+    except FileNotFoundError:
+        return b""
+    sig = (st.st_size, st.st_mtime_ns, st.st_ino)
+    with _lock:
+        cached = _packed.get(root)
+    if cached is not None and cached[0] == sig:
+        return cached[1]
+    with open(root + "/" + PACKED_REFS, "rb") as f:
+        data = f.read()
+    with _lock:
+        _packed[root] = (sig, data)
+    return data
+
+
+def _packed_lookup(data: bytes, name: str) -> str:
+    """Return the value of the ref name in the packed refs data (sorted), or ''."""
+    target = name.encode()
+    lo = len(PACKED_HEADER) if data.startswith(PACKED_HEADER) else 0
+    hi = len(data)
+    while lo < hi:  # Find the first line whose name is not less than target
+        mid = (lo + hi) // 2
+        start = data.rfind(b"\n", lo, mid) + 1 or lo
+        end = data.find(b"\n", start)
+        end = len(data) if end < 0 else end
+        key, _, ref = data[start:end].partition(b" ")
+        if ref == target:
+            return key.decode()
+        if ref < target:
+            lo = end + 1
+        else:
+            hi = start
+    return ""
+
+
+def _parse(data: bytes) -> Dict[str, str]:
+    """Return the refs in the packed refs data, by name."""
+    ret: Dict[str, str] = {}
+    for line in data.decode().splitlines():
+        if line and not line.startswith("#"):
+            key, _, name = line.partition(" ")
+            ret[name] = key
+    return ret
+
+
+def _write_packed(lock: LockFile, refs: Dict[str, str]) -> None:
+    """Write the packed refs file, sorted, through its lock."""
+    lock.write(PACKED_HEADER)
+    lock.write("".join(f"{refs[n]} {n}\n" for n in sorted(refs)).encode())
+    lock.commit()
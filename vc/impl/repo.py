@@ -3,11 +3,13 @@
 from __future__ import annotations  # For factory methods in Commit, etc.
 import os
 import os.path
-import difflib
 from itertools import dropwhile
 from dataclasses import dataclass
-from typing import List, Optional, Callable, Tuple
+from typing import Dict, Iterator, List, Optional, Callable, Set, Tuple, TypeVar
 from ..api import (
+    CheckoutResult,
+    DBObject,
+    DBObjectType,
     PRepo,
     LogEntry,
     RepoStatus,
@@ -21,15 +23,35 @@ from ..api import (
     FileName,
 )
 from .fs import (
-    exists_file,
-    head_read,
     head_write,
-    list_files,
-    read_file,
-    remove_file,
-    write_file,
-    rename_file,
+    worktree_path,
+    remove_worktree_file,
 )
+from .cache import CachedDB
+from .checkout import write_files
+from .refs import (
+    HEADS,
+    branch_current,
+    branch_head,
+    delete_ref,
+    list_refs,
+    pack_refs,
+    write_ref,
+)
+from .hasher import changed_entries
+from . import commitgraph
+from .commitgraph import CommitGraph, CommitInfo
+from .history import CommitNode, History
+from . import bloom
+from .bloom import ChangedPathFilters, path_hashes
+from . import fsmonitor
+from .ignore import IgnoreMatcher, read_ignore
+from .untracked import list_dirs
+from .db import object_key
+from .linediff import BINARY_SNIFF, is_binary, unified_diff
+from .treediff import TreeChange, TreeItem, TreeReader, build_trees, diff_trees
+
+T = TypeVar("T")
 
 
 class Repo(PRepo):
@@ -59,7 +81,7 @@ class Repo(PRepo):
         """Initialize the repo."""
         ini_branch = "master"  # FIXME make 'master' configurable
         _branch_create(self.root, ini_branch)
-        head_write(self.root, "refs/heads/" + ini_branch)
+        head_write(self.root, HEADS + ini_branch)
 
     def status(self) -> RepoStatus:
         """Calculate and return the status of the repo."""
@@ -67,20 +89,52 @@ class Repo(PRepo):
 
     def log(self) -> List[LogEntry]:
         """Return the log entries for the current HEAD."""
-        return _log(self._db, self.root)
+        return list(self.iter_log())
+
+    def iter_log(
+        self,
+        revisions: Optional[List[str]] = None,
+        max_count: Optional[int] = None,
+        since: Optional[int] = None,
+        first_parent: bool = False,
+        topo_order: bool = False,
+        paths: Optional[List[str]] = None,
+    ) -> Iterator[LogEntry]:
+        """Yield the log entries for the revisions, as they are found.
+
+        revisions are commits or branches ('HEAD' if none is given), with
+        'A..B' meaning the commits in B but not in A, and '^A' excluding
+        the commits in A. since is a timestamp. With paths, only commits
+        changing them are yielded.
+        """
+        return _iter_log(
+            self._db,
+            self.root,
+            revisions or [],
+            max_count,
+            since,
+            first_parent,
+            topo_order,
+            [_repo_path(self.root, p) for p in paths or []],
+        )
 
     def checkout(
-        self, commit_id_or_branch: str, create_branch: bool = False
-    ) -> Tuple[str, bool]:
-        """Checkout the commit and return its short message.
-
-        Any errors are thrown as an exception, with a message ready to
-        be shown to the end user. if create_branch is true, commit_id_or_branch
-        is assumed to be the name of a branch which will be created if it doesn't
-        exist.
+        self,
+        commit_id_or_branch: str,
+        create_branch: bool = False,
+        workers: Optional[int] = None,
+    ) -> CheckoutResult:
+        """Checkout the commit and return its short message, and what changed.
+
+        Only the files which differ between HEAD and the commit are written
+        or removed, by 'workers' threads, and the changes staged for other
+        files are kept. Any errors are thrown as
+        an exception, with a message ready to be shown to the end user. if
+        create_branch is true, commit_id_or_branch is assumed to be the name
+        of a branch which will be created if it doesn't exist.
         """
         return _checkout(
-            self._index, self._db, self.root, commit_id_or_branch, create_branch
+            self._index, self._db, self.root, commit_id_or_branch, create_branch, workers
         )
 
     def initialized(self) -> bool:
@@ -114,13 +168,80 @@ class Repo(PRepo):
         """List the existing branches.."""
         return _branch_list(self.root)
 
-    def diff(self, files: List[str]) -> List[str]:
+    def diff(
+        self,
+        files: List[str],
+        revisions: Optional[List[str]] = None,
+        cached: bool = False,
+        context: int = 3,
+        algorithm: str = "myers",
+    ) -> List[str]:
         """Calculates the diff for the given list of files.
 
         If the list is empty, provide the diff for all files.
         By default, the diff is between the file in the workdir and the head.
+        With two revisions, the diff is between those commits; with one, from
+        the commit to the workdir. With cached, from the commit (or HEAD)
+        to the index. Diffs are unified, with context lines around changes,
+        computed with the algorithm ("myers" or "histogram"). Binary files
+        are only reported to differ.
+        """
+        return list(self.iter_diff(files, revisions, cached, context, algorithm))
+
+    def iter_diff(
+        self,
+        files: List[str],
+        revisions: Optional[List[str]] = None,
+        cached: bool = False,
+        context: int = 3,
+        algorithm: str = "myers",
+    ) -> Iterator[str]:
+        """Yield the diff of each changed file, as 'diff' but one file at a time."""
+        return _iter_diff(
+            self.root, self.db, self.index, files, revisions or [], cached, context, algorithm
+        )
+
+    def repack(self, all_objects: bool = False) -> int:
+        """Pack the objects of the repo, returning how many were packed.
+
+        Objects are delta compressed against other revisions of the same path.
+        """
+        return self._db.repack(all_objects, _path_hints(self._db, self.root))
+
+    def write_commit_graph(self, changed_paths: bool = False) -> int:
+        """Write the commit-graph file, returning the number of commits in it.
+
+        Changed-path filters are written too with changed_paths, or if there
+        were already some.
         """
-        return _diff(self.root, self.db, self.index, files)
+        return _write_commit_graph(self._db, self.root, changed_paths)
+
+    def pack_refs(self) -> int:
+        """Move the branches into the packed-refs file, returning how many it has."""
+        return pack_refs(self.root)
+
+    def merge_base(self, commit1: str, commit2: str) -> List[str]:
+        """Return the best common ancestors of the two commits (or branches)."""
+        a = _resolve_commit(self.root, self._db, commit1)
+        b = _resolve_commit(self.root, self._db, commit2)
+        return _history(self._db, self.root).merge_bases(a, b)
+
+    def is_ancestor(self, ancestor: str, commit: str) -> bool:
+        """Return True if ancestor is commit or one of its ancestors."""
+        a = _resolve_commit(self.root, self._db, ancestor)
+        b = _resolve_commit(self.root, self._db, commit)
+        return _history(self._db, self.root).is_ancestor(a, b)
+
+    def start_fsmonitor(self) -> bool:
+        """Start the filesystem monitor, returning False if already running.
+
+        While it runs, status and diff only check the files it reports as changed.
+        """
+        return fsmonitor.start(self.root)
+
+    def stop_fsmonitor(self) -> bool:
+        """Stop the filesystem monitor, returning False if it wasn't running."""
+        return fsmonitor.stop(self.root)
 
 
 @dataclass
@@ -145,6 +266,15 @@ class Commit:
                 break
         return ret
 
+    @property
+    def timestamp(self) -> int:
+        """Return the commit time, in seconds since the epoch (0 if unknown)."""
+        for ident in (self.committer, self.author):
+            parts = ident.split(" ")
+            if len(parts) >= 2 and parts[-2].isdigit():
+                return int(parts[-2])
+        return 0
+
     @staticmethod
     def from_str(s: str) -> Commit:
         """Build a Commit from its str file representation."""
@@ -163,7 +293,9 @@ class Commit:
                     tree_id = ln.removeprefix("tree ").strip()
                 elif ln.startswith("author "):
                     author = ln.removeprefix("author ").strip()
-                elif ln.startswith("commiter "):
+                elif ln.startswith("committer "):
+                    committer = ln.removeprefix("committer ").strip()
+                elif ln.startswith("commiter "):  # Written by old versions
                     committer = ln.removeprefix("commiter ").strip()
                 else:
                     comment_started = True
@@ -194,18 +326,21 @@ class Commit:
     def from_hash(hsh: str, db: PObjectDB) -> Optional[Commit]:
         """Read a Commit from the db from its hash."""
         try:
-            c = db.get(hsh)
+            key = db.get_full_key(hsh)
+            return _parsed(db, key, "commit", lambda ob: Commit._from_object(key, ob))
         except:
             return None
-        cs = c.text
-        ret = Commit.from_str(cs)
-        ret.id = hsh
+
+    @staticmethod
+    def _from_object(key: str, ob: DBObject) -> Commit:
+        ret = Commit.from_str(ob.text)
+        ret.id = key
         return ret
 
     @staticmethod
     def from_branch(root: str, branch: str, db: PObjectDB) -> Optional[Commit]:
         """Read a Commit from the db from the head of the branch."""
-        commit = _branch_head(root, branch)
+        commit = branch_head(root, branch)
         if commit is None:
             return None
         return Commit.from_hash(commit, db)
@@ -276,224 +411,314 @@ def _status(index: PIndex, db: PObjectDB, root: str) -> RepoStatus:
         raise FileNotFoundError("Not in a repository")
     stag_dict: DirDict = index.dirtree()
     dirs = list(stag_dict.keys())
-    work_dict: DirDict = _build_working_dict(dirs, _read_ignore(root))
-    head_dict: DirDict = _build_head_dict(db, root)
+    work_dict: DirDict = _build_working_dict(root, dirs, read_ignore(root))
+
+    b, h = branch_current(root)
+    ret = RepoStatus(b, h[:7] if b is None else "", [], [], [])
+
+    tracked_dirs = _tracked_dirs(stag_dict)
+    for f in work_dict.all_file_names():
+        if f not in tracked_dirs and not stag_dict.contains_file(f):
+            ret.not_tracked.append(FileWithStatus(f or ".", None))
+    # Only the subtrees which differ from HEAD are read
+    index_tree, trees = _index_trees(stag_dict)
+    for c in diff_trees(_tree_reader(db, trees), _head_tree(db, root), index_tree):
+        if c.status != FileStatus.DELETED:
+            ret.staged.append(FileWithStatus(c.path, c.status))
+        elif not work_dict.contains_file(c.path):
+            ret.not_staged.append(FileWithStatus(c.path, FileStatus.DELETED))
+    for f in sorted(_modified_in_worktree(stag_dict, db, root)):
+        ret.not_staged.append(FileWithStatus(f, FileStatus.MODIFIED))
+    return ret
 
-    staged: List[FileWithStatus] = []
-    not_staged: List[FileWithStatus] = []
-    not_tracked: List[FileWithStatus] = []
 
-    b, h = _branch_current(root)
-    ret = RepoStatus(b, h[:7] if b is None else "", staged, not_staged, not_tracked)
+def _tracked_dirs(stag_dict: DirDict) -> Set[str]:
+    """Return the dirs with tracked files, including their parents."""
+    ret: Set[str] = set()
+    for d in stag_dict.keys():
+        while d and d not in ret:
+            ret.add(d)
+            d = os.path.dirname(d)
+    return ret
 
-    all_files = []
-    all_files.extend(stag_dict.all_file_names())
-    all_files.extend(work_dict.all_file_names())
-    all_files.extend(head_dict.all_file_names())
 
-    set_all_files = set(all_files)
-    for f in set_all_files:
-        ret = _add_file_to_repostatus(
-            FilePath(f), ret, stag_dict, work_dict, head_dict, db
-        )
+def _modified_in_worktree(dd: DirDict, db: PObjectDB, root: str) -> Set[FileName]:
+    """Return the names of the files in dd modified in the working tree.
+
+    If the filesystem monitor is running, only the files it reports as
+    changed are checked.
+    """
+    files = [e for es in dd.values() for e in es if e.etype == "f"]
+    monitor = fsmonitor.query(root)
+    if monitor is not None:
+        files = [e for e in files if monitor.may_have_changed(e.ename)]
+    ret = {e.ename for e in changed_entries(files, db, root)}
+    if monitor is not None:
+        monitor.save(ret)
     return ret
 
 
-def _add_file_to_repostatus(
-    f: FilePath,
-    rs: RepoStatus,
-    stag_dict: DirDict,
-    work_dict: DirDict,
-    head_dict: DirDict,
-    db: PObjectDB,
-) -> RepoStatus:
-    if f == "":
-        f = FilePath(".")
-    if not stag_dict.contains_file(f):
-        if work_dict.contains_file(f):
-            rs.not_tracked.append(FileWithStatus(f, None))
-            return rs  # We are done
-        if head_dict.contains_file(f):
-            rs.not_staged.append(FileWithStatus(f, FileStatus.DELETED))
-            return rs  # We are done
-    if _file_is_modified_in_staging_tree(f, stag_dict, head_dict):
-        if not head_dict.contains_file(f):
-            rs.staged.append(FileWithStatus(f, FileStatus.NEW))
-        else:
-            rs.staged.append(FileWithStatus(f, FileStatus.MODIFIED))
-    if _file_is_modified_in_working_tree(f, stag_dict, db):
-        rs.not_staged.append(FileWithStatus(f, FileStatus.MODIFIED))
-    return rs
+def _head_tree(db: PObjectDB, root: str) -> Optional[str]:
+    """Return the key of the tree of the current HEAD, if any."""
+    _, key = branch_current(root)
+    commit = Commit.from_hash(key, db) if key else None
+    return commit.tree_id if commit is not None else None
 
 
-def _file_is_modified_in_working_tree(
-    f: FilePath, stag_dict: DirDict, db: PObjectDB
-) -> bool:
-    """Return True is f is modified in the working tree, with respect to the index."""
-    if f == "" or os.path.isdir(f):
-        return False
-    try:
-        with open(f.file_name, "rb") as ff:
-            bb = ff.read()
-            k1 = db.calculate_key(bb)
-            if f.dir is None:  # FIXME: cleanup the usage of "" vs "." vs None
-                d = ""
-            else:
-                d = f.dir
-            st = stag_dict[d]
-            fss = [ff for ff in st if ff.ename == f]
-            if len(fss) == 0:
-                return False
-            return fss[0].ehash != k1
-    except Exception:
-        return False
+def _index_trees(dd: DirDict) -> Tuple[str, Dict[str, List[TreeItem]]]:
+    """Return the key the tree of the index (dd) would have, and its trees by key."""
+    files = ((e.ename, e.ehash) for es in dd.values() for e in es if e.etype == "f")
+    return build_trees(files, lambda ob: object_key(ob, DBObjectType.TREE))
 
 
-def _file_is_modified_in_staging_tree(
-    f: FilePath, stag_dict: DirDict, head_dict: DirDict
-) -> bool:
-    """Return True is f is modified in the staging tree, with respect to HEAD."""
-    if f == "" or os.path.isdir(f):
-        return False
-    fes = _get_file_entry_from_dirdict(f, stag_dict)
-    feh = _get_file_entry_from_dirdict(f, head_dict)
-    fesh = fes.ehash if fes else ""
-    fehh = feh.ehash if feh else ""
-    if fesh == fehh:
-        return False
-    else:
-        return True
+def _tree_reader(
+    db: PObjectDB, trees: Optional[Dict[str, List[TreeItem]]] = None
+) -> TreeReader:
+    """Return a reader of the trees in db or, first, in trees (not written to the db)."""
 
+    def read(key: str) -> List[TreeItem]:
+        if trees is not None and key in trees:
+            return trees[key]
+        return sorted((e.name, e.type, e.hash) for e in _read_tree(db, key).entries)
 
-def _get_file_entry_from_dirdict(f: FilePath, di: DirDict) -> Optional[DirEntry]:
-    d: str = f.dir
-    fs: List[DirEntry] = di[d] if d in di.keys() else []
-    fe = [ff for ff in fs if ff.ename == f]
-    if len(fe) > 0:
-        return fe[0]
-    else:
-        return None
+    return read
 
 
-def _build_head_dict(db: PObjectDB, root: str) -> DirDict:
-    """Build the DirDict for the current HEAD, from the DB."""
-    _, key = _branch_current(root)
-    if key is None or key == "":
-        return DirDict()
-    commit = Commit.from_hash(key, db)
-    if commit is None:
-        return DirDict()
-    key = commit.tree_id
-    return _add_tree_entries("", key, db, DirDict())
+def _read_tree(db: PObjectDB, key: str) -> Tree:
+    """Read (and parse) the tree object with the given key."""
+    return _parsed(db, key, "tree", lambda ob: Tree.from_str(ob.text))
 
 
-def _add_tree_entries(d: DirName, key: str, db: PObjectDB, ret: DirDict) -> DirDict:
-    """Recursively add the tree entries for the tree of hash key to the DirDict.
-
-    The passed DirDict is modified in place, even if it's also returned, for convenience.
-    """
-    t = db.get(key)
-    if t is None:
-        return ret
-    tree = Tree.from_str(t.text)
-    ret[d] = []
-    for en in tree.entries:
-        if en.type == "d":
-            dd = d + "/" if d != "" else ""
-            _add_tree_entries(dd + en.name, en.hash, db, ret)
-        else:
-            ret[d].append(DirEntry(en.name, en.type, en.hash))
-    return ret
+def _parsed(db: PObjectDB, key: str, kind: str, parse: Callable[[DBObject], T]) -> T:
+    """Return the parsed object with the given key, cached if the db allows it."""
+    if isinstance(db, CachedDB):
+        return db.parsed(key, kind, parse)
+    return parse(db.get(key))
 
 
 def _build_working_dict(
-    dirs: List[DirName], ignorefn: Callable[[str], bool] = lambda _: False
+    root: str, dirs: List[DirName], ignore: IgnoreMatcher
 ) -> DirDict:
-    """Build the DirDict for the working dir, only taking into account entries in 'dirs'."""
+    """Build the DirDict for the working dir, only taking into account entries in 'dirs'.
+
+    Listings of unchanged directories are read from the untracked cache.
+    """
     ret = DirDict()
-    for d in dirs + [""]:
-        if d == "":
-            dd = "."
-        else:
-            dd = d
-        files = os.listdir(dd)
-        for f in files:
-            if ignorefn(f):
-                continue
-            if os.path.isdir(f):
-                typ = "d"
-            else:
-                typ = "f"
-            if d not in ret:
-                ret[d] = []
+    dirs = list(dict.fromkeys(dirs + [""]))
+    for d, entries in list_dirs(root, dirs, ignore, ignore.signature(dirs)).items():
+        for f, typ in entries:
             a = f
             if d != "":
                 a = d + "/" + a
-            ret[d].append(DirEntry(a, typ, ""))
+            ret.add_entry(d, DirEntry(a, typ, ""))
     return ret
 
 
-def _read_db_tree(db: PObjectDB, key: str, acc: Optional[DirDict] = None) -> DirDict:
-    """Read a tree object from the DB, recursively building the associated DirDict."""
-    if acc is None:
-        acc = DirDict()
-    linesr = db.get(key)
-    if linesr is None:
-        raise Exception(f"Object not found: '{key}'")
-    lines = linesr.text.splitlines()
-    for ln in lines:
-        en = DirEntry(ln[43:], ln[0:40], ln[41])
-        enp = FilePath(en.ename)
-        if en.etype == "d":
-            _read_db_tree(db, en.ehash, acc)
-        ens = acc[enp]
-        if ens is None:
-            acc[enp] = []
-        acc[enp].append(en)
-    return acc
-
-
-def _read_ignore(root: str) -> Callable[[str], bool]:
-    vcignore = root + "/../.vcignore"
-    entries = ".vc\n"  # Never track the .vc dir
-    if os.path.exists(vcignore):
-        with open(vcignore, "r") as f:
-            entries += f.read()
-    return lambda x: _matches(entries.splitlines(), x)
-
-
-def _matches(patterns: List[str], s: str) -> bool:
-    import re
-
-    for p in patterns:
-        if re.match(f"^{p}$", s):
-            return True
-    return False
+def _iter_log(
+    db: PObjectDB,
+    root: str,
+    revisions: List[str],
+    max_count: Optional[int],
+    since: Optional[int],
+    first_parent: bool,
+    topo_order: bool,
+    paths: List[str],
+) -> Iterator[LogEntry]:
+    """Return the log entries for the revisions (see Repo.iter_log).
+
+    The revisions are resolved now, so bad ones raise before any entry.
+    """
+    include, exclude = _parse_revisions(root, db, revisions)
+    graph = CommitGraph.load(root)
+    history = History(graph, lambda key: _commit_info(db, key))
+    walk = history.walk(include, exclude, topo_order, first_parent, since)
+    if paths and "" not in paths:
+        filters = ChangedPathFilters.load(root, graph) if graph is not None else None
+        walk = _changing(db, history, graph, filters, walk, paths)
+    return _log_entries(db, walk, max_count)
 
 
-def _log(db: PObjectDB, root: str) -> List[LogEntry]:
-    """Return the log entries for the current HEAD."""
-    ret: List[LogEntry] = []
-    _, chash = _branch_current(root)
-    while chash:
-        commit = Commit.from_hash(chash, db)
+def _changing(
+    db: PObjectDB,
+    history: History,
+    graph: Optional[CommitGraph],
+    filters: Optional[ChangedPathFilters],
+    walk: Iterator[CommitNode],
+    paths: List[str],
+) -> Iterator[CommitNode]:
+    """Yield the commits of walk changing some of the paths (from the first parent).
+
+    The trees are only compared for the commits whose filters say they may
+    have changed the paths, and only along the paths.
+    """
+    hashes = [path_hashes(p) for p in paths]
+    for node in walk:
+        pos = graph.position(node.key) if graph is not None and filters is not None else None
+        if pos is not None and not any(filters.may_have_changed(pos, h) for h in hashes):
+            continue
+        parent = history.node(node.parents[0]) if node.parents else None
+        old = parent.tree if parent is not None else None
+        if next(diff_trees(_tree_reader(db), old, node.tree, paths), None) is not None:
+            yield node
+
+
+def _log_entries(
+    db: PObjectDB, walk: Iterator[CommitNode], max_count: Optional[int]
+) -> Iterator[LogEntry]:
+    if max_count is not None and max_count <= 0:
+        return
+    for i, node in enumerate(walk, 1):
+        commit = Commit.from_hash(node.key, db)
         if commit is None:
-            return ret
-        ret.append(LogEntry(chash, commit.short_comment))
-        if commit.parents and len(commit.parents) > 0:
-            chash = commit.parents[0]
+            return
+        yield LogEntry(node.key, commit.short_comment)
+        if i == max_count:
+            return
+
+
+def _parse_revisions(
+    root: str, db: PObjectDB, revisions: List[str]
+) -> Tuple[List[str], List[str]]:
+    """Return the commits to include and to exclude for the revisions."""
+    include: List[str] = []
+    exclude: List[str] = []
+    for rev in revisions:
+        if ".." in rev:
+            a, b = rev.split("..", 1)
+            exclude.append(_resolve_commit(root, db, a or "HEAD"))
+            include.append(_resolve_commit(root, db, b or "HEAD"))
+        elif rev.startswith("^"):
+            exclude.append(_resolve_commit(root, db, rev[1:]))
         else:
-            chash = None
+            include.append(_resolve_commit(root, db, rev))
+    if not include:
+        _, head = branch_current(root)
+        if head:
+            include.append(head)
+    return include, exclude
+
+
+def _history(db: PObjectDB, root: str) -> History:
+    """Return the history of the repo, using its commit-graph if there's one."""
+    return History(CommitGraph.load(root), lambda key: _commit_info(db, key))
+
+
+def _commit_info(db: PObjectDB, key: str) -> Optional[CommitInfo]:
+    commit = Commit.from_hash(key, db)
+    if commit is None:
+        return None
+    return CommitInfo(commit.id, commit.tree_id, commit.parents, commit.timestamp)
+
+
+def _resolve_commit(root: str, db: PObjectDB, rev: str) -> str:
+    """Return the full key of the commit named by rev (a branch, a key or HEAD)."""
+    if rev == "HEAD":
+        key: Optional[str] = branch_current(root)[1]
+    else:
+        key = branch_head(root, rev) if rev else None
+    if not key:
+        key = rev
+    commit = Commit.from_hash(key, db) if key else None
+    if commit is None:
+        raise Exception(f"fatal: Not a valid commit name {rev}")
+    return commit.id
+
+
+def _write_commit_graph(db: PObjectDB, root: str, changed_paths: bool) -> int:
+    """Write the commit-graph with the commits reachable from the branches.
+
+    The changed-path filters are written too if changed_paths or if they
+    already exist.
+    """
+    branches, _ = _branch_list(root)
+    pending = [branch_head(root, b) for b in branches]
+    pending.append(branch_current(root)[1])
+    infos: Dict[str, CommitInfo] = {}
+    while pending:
+        chash = pending.pop()
+        if not chash or chash in infos:
+            continue
+        info = _commit_info(db, chash)
+        if info is None:
+            continue
+        infos[chash] = info
+        pending.extend(info.parents)
+    changed_paths = changed_paths or os.path.exists(root + "/" + bloom.BLOOM_FILE)
+    ret = commitgraph.write(root, infos.values())
+    graph = CommitGraph.load(root)
+    if changed_paths and graph is not None:
+
+        def changed(key: str) -> List[str]:
+            parents = infos[key].parents
+            old = infos[parents[0]].tree if parents else None
+            return _changed_paths(db, old, infos[key].tree)
+
+        bloom.write(root, graph, changed)
+        graph.close()
+    return ret
+
+
+def _changed_paths(db: PObjectDB, old: Optional[str], new: Optional[str]) -> List[str]:
+    """Return the paths which differ between the trees (None being the empty tree).
+
+    Directories are included if something in them changed.
+    """
+    ret: Set[str] = set()
+    for c in diff_trees(_tree_reader(db), old, new):
+        p = c.path
+        while p and p not in ret:
+            ret.add(p)
+            p = os.path.dirname(p)
+    return sorted(ret)
+
+
+def _repo_path(root: str, path: str) -> str:
+    """Return path relative to the working tree ('' for the working tree itself)."""
+    worktree = os.path.abspath(worktree_path(root, ""))
+    ret = os.path.relpath(os.path.abspath(path), worktree)
+    return "" if ret == "." else ret
+
+
+def _path_hints(db: PObjectDB, root: str) -> Dict[str, str]:
+    """Map the keys of the objects reachable from the branches to their paths."""
+    ret: Dict[str, str] = {}
+    branches, _ = _branch_list(root)
+    pending = [branch_head(root, b) for b in branches]
+    pending.append(branch_current(root)[1])
+    seen: Set[str] = set()
+    while pending:
+        chash = pending.pop()
+        if not chash or chash in seen:
+            continue
+        seen.add(chash)
+        commit = Commit.from_hash(chash, db)
+        if commit is None:
+            continue
+        pending.extend(commit.parents)
+        _tree_path_hints(db, commit.tree_id, "", ret)
     return ret
 
 
+def _tree_path_hints(db: PObjectDB, key: str, path: str, acc: Dict[str, str]) -> None:
+    if key in acc:
+        return  # Already visited
+    acc[key] = path
+    tree = _read_tree(db, key)
+    for en in tree.entries:
+        if en.type == "d":
+            _tree_path_hints(db, en.hash, en.name, acc)
+        else:
+            acc.setdefault(en.hash, en.name)
+
+
 def _checkout(
     index: PIndex,
     db: PObjectDB,
     root: str,
     commit_id_or_branch: str,
     create_branch: bool,
-) -> Tuple[str, bool]:
+    workers: Optional[int] = None,
+) -> CheckoutResult:
     commit = Commit.from_hash(commit_id_or_branch, db)
     branch = None
     if commit is None:
@@ -501,14 +726,14 @@ def _checkout(
         commit = Commit.from_branch(root, branch, db)
         if commit is None and create_branch:
             _branch_create(root, branch)
-            commit = Commit.from_hash(_branch_head(root, branch) or "", db)
+            commit = Commit.from_hash(branch_head(root, branch) or "", db)
     if commit is None:
         raise Exception(
             f"error: pathspec '{commit_id_or_branch}' did not match any file(s) known to vc"
         )
     full_commit_hash = db.get_full_key(commit.id)
 
-    de = _dirty_entries_in_index(index, db)
+    de = _dirty_entries_in_index(index, db, root)
     if de:
         raise Exception(
             "error: Your local changes to the following files would be "
@@ -519,139 +744,267 @@ def _checkout(
             + "Please commit your changes or stash them before you switch branches.\n"
             + "Aborting"
         )
-    commit_dict = _add_tree_entries(root, commit.tree_id, db, DirDict())
-    for _, fs in commit_dict.items():
-        for f in fs:
-            if not f.etype == "f":
-                continue
-            contents = db.get(f.ehash).contents
-            with open(f.ename, "wb") as ff:
-                ff.write(contents)
+    stag_dict = index.dirtree()
+    # Only what differs between HEAD and the commit changes. The index entries
+    # of other files are kept, with what was staged for them.
+    changes = list(diff_trees(_tree_reader(db), _head_tree(db, root), commit.tree_id))
+    staged = [
+        c.path
+        for c in changes
+        if _staged_key(stag_dict, c.path) not in (c.old_key, c.new_key)
+    ]
+    if staged:
+        raise Exception(
+            "error: Your local changes to the following files would be "
+            + "overwritten by checkout:\n"
+            + "       "
+            + ", ".join(staged)
+            + "\n"
+            + "Please commit your changes or stash them before you switch branches.\n"
+            + "Aborting"
+        )
+    removed = {c.path for c in changes if c.status == FileStatus.DELETED}
+    in_the_way = [
+        c.path
+        for c in changes
+        if c.status == FileStatus.NEW and _in_the_way(root, c.path, stag_dict, removed)
+    ]
+    if in_the_way:
+        raise Exception(
+            "error: The following untracked working tree files would be "
+            + "overwritten by checkout:\n"
+            + "       "
+            + ", ".join(in_the_way)
+            + "\n"
+            + "Please move or remove them before you switch branches.\n"
+            + "Aborting"
+        )
+    ret = CheckoutResult(commit.short_comment, branch is None)
+    for f in sorted(removed):  # First, as a deleted dir may become a file
+        remove_worktree_file(root, f)
+        ret.files_removed += 1
+    for d, es in list(stag_dict.items()):
+        if any(e.ename in removed for e in es):
+            stag_dict[d] = [e for e in es if e.ename not in removed]
+    files = [(c.path, c.new_key) for c in changes if c.new_key is not None]
+    for (path, key), (stat, size) in zip(files, write_files(db, root, files, workers)):
+        ret.files_written += 1
+        ret.bytes_written += size
+        entry = stag_dict.find_entry(path)
+        if entry is not None:
+            entry.ehash, entry.estat = key, stat
+        else:
+            stag_dict.add_entry(os.path.dirname(path), DirEntry(path, "f", key, stat))
     if branch is None:  # FIXME: refactor. This is a hack. branch
         head_write(root, full_commit_hash)
     else:
-        head_write(root, "refs/heads/" + branch)
-    index.set_to_dirtree(commit_dict)
-    return (commit.comment.splitlines()[0], branch is None)
-
-
-def _dirty_entries_in_index(index: PIndex, db: PObjectDB) -> List[FileName]:
-    """Return the list of entries which are 'dirty' (different than in work dir)."""
-    ret: List[FileName] = []
-    tree = index.dirtree()
-    for d in tree.keys():
-        for f in tree[d]:
-            if _is_dirty_in_index(f, db):
-                ret.append(f.ename)
+        head_write(root, HEADS + branch)
+    if changes:
+        index.set_to_dirtree(stag_dict)
     return ret
 
 
-def _is_dirty_in_index(f: DirEntry, db: PObjectDB) -> bool:
-    with open(f.ename, "rb") as ff:
-        hsh = db.calculate_key(ff.read())
-    if f.ehash == hsh:
-        return False
-    else:
-        return True
+def _staged_key(dd: DirDict, path: str) -> Optional[str]:
+    """Return the key of path in the index (dd), or None if it isn't there."""
+    entry = dd.find_entry(path)
+    return entry.ehash if entry is not None else None
 
 
-def _branch_current(root: str) -> Tuple[Optional[str], str]:
-    """Return the name and commit id of the current branch.
+def _in_the_way(root: str, path: str, dd: DirDict, removed: Set[str]) -> bool:
+    """Return True if checking out the new file path would overwrite something.
 
-    name can be None if head is detached.
+    That's anything at path not in the index (dd), unless it's a dir with
+    only files which are removed by the checkout, as they are removed first.
     """
-    headc = head_read(root)
-    if headc[:5] == "refs/":
-        rh = "refs/heads/"
-        branch = rh + headc[len(rh) :]
-        branch = headc[len(rh) :]
-
-        headc = read_file(root, rh + branch)
-        return (branch, headc)
-    else:
-        return (None, headc)
+    full = worktree_path(root, path)
+    if not os.path.lexists(full) or dd.find_entry(path) is not None:
+        return False
+    if os.path.islink(full) or not os.path.isdir(full):
+        return True
+    for top, _, files in os.walk(full):
+        rel = path + top[len(full) :].replace(os.sep, "/")
+        if any(f"{rel}/{f}" not in removed for f in files):
+            return True
+    return not any(r.startswith(path + "/") for r in removed)
 
 
-def _branch_head(root: str, branch: str) -> Optional[str]:
-    rh = "refs/heads/" + branch
-    commit = read_file(root, rh)
-    return commit
+def _dirty_entries_in_index(
+    index: PIndex, db: PObjectDB, root: str
+) -> List[FileName]:
+    """Return the list of entries which are 'dirty' (different than in work dir)."""
+    tree = index.dirtree()
+    files = [e for es in tree.values() for e in es if e.etype == "f"]
+    return [e.ename for e in changed_entries(files, db, root)]
 
 
 def _branch_create(root: str, name: str) -> None:
-    hf = "refs/heads/" + name
-    if exists_file(root, hf):
+    if branch_head(root, name):
         raise FileExistsError(f"The branch {name} already exists")
-    _, commit_id = _branch_current(root)
-    write_file(root, hf, commit_id)
+    _, commit_id = branch_current(root)
+    write_ref(root, HEADS + name, commit_id)
 
 
 def _branch_list(root: str) -> Tuple[List[str], Optional[str]]:
-    branches = list_files(root, "refs/heads")
-    curr, _ = _branch_current(root)
+    branches = list_refs(root)
+    curr, _ = branch_current(root)
     return (branches, curr)
 
 
 def _branch_delete(root: str, branch_name: str) -> str:
-    if _branch_head(root, branch_name) == "":
+    h = branch_head(root, branch_name)
+    if h == "":
         raise FileNotFoundError(f"error: refname refs/heads/{branch_name} not found")
 
-    b, _ = _branch_current(root)
+    b, _ = branch_current(root)
     if b == branch_name:
         raise FileExistsError(
             f"error: Cannot delete branch '{b}' checked out at '{root}'"
         )
 
-    h = _branch_head(root, branch_name)
-    remove_file(root, "refs/heads/" + branch_name)
-    return h[:7] if h else ""
+    delete_ref(root, HEADS + branch_name)
+    return h[:7]
 
 
 def _branch_rename(root: str, branch_name: str, branch_new_name):
-    if _branch_head(root, branch_name) == "":
+    h = branch_head(root, branch_name)
+    if h == "":
         raise FileNotFoundError(f"error: refname refs/heads/{branch_name} not found")
 
-    if _branch_head(root, branch_new_name) != "":
+    if branch_head(root, branch_new_name) != "":
         raise FileExistsError(
             f"fatal: a branch named '{branch_new_name}' already exists"
         )
 
-    rename_file(root, "refs/heads/" + branch_name, "refs/heads/" + branch_new_name)
+    write_ref(root, HEADS + branch_new_name, h)
+    delete_ref(root, HEADS + branch_name)
+    if branch_current(root)[0] == branch_name:
+        head_write(root, HEADS + branch_new_name)
 
 
-def _diff(root: str, db: PObjectDB, index: PIndex, files: List[str]) -> List[str]:
-    # FIXME: almost all this code is copied from _status -> refactor
+def _iter_diff(
+    root: str,
+    db: PObjectDB,
+    index: PIndex,
+    files: List[str],
+    revisions: List[str],
+    cached: bool,
+    context: int = 3,
+    algorithm: str = "myers",
+) -> Iterator[str]:
+    """Check the arguments and return a generator of the diff of each changed file."""
     if root is None or root.strip() == "":
         raise FileNotFoundError("Not in a repository")
+    if len(revisions) > 2 or (cached and len(revisions) > 1):
+        raise Exception("usage: vc diff [--cached] [<commit> [<commit>]] [--] [<path>...]")
+    trees = [_commit_tree(db, _resolve_commit(root, db, r)) for r in revisions]
+    diffs = _diff_entries(root, db, index, files, trees, cached, context, algorithm)
+    return (d for d in diffs if d)
+
+
+def _diff_entries(
+    root: str,
+    db: PObjectDB,
+    index: PIndex,
+    files: List[str],
+    trees: List[str],
+    cached: bool,
+    context: int,
+    algorithm: str,
+) -> Iterator[str]:
+    paths = [_repo_path(root, f) for f in files] if files else None
+    if len(trees) == 2:
+        for c in diff_trees(_tree_reader(db), trees[0], trees[1], paths):
+            yield _diff_blobs(db, c, context, algorithm)
+        return
     stag_dict: DirDict = index.dirtree()
-    dirs = list(stag_dict.keys())
-    work_dict: DirDict = _build_working_dict(dirs, _read_ignore(root))
-    head_dict: DirDict = _build_head_dict(db, root)
+    if cached or trees:
+        index_tree, virtual = _index_trees(stag_dict)
+        old = trees[0] if trees else _head_tree(db, root)
+        changes = diff_trees(_tree_reader(db, virtual), old, index_tree, paths)
+        if cached:
+            for c in changes:
+                yield _diff_blobs(db, c, context, algorithm)
+            return
+        # From the commit to the working tree: the files changed in the index or after it
+        old_keys = {c.path: c.old_key for c in changes}
+        modified = _modified_in_worktree(stag_dict, db, root)
+        for f in sorted(old_keys.keys() | modified):
+            if paths and not any(f == p or f.startswith(p + "/") for p in paths):
+                continue
+            if f in old_keys:
+                key = old_keys[f]
+            else:
+                key = stag_dict.find_entry(f).ehash  # type: ignore
+            yield _diff_worktree(db, root, f, key, context, algorithm)
+        return
 
+    dirs = list(stag_dict.keys())
+    work_dict: DirDict = _build_working_dict(root, dirs, read_ignore(root))
     all_files = []
     all_files.extend(stag_dict.all_file_names())
     all_files.extend(work_dict.all_file_names())
-    all_files.extend(head_dict.all_file_names())
 
-    set_all_files = set(all_files)
+    set_all_files = set(all_files) - _tracked_dirs(stag_dict)
     if len(files) > 0:
         set_all_files = set_all_files.intersection(files)
-    ret = []
-    for f in set_all_files:
-        ret.append(_diff_file(db, root, stag_dict, f))
-    return ret
+    modified = _modified_in_worktree(stag_dict, db, root)
+    for f in sorted(set_all_files):
+        if stag_dict.contains_file(f) and f not in modified:
+            continue  # Unchanged: no need to read it
+        fst = stag_dict.find_entry(f)
+        yield _diff_worktree(db, root, f, fst.ehash if fst else None, context, algorithm)
 
 
-def _diff_file(db: PObjectDB, root: str, stag_dict: DirDict, file: str) -> str:
-    fwdc = ""
-    with open(root + "/../" + file, "r") as f:
-        fwdc = f.read()
-    fst = stag_dict.find_entry(file)
-    fstc = ""
-    if fst is not None:
-        fstc = db.get(fst.ehash).text  # FIXME: support binary files
-    return "".join(
-        difflib.context_diff(
-            fstc.splitlines(True), fwdc.splitlines(True), fromfile=file, tofile=file
-        )
-    )
+def _commit_tree(db: PObjectDB, key: str) -> str:
+    commit = Commit.from_hash(key, db)
+    if commit is None:
+        raise Exception(f"fatal: Not a valid commit name {key}")
+    return commit.tree_id
+
+
+def _diff_blobs(db: PObjectDB, c: TreeChange, context: int, algorithm: str) -> str:
+    old, new = _blob_data(db, c.old_key), _blob_data(db, c.new_key)
+    return _diff_data(c.path, old, new, context, algorithm)
+
+
+def _diff_worktree(
+    db: PObjectDB, root: str, file: str, key: Optional[str], context: int, algorithm: str
+) -> str:
+    """Return the diff from the blob with key ('' if None) to file in the working tree.
+
+    The start of the file is sniffed first: if it's binary, the rest is
+    hashed in chunks to tell whether they differ, and the blob isn't read.
+    """
+    try:
+        with open(worktree_path(root, file), "rb") as f:
+            head = f.read(BINARY_SNIFF)
+            old = b"" if is_binary(head) else _blob_data(db, key)
+            if is_binary(head) or is_binary(old):
+                f.seek(0)
+                size = os.fstat(f.fileno()).st_size
+                if key and db.calculate_key_stream(f, size) == key:
+                    return ""
+                return _binary_diff(file)
+            new = head + f.read()
+    except FileNotFoundError:  # Deleted
+        old, new = _blob_data(db, key), b""
+    return _diff_data(file, old, new, context, algorithm)
+
+
+def _blob_data(db: PObjectDB, key: Optional[str]) -> bytes:
+    """Return the contents of the blob with key (empty if None)."""
+    return db.get(key).contents if key else b""
+
+
+def _diff_data(file: str, old: bytes, new: bytes, context: int, algorithm: str) -> str:
+    if old == new:
+        return ""
+    if is_binary(old) or is_binary(new):
+        return _binary_diff(file)
+    a = old.decode("UTF-8", errors="replace")
+    b = new.decode("UTF-8", errors="replace")
+    return "".join(unified_diff(a, b, file, file, context, algorithm))
+
+
+def _binary_diff(file: str) -> str:
+    return f"Binary files {file} and {file} differ\n"
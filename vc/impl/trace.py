@@ -0,0 +1,81 @@
+"""Counting of the file system calls made by vc, for debugging.
+
+'VC_TRACE=1 vc <command>' prints to stderr how many calls of each kind
+the command made. The functions of 'os' (and 'open') which make system
+calls are wrapped while counting, so calls made through os.path and
+shutil are counted too.
+"""
+
+import builtins
+import os
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+TRACE_ENV = "VC_TRACE"
+TRACED = (
+    "stat",
+    "lstat",
+    "open",
+    "listdir",
+    "scandir",
+    "mkdir",
+    "rmdir",
+    "remove",
+    "rename",
+    "replace",
+    "getcwd",
+)
+
+_lock = threading.Lock()
+
+
+class SyscallCounts(Counter):
+    """Counts of the calls by name, along with the paths they were called with."""
+
+    calls: List[Tuple[str, str]]
+
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    def paths(self, name: str) -> List[str]:
+        """Return the paths of the calls to name, in order."""
+        return [p for n, p in self.calls if n == name]
+
+    def summary(self) -> str:
+        """Return the counts as 'name=count' pairs, sorted by name."""
+        return " ".join(f"{n}={c}" for n, c in sorted(self.items()))
+
+
+@contextmanager
+def count_syscalls() -> Iterator[SyscallCounts]:
+    """Count the file system calls made inside the context (not reentrant)."""
+    counts = SyscallCounts()
+    originals: Dict[str, Callable[..., Any]] = {n: getattr(os, n) for n in TRACED}
+    original_open = builtins.open
+
+    def counted(name: str, fn: Callable[..., Any]) -> Callable[..., Any]:
+        def call(*args, **kwargs):
+            with _lock:
+                counts[name] += 1
+                counts.calls.append((name, str(args[0]) if args else ""))
+            return fn(*args, **kwargs)
+
+        return call
+
+    for name, fn in originals.items():
+        setattr(os, name, counted(name, fn))
+    builtins.open = counted("open", original_open)
+    try:
+        yield counts
+    finally:
+        for name, fn in originals.items():
+            setattr(os, name, fn)
+        builtins.open = original_open
+
+
+def tracing() -> bool:
+    """Return True if the calls are to be traced (VC_TRACE is set)."""
+    return os.environ.get(TRACE_ENV, "") not in ("", "0")
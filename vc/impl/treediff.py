@@ -0,0 +1,133 @@
+"""Diff between trees, walking them in lockstep.
+
+Both trees are read level by level, their entries merged by path (tree
+objects keep them sorted). Entries with the same key in both trees are
+skipped, directories included, without reading their subtrees: the cost
+of a diff depends on what changed, not on the size of the trees.
+
+Trees are read through a TreeReader, so trees not in the db can take
+part: 'build_trees' computes the trees for a list of files (the index, for
+instance) with the keys they would have if they were written.
+"""
+
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from ..api import FileStatus
+
+TreeItem = Tuple[str, str, str]  # Full path, type ("f" or "d") and key of an entry
+TreeReader = Callable[[str], List[TreeItem]]  # Items of a tree, sorted by path
+
+
+@dataclass
+class TreeChange:
+    """A file which differs between two trees.
+
+    old_key is None for new files, and new_key for deleted ones.
+    """
+
+    path: str
+    status: FileStatus
+    old_key: Optional[str]
+    new_key: Optional[str]
+
+
+def diff_trees(
+    read: TreeReader,
+    old: Optional[str],
+    new: Optional[str],
+    paths: Optional[List[str]] = None,
+) -> Iterator[TreeChange]:
+    """Yield the changes from the tree old to new (None is the empty tree), by path.
+
+    With paths, only the files in them (files or directories) are compared.
+    """
+    if old == new:
+        return
+    olds = read(old) if old else []
+    news = read(new) if new else []
+    i = j = 0
+    while i < len(olds) or j < len(news):
+        x: Optional[TreeItem] = olds[i] if i < len(olds) else None
+        y: Optional[TreeItem] = news[j] if j < len(news) else None
+        if x is not None and (y is None or x[0] < y[0]):
+            y = None
+            i += 1
+        elif y is not None and (x is None or y[0] < x[0]):
+            x = None
+            j += 1
+        else:
+            i += 1
+            j += 1
+            if x == y:
+                continue
+        fx = x[2] if x is not None and x[1] != "d" else None
+        fy = y[2] if y is not None and y[1] != "d" else None
+        dx = x[2] if x is not None and x[1] == "d" else None
+        dy = y[2] if y is not None and y[1] == "d" else None
+        name = x[0] if x is not None else y[0]  # type: ignore
+        if (fx or fy) and (paths is None or _in_paths(name, paths)):
+            yield _change(name, fx, fy)
+        if (dx or dy) and (paths is None or _in_paths(name, paths, True)):
+            yield from diff_trees(read, dx, dy, paths)
+
+
+def build_trees(
+    files: Iterable[Tuple[str, str]], store: Callable[[str], str]
+) -> Tuple[str, Dict[str, List[TreeItem]]]:
+    """Build the trees for the files (pairs of path and key).
+
+    store gets the contents of each tree object, from the deepest ones up,
+    and returns its key (writing it or just calculating it). Return the key
+    of the root tree and the items of every tree, by key.
+    """
+    dirs: Dict[str, List[TreeItem]] = {"": []}
+    for path, key in files:
+        d = _dirname(path)
+        if d not in dirs:
+            # Add the missing parent dirs, up to one which exists
+            p = d
+            while p not in dirs:
+                dirs[p] = []
+                p = _dirname(p)
+        dirs[d].append((path, "f", key))
+    for d in dirs:
+        if d:
+            dirs[_dirname(d)].append((d, "d", ""))
+    trees: Dict[str, List[TreeItem]] = {}
+    keys: Dict[str, str] = {}
+    for d in sorted(dirs, key=lambda d: -d.count("/") if d else 1):
+        items = sorted((n, t, keys[n] if t == "d" else k) for n, t, k in dirs[d])
+        keys[d] = store(tree_object(items))
+        trees[keys[d]] = items
+    return keys[""], trees
+
+
+def tree_object(items: List[TreeItem]) -> str:
+    """Return the contents of the tree object for items (sorted by path)."""
+    return "".join(f"{t} {k} {n}\n" for n, t, k in items)
+
+
+def _change(path: str, old: Optional[str], new: Optional[str]) -> TreeChange:
+    if old is None:
+        return TreeChange(path, FileStatus.NEW, None, new)
+    if new is None:
+        return TreeChange(path, FileStatus.DELETED, old, None)
+    return TreeChange(path, FileStatus.MODIFIED, old, new)
+
+
+def _in_paths(name: str, paths: List[str], is_dir: bool = False) -> bool:
+    """Return True if name is in one of the paths ('' is everything).
+
+    Directories containing one of the paths are in them too, with is_dir.
+    """
+    for p in paths:
+        if p == "" or name == p or name.startswith(p + "/"):
+            return True
+        if is_dir and p.startswith(name + "/"):
+            return True
+    return False
+
+
+def _dirname(path: str) -> str:
+    i = path.rfind("/")
+    return path[:i] if i >= 0 else ""
@@ -0,0 +1,122 @@
+"""On-disk cache of the (not ignored) contents of the working tree directories.
+
+Listing a directory and filtering its entries with the ignore rules is only
+needed when the directory changed: adding, removing or renaming an entry
+updates its mtime. The cache, in '.vc/untracked', records for each directory
+listed its mtime and its entries, so unchanged directories are not read again.
+
+The file starts with a header line with the version and the signature of the
+ignore rules the entries were filtered with (the whole cache is dropped when
+they change), followed by one line per directory: its mtime, its name and
+its entries, each one prefixed by its type, separated by NUL characters.
+
+As for the index, directories modified in the same instant the cache was
+written are not trusted, as they could have changed again without their
+mtime changing.
+"""
+
+import os
+from typing import Callable, Dict, List, Tuple
+from ..api import DirName, FileName, FileType
+from .fs import worktree_path
+from .lockfile import LockError, write_locked
+
+CACHE_FILE = "untracked"
+CACHE_VERSION = 1
+
+Listing = List[Tuple[FileName, FileType]]
+
+
+class UntrackedCache:
+    """Listings of the working tree directories, persisted between runs."""
+
+    root: str
+    signature: str
+
+    def __init__(self, root: str, signature: str):
+        """Load the cache of the repo at root, if made with the same signature."""
+        self.root = root
+        self.signature = signature
+        self._entries: Dict[DirName, Tuple[int, Listing]] = {}
+        self._cache_mtime_ns = 0
+        self._dirty = False
+        self._load()
+
+    def listing(self, d: DirName, ignored: Callable[[str, bool], bool]) -> Listing:
+        """Return the (name, type) of the entries in d not ignored.
+
+        Returns an empty list if d doesn't exist (or is not a directory).
+        """
+        path = worktree_path(self.root, d)
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except (FileNotFoundError, NotADirectoryError):
+            return []
+        cached = self._entries.get(d)
+        if cached is not None and cached[0] == mtime_ns:
+            if mtime_ns < self._cache_mtime_ns:
+                return cached[1]
+        try:
+            ret = _list_dir(path, d, ignored)
+        except (FileNotFoundError, NotADirectoryError):
+            return []
+        self._entries[d] = (mtime_ns, ret)
+        self._dirty = True
+        return ret
+
+    def save(self) -> None:
+        """Write the cache, if it changed since it was loaded."""
+        if not self._dirty:
+            return
+        lines = [f"{CACHE_VERSION} {self.signature}"]
+        for d, (mtime_ns, entries) in sorted(self._entries.items()):
+            fields = [str(mtime_ns), d] + [t + n for n, t in entries]
+            if any("\n" in f or "\0" in f for f in fields[1:]):
+                continue  # Can't be represented, will be listed every time
+            lines.append("\0".join(fields))
+        path = self.root + "/" + CACHE_FILE
+        try:  # Not waiting if another process is writing it
+            write_locked(path, ("\n".join(lines) + "\n").encode(), timeout=0)
+        except (OSError, LockError):
+            return  # Only a cache: the next run will list the dirs again
+        self._dirty = False
+
+    def _load(self) -> None:
+        path = self.root + "/" + CACHE_FILE
+        try:
+            with open(path, "r") as f:
+                header = f.readline().rstrip("\n")
+                if header != f"{CACHE_VERSION} {self.signature}":
+                    return
+                self._cache_mtime_ns = os.fstat(f.fileno()).st_mtime_ns
+                for line in f:
+                    fields = line.rstrip("\n").split("\0")
+                    entries = [(e[1:], FileType(e[0])) for e in fields[2:]]
+                    self._entries[fields[1]] = (int(fields[0]), entries)
+        except (FileNotFoundError, ValueError, IndexError):
+            self._entries = {}
+
+
+def list_dirs(
+    root: str, dirs: List[DirName], ignored: Callable[[str, bool], bool], signature: str
+) -> Dict[DirName, Listing]:
+    """Return the listings of the dirs of the working tree, using the cache.
+
+    signature identifies the ignore rules applying to the dirs.
+    """
+    cache = UntrackedCache(root, signature)
+    ret = {d: cache.listing(d, ignored) for d in dirs}
+    cache.save()
+    return ret
+
+
+def _list_dir(path: str, d: DirName, ignored: Callable[[str, bool], bool]) -> Listing:
+    ret: Listing = []
+    prefix = d + "/" if d else ""
+    with os.scandir(path) as it:
+        for en in it:
+            is_dir = en.is_dir(follow_symlinks=False)
+            if ignored(prefix + en.name, is_dir):
+                continue
+            ret.append((FileName(en.name), FileType("d" if is_dir else "f")))
+    return ret